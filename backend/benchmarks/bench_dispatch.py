@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark: dispatching 1k ready orders to 500 available agents
+قياس توزيع 1000 طلب جاهز على 500 عامل توصيل متاح
+
+Seeds restaurants, ready orders and agents scattered over Nouakchott and
+times one dispatch round (load, solve, write) for the optimal and greedy
+assignment, with the SQL statements it issues and the mean pickup distance
+it achieves. For comparison it also reports the pickup distance of the
+manual flow, where each agent takes the oldest order in the available list
+whatever its distance.
+
+    python benchmarks/bench_dispatch.py [orders] [agents]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from sqlalchemy import event, update
+
+from src.main import app
+from src.models.user import db
+from src.models.customer import Customer
+from src.models.restaurant import Restaurant
+from src.models.delivery_agent import DeliveryAgent
+from src.models.order import Order
+from src.geo import haversine_matrix_km
+from src.order_dispatch import Dispatcher, DispatchLease
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+AGENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+RESTAURANTS = 200
+CITY = (18.03, 18.16, -16.04, -15.90)  # lat_min, lat_max, lng_min, lng_max
+
+
+def seed(rng):
+    db.drop_all()
+    db.create_all()
+    lat_min, lat_max, lng_min, lng_max = CITY
+    db.session.add(Customer(name='Bench', email='bench@customer.mr', phone='1', password_hash='x'))
+    db.session.add_all([Restaurant(name=f'Restaurant {i}', email=f'r{i}@restaurant.mr', address='Nouakchott',
+                                   password_hash='x', is_approved=True,
+                                   latitude=float(rng.uniform(lat_min, lat_max)),
+                                   longitude=float(rng.uniform(lng_min, lng_max)))
+                        for i in range(RESTAURANTS)])
+    db.session.add_all([DeliveryAgent(name=f'Livreur {i}', email=f'a{i}@agent.mr', phone=f'2{i}',
+                                      password_hash='x', vehicle_type='moto', is_approved=True, is_available=True,
+                                      current_latitude=float(rng.uniform(lat_min, lat_max)),
+                                      current_longitude=float(rng.uniform(lng_min, lng_max)))
+                        for i in range(AGENTS)])
+    now = datetime.utcnow()
+    db.session.add_all([Order(customer_id=1, restaurant_id=int(rng.integers(1, RESTAURANTS + 1)), status='ready',
+                              order_number=f'LVR{i:06d}', subtotal=300, total_amount=300,
+                              delivery_address='Tevragh Zeina', payment_method='cash',
+                              created_at=now - timedelta(seconds=int(rng.integers(0, 900))))
+                        for i in range(ORDERS)])
+    db.session.commit()
+
+
+def manual_pickup_km(dispatcher):
+    # Agents, in id order, each take the oldest order still in the list
+    orders, agents = dispatcher.load()
+    taken = orders[:len(agents)]
+    distance = haversine_matrix_km([agent[1] for agent in agents[:len(taken)]],
+                                   [agent[2] for agent in agents[:len(taken)]],
+                                   [order[2] for order in taken], [order[3] for order in taken])
+    return float(np.mean(np.diag(distance)))
+
+
+def main():
+    rng = np.random.default_rng(7)
+    results = []
+    with app.app_context():
+        seed(rng)
+        statements = []
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        manual_km = manual_pickup_km(Dispatcher(batch_size=1))
+        for method in ('optimal', 'greedy'):
+            db.session.execute(update(Order).values(delivery_agent_id=None))
+            DispatchLease.query.delete()
+            db.session.commit()
+            statements.clear()
+            started = time.perf_counter()
+            summary = Dispatcher(method=method, batch_size=1).run()
+            elapsed = (time.perf_counter() - started) * 1000
+            results.append((method, summary, elapsed, len(statements)))
+            assigned = db.session.query(Order.delivery_agent_id).filter(Order.delivery_agent_id.isnot(None)).all()
+            assert len(assigned) == summary['assigned'] == len({row[0] for row in assigned})
+
+    print(f'{ORDERS} ready orders, {AGENTS} available agents, {RESTAURANTS} restaurants')
+    print(f'{"method":>8} {"load ms":>8} {"solve ms":>9} {"total ms":>9} {"SQL":>4} {"assigned":>9} {"pickup km":>10}')
+    for method, summary, elapsed, sql in results:
+        print(f'{method:>8} {summary["load_ms"]:>8.1f} {summary["solve_ms"]:>9.1f} {elapsed:>9.1f} {sql:>4} '
+              f'{summary["assigned"]:>9} {summary["mean_pickup_km"]:>10.3f}')
+    print(f'{"manual":>8} {"":>8} {"":>9} {"":>9} {"":>4} {min(ORDERS, AGENTS):>9} {manual_km:>10.3f}'
+          '  (each agent takes the oldest order)')
+
+
+if __name__ == '__main__':
+    main()
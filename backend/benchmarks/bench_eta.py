@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark: learned delivery ETAs against the fixed per-status minutes
+قياس تقديرات وقت التوصيل المتعلمة مقارنة بالدقائق الثابتة لكل حالة
+
+Seeds a month of delivered orders whose preparation time depends on the
+restaurant and the hour, and whose ride time depends on the distance to the
+customer. Reports the time to refit the model, the cost of one prediction,
+and the holdout mean absolute error per status for the model and for the
+fixed ESTIMATED_TIMES.
+
+    python benchmarks/bench_eta.py [orders]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from sqlalchemy import insert
+
+from src.main import app
+from src.models.user import db
+from src.models.customer import Customer
+from src.models.restaurant import Restaurant
+from src.models.order import Order
+from src.eta import eta_predictor
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+RESTAURANTS = 100
+PREDICTIONS = 100000
+CITY = (18.03, 18.16, -16.04, -15.90)
+
+
+def seed(rng):
+    db.drop_all()
+    db.create_all()
+    lat_min, lat_max, lng_min, lng_max = CITY
+    db.session.add(Customer(name='Bench', email='bench@customer.mr', phone='1', password_hash='x'))
+    restaurants = [(float(rng.uniform(lat_min, lat_max)), float(rng.uniform(lng_min, lng_max)))
+                   for _ in range(RESTAURANTS)]
+    db.session.add_all([Restaurant(name=f'Restaurant {i}', email=f'r{i}@restaurant.mr', address='Nouakchott',
+                                   password_hash='x', is_approved=True, latitude=lat, longitude=lng)
+                        for i, (lat, lng) in enumerate(restaurants)])
+    db.session.commit()
+
+    prep_minutes = rng.uniform(10, 40, RESTAURANTS)
+    start = datetime.utcnow() - timedelta(days=29)
+    rows = []
+    for i in range(ORDERS):
+        restaurant = int(rng.integers(0, RESTAURANTS))
+        created = start + timedelta(minutes=float(rng.uniform(0, 29 * 24 * 60)))
+        dinner = 18 <= created.hour < 22
+        lat, lng = restaurants[restaurant]
+        delivery_lat, delivery_lng = lat + rng.normal(0, 0.02), lng + rng.normal(0, 0.02)
+        km = 111 * float(np.hypot(delivery_lat - lat, (delivery_lng - lng) * np.cos(np.radians(lat))))
+        confirmed = created + timedelta(minutes=float(rng.exponential(3)))
+        ready = confirmed + timedelta(minutes=float(prep_minutes[restaurant] * (1.3 if dinner else 1.0)
+                                                    + rng.normal(0, 4)))
+        picked_up = ready + timedelta(minutes=float(rng.exponential(4)))
+        delivered = picked_up + timedelta(minutes=float(3 + 3 * km + rng.normal(0, 2)))
+        rows.append({
+            'customer_id': 1, 'restaurant_id': restaurant + 1, 'order_number': f'LVR{i:08d}',
+            'status': 'delivered', 'subtotal': 300, 'total_amount': 300, 'delivery_address': 'Nouakchott',
+            'delivery_latitude': delivery_lat, 'delivery_longitude': delivery_lng, 'payment_method': 'cash',
+            'created_at': created, 'confirmed_at': confirmed, 'prepared_at': ready,
+            'picked_up_at': picked_up, 'delivered_at': max(delivered, picked_up)
+        })
+    db.session.execute(insert(Order), rows)
+    db.session.commit()
+
+
+def main():
+    with app.app_context():
+        seed(np.random.default_rng(5))
+        started = time.perf_counter()
+        statuses = eta_predictor.refresh()
+        refresh_ms = (time.perf_counter() - started) * 1000
+
+    at = datetime(2024, 1, 1, 19, 30)
+    started = time.perf_counter()
+    for i in range(PREDICTIONS):
+        eta_predictor.remaining_minutes(i % RESTAURANTS + 1, 'ready', at, 18.09, -15.97)
+    per_call_us = (time.perf_counter() - started) / PREDICTIONS * 1e6
+
+    print(f'{ORDERS} delivered orders, {RESTAURANTS} restaurants; statuses modelled: {", ".join(statuses)}')
+    print(f'refit (load, fit, holdout): {refresh_ms:.0f}ms; prediction: {per_call_us:.2f}us')
+    print(f'{"status":>10} {"holdout":>8} {"model MAE":>10} {"fixed MAE":>10}')
+    for status, result in eta_predictor.holdout.items():
+        print(f'{status:>10} {result["samples"]:>8} {result["model_mae"]:>10.2f} {result["fixed_mae"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark: streaming menu import of large CSV files
+قياس استيراد قوائم الطعام الكبيرة من ملفات CSV
+
+Writes CSV files of increasing size to a temporary directory and imports each
+into an empty restaurant on in-memory SQLite. Reports rows per second and the
+peak Python memory allocated during the import (tracemalloc, measured in a
+second run because tracing slows the import down). Peak memory should stay
+flat as the file grows: only one chunk of rows is held at a time.
+
+    python benchmarks/bench_menu_import.py [rows ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.main import app
+from src.models.user import db
+from src.models.restaurant import Restaurant, MenuItem
+from src.menu_import import import_menu
+
+SIZES = [int(arg) for arg in sys.argv[1:]] or [10000, 50000]
+CATEGORIES = ['أطباق رئيسية', 'Grillades', 'Pizzas', 'Salades', 'Desserts', 'Boissons']
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('name,price,category,description,is_vegetarian\n')
+        for i in range(rows):
+            f.write(f'Plat {i},{50 + i % 900},{CATEGORIES[i % len(CATEGORIES)]},'
+                    f'"Recette maison numéro {i}, servie chaude",{"true" if i % 3 == 0 else "false"}\n')
+
+
+def run_import(path, traced):
+    db.drop_all()
+    db.create_all()
+    restaurant = Restaurant(name='Chaîne', email='chain@example.com', address='Nouakchott',
+                            password_hash='x', is_approved=True)
+    db.session.add(restaurant)
+    db.session.commit()
+
+    if traced:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with open(path, 'rb') as upload:
+        summary = import_menu(restaurant.id, upload, 'csv')
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if traced else None
+    if traced:
+        tracemalloc.stop()
+
+    assert summary['created'] == MenuItem.query.count() and not summary['failed']
+    return elapsed, peak
+
+
+def main():
+    print(f"{'rows':>8} {'seconds':>9} {'rows/s':>9} {'peak MB':>9}")
+    with app.app_context(), tempfile.TemporaryDirectory() as directory:
+        for rows in SIZES:
+            path = os.path.join(directory, f'menu_{rows}.csv')
+            write_csv(path, rows)
+            elapsed, _ = run_import(path, traced=False)
+            _, peak = run_import(path, traced=True)
+            print(f'{rows:>8} {elapsed:>9.2f} {rows / elapsed:>9.0f} {peak / 1e6:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark: delivery agents racing to accept the same ready orders
+قياس تنافس عمال التوصيل على قبول نفس الطلبات الجاهزة
+
+Many agent threads repeatedly list the ready orders, pick one of the first
+few (so they collide, as agents looking at the same screen do) and accept it
+until none are left. The previous handler read the order, checked it was
+unassigned and then wrote it; claim_order() moves the order to picked_up
+with one UPDATE that only applies while the order is still ready and
+unassigned (no locking read, no retry), and only the winner writes its
+tracking row and notification, in the same transaction.
+Reports orders claimed per second, lost attempts and double assignments
+(orders that more than one agent was told they had won). A simulated network
+round trip per statement stands in for the remote production database.
+
+Runs against a temporary SQLite file unless DATABASE_URL is set.
+
+    python benchmarks/bench_order_claims.py [agents] [round_trip_ms]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+_db_file = os.path.join(tempfile.mkdtemp(), 'claims.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_file}?timeout=30')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import event
+
+from src.main import app
+from src.models.user import db
+from src.models.customer import Customer
+from src.models.restaurant import Restaurant
+from src.models.delivery_agent import DeliveryAgent
+from src.models.order import Order
+from src.order_dispatch import claim_order
+
+ORDERS = 400
+VISIBLE = 5
+AGENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+ROUND_TRIP_MS = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+
+def previous_accept(order_id, agent_id):
+    order = db.session.get(Order, order_id)
+    if order is None or order.delivery_agent_id is not None or order.status != 'ready':
+        db.session.rollback()
+        return False
+    order.delivery_agent_id = agent_id
+    order.status = 'picked_up'
+    db.session.commit()
+    return True
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.add(Customer(name='Bench', email='bench@customer.mr', phone='1', password_hash='x'))
+    db.session.add(Restaurant(name='Bench', email='bench@restaurant.mr', address='Nouakchott',
+                              password_hash='x', is_approved=True))
+    db.session.add_all([DeliveryAgent(name=f'Livreur {i}', email=f'a{i}@agent.mr', phone=f'2{i}',
+                                      password_hash='x', vehicle_type='moto') for i in range(AGENTS)])
+    db.session.add_all([Order(customer_id=1, restaurant_id=1, status='ready', order_number=f'LVR{i:06d}',
+                              subtotal=300, total_amount=300, delivery_address='Tevragh Zeina',
+                              payment_method='cash') for i in range(ORDERS)])
+    db.session.commit()
+
+
+def agent_loop(agent_id, accept, wins, attempts):
+    rng = random.Random(agent_id)
+    with app.app_context():
+        while True:
+            ready = [row[0] for row in db.session.query(Order.id).filter(
+                Order.status == 'ready', Order.delivery_agent_id.is_(None)
+            ).order_by(Order.id).limit(VISIBLE)]
+            db.session.rollback()
+            if not ready:
+                return
+            order_id = rng.choice(ready)
+            attempts[agent_id] += 1
+            if accept(order_id, agent_id):
+                wins.append(order_id)
+
+
+def run(accept):
+    with app.app_context():
+        seed()
+    wins = []
+    attempts = Counter()
+    threads = [threading.Thread(target=agent_loop, args=(agent_id, accept, wins, attempts))
+               for agent_id in range(1, AGENTS + 1)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        assigned = db.session.query(Order).filter(Order.delivery_agent_id.isnot(None)).count()
+    doubles = sum(1 for count in Counter(wins).values() if count > 1)
+    total_attempts = sum(attempts.values())
+    return assigned / elapsed, total_attempts - len(wins), doubles, assigned
+
+
+def main():
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _round_trip(conn, cursor, statement, *args):
+            time.sleep(ROUND_TRIP_MS / 1000)
+
+    results = [
+        ('read, check, write (previous)', run(previous_accept)),
+        ('state machine claim', run(claim_order)),
+    ]
+
+    print(f'{AGENTS} agents, {ORDERS} ready orders, first {VISIBLE} visible, '
+          f'{ROUND_TRIP_MS:g}ms simulated round trip per statement')
+    print(f'{"path":>30} {"claims/s":>9} {"lost":>6} {"double":>7} {"assigned":>9}')
+    for name, (rate, lost, doubles, assigned) in results:
+        print(f'{name:>30} {rate:>9.1f} {lost:>6} {doubles:>7} {assigned:>9}')
+
+
+if __name__ == '__main__':
+    main()
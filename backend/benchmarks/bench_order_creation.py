@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark: order creation latency, per-line ORM inserts vs the placement pipeline
+قياس زمن إنشاء الطلبات: إدراج كل سطر عبر ORM مقابل مسار تقديم الطلبات
+
+The previous path looked up item names, added the order, flushed for its id
+and added each line as its own ORM object (one INSERT per line at flush).
+place_order() prices the cart from the catalog snapshot and writes the order
+and its lines with one INSERT each. Reports p50/p99 per order and SQL
+statements per order for a 6-line cart, on in-memory SQLite and with a
+simulated network round trip per statement (the production database is
+remote).
+
+    python benchmarks/bench_order_creation.py [round_trip_ms]
+"""
+
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import event
+
+from src.main import app
+from src.models.user import db
+from src.models.customer import Customer
+from src.models.restaurant import Restaurant, MenuItem
+from src.models.order import Order, OrderItem
+from src.order_placement import place_order
+
+LINES = 6
+ROUNDS = 300
+ROUND_TRIP_MS = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+
+
+def previous_path(customer_id, restaurant_id, cart):
+    names = dict(db.session.query(MenuItem.id, MenuItem.name).filter(
+        MenuItem.id.in_([item['menu_item_id'] for item in cart])
+    ).all())
+    order = Order(
+        customer_id=customer_id, restaurant_id=restaurant_id,
+        order_number=f"LVR{datetime.now().strftime('%Y%m%d')}{str(uuid.uuid4())[:8].upper()}",
+        subtotal=0, delivery_fee=0, total_amount=0, delivery_address='Tevragh Zeina',
+        payment_method='cash', estimated_delivery_time=datetime.utcnow() + timedelta(minutes=30)
+    )
+    db.session.add(order)
+    db.session.flush()
+    for item in cart:
+        db.session.add(OrderItem(order_id=order.id, menu_item_id=item['menu_item_id'],
+                                 item_name=names.get(item['menu_item_id']), quantity=item['quantity'],
+                                 unit_price=100, total_price=100 * item['quantity']))
+    db.session.commit()
+
+
+def pipeline_path(customer_id, restaurant_id, cart):
+    place_order(customer_id, restaurant_id, cart, 'Tevragh Zeina')
+
+
+def measure(fn, statements):
+    fn()
+    db.session.remove()
+    statements.clear()
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        db.session.remove()
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99) - 1], len(statements) / ROUNDS
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        customer = Customer(name='Bench', email='bench@customer.mr', phone='1', password_hash='x')
+        restaurant = Restaurant(name='Bench', email='bench@restaurant.mr', address='Nouakchott',
+                                password_hash='x', is_approved=True)
+        db.session.add_all([customer, restaurant])
+        db.session.flush()
+        items = [MenuItem(restaurant_id=restaurant.id, name=f'Plat {i}', price=100 + i) for i in range(40)]
+        db.session.add_all(items)
+        db.session.commit()
+        customer_id, restaurant_id = customer.id, restaurant.id
+        cart = [{'menu_item_id': item.id, 'quantity': 1 + i % 3} for i, item in enumerate(items[:LINES])]
+
+        statements = []
+        latency = {'seconds': 0.0}
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _round_trip(conn, cursor, statement, *args):
+            statements.append(statement)
+            if latency['seconds']:
+                time.sleep(latency['seconds'])
+
+        results = []
+        for name, fn in (('per-line ORM inserts (previous)', previous_path),
+                         ('priced pipeline, bulk inserts', pipeline_path)):
+            latency['seconds'] = 0.0
+            local = measure(lambda: fn(customer_id, restaurant_id, cart), statements)
+            latency['seconds'] = ROUND_TRIP_MS / 1000
+            remote = measure(lambda: fn(customer_id, restaurant_id, cart), statements)
+            results.append((name, local, remote))
+        latency['seconds'] = 0.0
+
+    print(f'{LINES}-line cart, {ROUNDS} orders per run')
+    print(f'{"path":>32} {"p50 ms":>8} {"p99 ms":>8} {"p50 @RTT":>9} {"p99 @RTT":>9} {"SQL/order":>10}')
+    for name, (p50, p99, sql), (remote_p50, remote_p99, _) in results:
+        print(f'{name:>32} {p50:>8.2f} {p99:>8.2f} {remote_p50:>9.2f} {remote_p99:>9.2f} {sql:>10.2f}')
+    print(f'(@RTT: {ROUND_TRIP_MS:g}ms simulated round trip per statement)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark: a restaurant marking a batch of orders ready
+قياس تعليم مطعم لمجموعة من الطلبات كجاهزة
+
+Seeds orders in preparation and moves them to ready three ways: one at a
+time through the previous tracking service (load the order, write its
+tracking row, commit, then one committed insert per notification), one at a
+time through transition_orders, and all at once through transition_orders.
+Reports the time, SQL statements and commits for each, with a simulated
+network round trip per statement standing in for the remote production
+database, and checks that every order got its tracking row.
+
+    python benchmarks/bench_order_transitions.py [orders] [round_trip_ms]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import event
+
+from src.main import app
+from src.models.user import db
+from src.models.customer import Customer
+from src.models.restaurant import Restaurant
+from src.models.delivery_agent import DeliveryAgent
+from src.models.order import Order
+from src.notifications import send_order_notification
+from src.order_tracking import OrderTracking, OrderTrackingService
+from src.order_state import transition_orders
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+ROUND_TRIP_MS = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+
+def previous_update(order_id, new_status):
+    order = db.session.get(Order, order_id)
+    if new_status not in OrderTrackingService.STATUS_FLOW.get(order.status, []):
+        return False
+    db.session.add(OrderTracking(order_id=order_id, status=new_status, updated_by=1, updated_by_type='restaurant'))
+    order.status = new_status
+    order.prepared_at = datetime.utcnow()
+    db.session.commit()
+    for user_type in OrderTrackingService.notified_user_types(order, new_status):
+        send_order_notification(order, new_status, user_type)
+    return True
+
+
+def per_order(order_ids):
+    return sum(bool(transition_orders([order_id], 'ready', 1, 'restaurant').updated) for order_id in order_ids)
+
+
+def bulk(order_ids):
+    return len(transition_orders(order_ids, 'ready', 1, 'restaurant').updated)
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.add(Customer(name='Bench', email='bench@customer.mr', phone='1', password_hash='x'))
+    db.session.add(Restaurant(name='Bench', email='bench@restaurant.mr', address='Nouakchott',
+                              password_hash='x', is_approved=True))
+    db.session.add(DeliveryAgent(name='Livreur', email='a@agent.mr', phone='2', password_hash='x',
+                                 vehicle_type='moto'))
+    orders = [Order(customer_id=1, restaurant_id=1, status='preparing', order_number=f'LVR{i:06d}',
+                    subtotal=300, total_amount=300, delivery_address='Tevragh Zeina', payment_method='cash',
+                    delivery_agent_id=1 if i % 2 else None)
+              for i in range(ORDERS)]
+    db.session.add_all(orders)
+    db.session.commit()
+    return [order.id for order in orders]
+
+
+def main():
+    results = []
+    with app.app_context():
+        statements = []
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _round_trip(conn, cursor, statement, *args):
+            statements.append(statement)
+            time.sleep(ROUND_TRIP_MS / 1000)
+
+        commits = []
+        event.listen(db.engine, 'commit', lambda conn: commits.append(1))
+
+        for name, transition in (('previous, per order', lambda ids: sum(previous_update(i, 'ready') for i in ids)),
+                                 ('state machine, per order', per_order),
+                                 ('state machine, bulk', bulk)):
+            order_ids = seed()
+            statements.clear()
+            commits.clear()
+            started = time.perf_counter()
+            moved = transition(order_ids)
+            elapsed = (time.perf_counter() - started) * 1000
+            tracked = OrderTracking.query.filter(OrderTracking.order_id.in_(order_ids)).count()
+            results.append((name, moved, tracked, len(statements), len(commits), elapsed))
+
+    print(f'{ORDERS} orders marked ready, {ROUND_TRIP_MS:g}ms simulated round trip per statement')
+    print(f'{"path":>26} {"moved":>6} {"tracked":>8} {"SQL":>5} {"commits":>8} {"ms":>8}')
+    for name, moved, tracked, sql, commit_count, elapsed in results:
+        print(f'{name:>26} {moved:>6} {tracked:>8} {sql:>5} {commit_count:>8} {elapsed:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark: restaurant detail loading for a restaurant with 500 menu items
+قياس تحميل تفاصيل مطعم يحتوي على 500 طبق
+
+Compares the previous two-query detail path (restaurant, then its items, as a
+flat list the frontend regroups) with the single-query join that returns the
+menu grouped by category, and with the grouped response served from the
+catalog snapshot. Reports time per call and SQL statements per call, on
+in-memory SQLite and with a simulated network round trip per statement
+(the production database is remote).
+
+    python benchmarks/bench_restaurant_detail.py [round_trip_ms]
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import json
+from sqlalchemy import event
+
+from src.main import app
+from src.models.user import db
+from src.models.restaurant import Restaurant, MenuItem
+from src.catalog_cache import group_menu_by_category, load_restaurant_menu
+
+ITEMS = 500
+CATEGORIES = ['أطباق رئيسية', 'Grillades', 'Pizzas', 'Salades', 'Desserts', 'Boissons', 'مشروبات', 'Sandwichs']
+ROUNDS = 300
+ROUND_TRIP_MS = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+
+
+def previous_path(restaurant_id):
+    restaurant = Restaurant.query.get(restaurant_id)
+    menu_items = MenuItem.query.filter_by(restaurant_id=restaurant_id, is_available=True).all()
+    body = json.dumps({
+        'restaurant': restaurant.to_dict(),
+        'menu_items': [item.to_dict() for item in menu_items]
+    })
+    # The grouping the frontend had to do itself
+    group_menu_by_category(json.loads(body)['menu_items'])
+    return body
+
+
+def single_query_path(restaurant_id):
+    restaurant, menu_items = load_restaurant_menu(restaurant_id)
+    return json.dumps({
+        'restaurant': restaurant.to_dict(),
+        'menu': group_menu_by_category([item.to_dict() for item in menu_items])
+    })
+
+
+def measure(fn, statements):
+    fn()
+    statements.clear()
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn()
+        # A fresh session per call, as each request gets
+        db.session.remove()
+    elapsed = time.perf_counter() - started
+    return elapsed / ROUNDS * 1000, len(statements) / ROUNDS
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        restaurant = Restaurant(name='Bench', email='bench@restaurant.mr', address='Nouakchott',
+                                password_hash='x', is_approved=True)
+        db.session.add(restaurant)
+        db.session.flush()
+        db.session.add_all([
+            MenuItem(restaurant_id=restaurant.id, name=f'Item {i}', description='Benchmark item',
+                     price=100 + i, category=CATEGORIES[i % len(CATEGORIES)], is_available=i % 10 != 0)
+            for i in range(ITEMS)
+        ])
+        db.session.commit()
+        restaurant_id = restaurant.id
+
+        statements = []
+        latency = {'seconds': 0.0}
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _round_trip(conn, cursor, statement, *args):
+            statements.append(statement)
+            if latency['seconds']:
+                time.sleep(latency['seconds'])
+
+        client = app.test_client()
+        url = f'/api/restaurants/{restaurant_id}?group_by=category'
+        paths = [
+            ('restaurant + items (previous)', lambda: previous_path(restaurant_id)),
+            ('single query, grouped', lambda: single_query_path(restaurant_id)),
+            ('catalog snapshot, grouped (HTTP)', lambda: client.get(url))
+        ]
+        results = []
+        for name, fn in paths:
+            latency['seconds'] = 0.0
+            local_ms, sql = measure(fn, statements)
+            latency['seconds'] = ROUND_TRIP_MS / 1000
+            remote_ms, _ = measure(fn, statements)
+            results.append((name, local_ms, remote_ms, sql))
+        latency['seconds'] = 0.0
+
+        groups = json.loads(single_query_path(restaurant_id))['menu']
+
+    print(f'{ITEMS} menu items, {len(groups)} categories, {sum(len(g["items"]) for g in groups)} available')
+    remote_label = f'ms @{ROUND_TRIP_MS:g}ms RTT'
+    print(f'{"path":>32} {"ms local":>10} {remote_label:>14} {"SQL/call":>10}')
+    for name, local_ms, remote_ms, sql in results:
+        print(f'{name:>32} {local_ms:>10.2f} {remote_ms:>14.2f} {sql:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Check: menu management endpoints are mounted and guarded
+التحقق من أن نقاط نهاية إدارة القوائم مسجلة ومحمية
+
+Calls the menu endpoints through the registered /api blueprint as an
+anonymous client, a customer, another restaurant, the owning restaurant
+and an admin, and checks each gets the expected status code and that only
+the allowed callers change the menu. Then imports broken files (invalid
+UTF-8, nothing but invalid rows, an encoding error after the NDJSON
+progress stream started) and checks the status code or final progress line
+reports the failure and the menu is left untouched. Exits non-zero when
+any check fails.
+
+    python benchmarks/check_menu_routes.py
+"""
+
+import os
+import sys
+import json
+import datetime
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import jwt
+
+from src.main import app
+from src.models.user import db
+from src.models.customer import Customer
+from src.models.restaurant import Restaurant, MenuItem
+from src.models.admin import Admin
+from src.routes.auth import JWT_SECRET
+
+BULK_URL = '/api/restaurants/1/menu/bulk'
+IMPORT_URL = '/api/restaurants/1/menu/import'
+
+failures = []
+
+
+def issue_token(user_type, user_id=1):
+    return jwt.encode({
+        'user_id': user_id,
+        'user_type': user_type,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    }, JWT_SECRET, algorithm='HS256')
+
+
+def headers(user_type=None, user_id=1):
+    return {'Authorization': f'Bearer {issue_token(user_type, user_id)}'} if user_type else {}
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.add(Customer(name='Client', email='c@example.com', phone='1', password_hash='x'))
+    for i in (1, 2):
+        db.session.add(Restaurant(name=f'Restaurant {i}', email=f'r{i}@example.com', address='Nouakchott',
+                                  password_hash='x', is_approved=True))
+    db.session.add(Admin(username='admin', email='admin@example.com', password_hash='x', full_name='Admin'))
+    db.session.commit()
+
+
+def menu_size():
+    return MenuItem.query.filter_by(restaurant_id=1).count()
+
+
+def expect(name, response, status_code, menu_items=None):
+    ok = response.status_code == status_code and (menu_items is None or menu_size() == menu_items)
+    print(f"{'ok' if ok else 'FAIL':<5} {name:<48} {response.status_code}")
+    if not ok:
+        failures.append(name)
+
+
+def check_bulk(client):
+    operations = {'operations': [{'op': 'create', 'name': 'Thieboudienne', 'price': 350}]}
+    expect('bulk: no token', client.post(BULK_URL, json=operations), 401, 0)
+    expect('bulk: customer', client.post(BULK_URL, json=operations, headers=headers('customer')), 403, 0)
+    expect('bulk: other restaurant', client.post(BULK_URL, json=operations, headers=headers('restaurant', 2)), 403, 0)
+    expect('bulk: owning restaurant', client.post(BULK_URL, json=operations, headers=headers('restaurant')), 200, 1)
+    operations['operations'][0]['name'] = 'Mechoui'
+    expect('bulk: admin', client.post(BULK_URL, json=operations, headers=headers('admin')), 200, 2)
+    expect('bulk: admin, unknown restaurant',
+           client.post('/api/restaurants/99/menu/bulk', json=operations, headers=headers('admin')), 404)
+
+
+def check_import(client):
+    csv_file = b'name,price\nYassa,300\n'
+    expect('import: no token', client.post(IMPORT_URL + '?format=csv', data=csv_file), 401, 2)
+    expect('import: other restaurant',
+           client.post(IMPORT_URL + '?format=csv', data=csv_file, headers=headers('restaurant', 2)), 403, 2)
+    expect('import: owning restaurant',
+           client.post(IMPORT_URL + '?format=csv', data=csv_file, headers=headers('restaurant')), 200, 3)
+    expect('import: admin', client.post(IMPORT_URL + '?format=csv', data=b'name,price\nLakh,150\n',
+                                        headers=headers('admin')), 200, 4)
+
+    owner = headers('restaurant')
+    expect('import: CSV with invalid UTF-8',
+           client.post(IMPORT_URL + '?format=csv', data=b'name,price\nCaf\xe9,100\n', headers=owner), 400, 4)
+    expect('import: only invalid rows',
+           client.post(IMPORT_URL + '?format=ndjson', data=b'{"name": "Thiakry"}\nnot json\n', headers=owner), 422, 4)
+
+    # chunk_size=1: the encoding error comes after the stream (and its 200) started
+    late_error = b'name,price\nBissap,50\nBouye,60\nCaf\xe9,100\n'
+    response = client.post(IMPORT_URL + '?format=csv&chunk_size=1', data=late_error,
+                           headers=dict(owner, Accept='application/x-ndjson'))
+    final = json.loads(response.get_data(as_text=True).splitlines()[-1])
+    expect('import: late error, final line reports it', response, 200, 4)
+    if final.get('success') is not False:
+        print(f"FAIL  {'import: late error, final line success':<48} {final.get('success')}")
+        failures.append('import: late error, final line success')
+
+
+def main():
+    with app.app_context():
+        seed()
+        client = app.test_client()
+        check_bulk(client)
+        check_import(client)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
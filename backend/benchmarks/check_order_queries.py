@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Check: order listings run a fixed number of SQL statements
+التحقق من أن قوائم الطلبات تنفذ عدداً ثابتاً من الاستعلامات
+
+Seeds a small and a large set of orders, each with its own customer and
+several lines, calls every order listing endpoint and counts the SQL
+statements per request. Fails when any listing issues more statements for
+more orders (an N+1 query). The customer, restaurant, delivery agent and
+admin blueprints are mounted under /legacy for the check.
+
+    python benchmarks/check_order_queries.py
+"""
+
+import os
+import sys
+import datetime
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import jwt
+from sqlalchemy import event
+
+from src.main import app
+from src.models.user import db
+from src.models.customer import Customer
+from src.models.restaurant import Restaurant, MenuItem
+from src.models.delivery_agent import DeliveryAgent
+from src.models.order import Order, OrderItem
+from src.routes.auth import JWT_SECRET
+from src.routes.admin import admin_bp
+from src.routes.customer import customer_bp
+from src.routes.delivery_agent import delivery_agent_bp
+from src.routes.restaurant import restaurant_bp
+
+SIZES = (3, 40)
+LINES_PER_ORDER = 3
+
+for blueprint in (admin_bp, customer_bp, delivery_agent_bp, restaurant_bp):
+    if blueprint.name not in app.blueprints:
+        app.register_blueprint(blueprint, url_prefix='/legacy')
+
+ENDPOINTS = [
+    ('GET /api/restaurant/orders', '/api/restaurant/orders', 'restaurant'),
+    ('GET /api/customer/orders', '/api/customer/orders', 'customer'),
+    ('GET /api/delivery/available-orders', '/api/delivery/available-orders', 'delivery_agent'),
+    ('admin.get_all_orders', '/legacy/admin/orders?limit=100', None),
+    ('admin.get_dashboard_stats', '/legacy/admin/dashboard', None),
+    ('delivery_agent.get_available_orders', '/legacy/delivery-agents/1/available-orders', None),
+    ('delivery_agent.get_agent_orders', '/legacy/delivery-agents/1/orders?limit=100', None),
+    ('restaurant.get_restaurant_orders', '/legacy/restaurants/1/orders?limit=100', None),
+    ('customer.get_customer_orders', '/legacy/customers/1/orders?limit=100', None),
+]
+
+
+def issue_token(user_type):
+    return jwt.encode({
+        'user_id': 1,
+        'user_type': user_type,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    }, JWT_SECRET, algorithm='HS256')
+
+
+def seed(orders):
+    """
+    Restaurant 1, customer 1 and agent 1 each see every order; every order has
+    a different customer, restaurant or agent on its other side
+    """
+    db.drop_all()
+    db.create_all()
+    for i in range(orders + 1):
+        db.session.add(Customer(name=f'Client {i}', email=f'c{i}@example.com', phone=f'1{i}', password_hash='x'))
+        db.session.add(Restaurant(name=f'Restaurant {i}', email=f'r{i}@example.com', address='Nouakchott',
+                                  password_hash='x', is_approved=True))
+        db.session.add(DeliveryAgent(name=f'Livreur {i}', email=f'a{i}@example.com', phone=f'2{i}',
+                                     password_hash='x', vehicle_type='moto'))
+    db.session.flush()
+    for i in range(orders):
+        db.session.add(MenuItem(restaurant_id=i + 2, name=f'Plat {i}', price=100))
+    db.session.flush()
+
+    number = 0
+    for kind in ('restaurant', 'customer', 'agent', 'ready'):
+        for i in range(orders):
+            number += 1
+            order = Order(
+                customer_id=1 if kind == 'customer' else i + 2,
+                restaurant_id=1 if kind == 'restaurant' else i + 2,
+                delivery_agent_id=1 if kind == 'agent' else None,
+                status='ready' if kind == 'ready' else 'delivered',
+                order_number=f'LVR{number:06d}', subtotal=300, total_amount=300,
+                delivery_address='Tevragh Zeina', payment_method='cash'
+            )
+            db.session.add(order)
+            db.session.flush()
+            for line in range(LINES_PER_ORDER):
+                db.session.add(OrderItem(order_id=order.id, menu_item_id=i + 1, item_name=f'Plat {i}',
+                                         quantity=1, unit_price=100, total_price=100))
+    db.session.commit()
+
+
+def count_statements(client, url, user_type):
+    headers = {'Authorization': f'Bearer {issue_token(user_type)}'} if user_type else {}
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    # Warm caches (principal cache, catalog) so only the listing itself is counted
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200, (url, response.status_code, response.get_data(as_text=True))
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        client.get(url, headers=headers)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def main():
+    counts = {}
+    client = app.test_client()
+    for size in SIZES:
+        with app.app_context():
+            seed(size)
+        for name, url, user_type in ENDPOINTS:
+            with app.app_context():
+                counts.setdefault(name, []).append(count_statements(client, url, user_type))
+
+    failed = False
+    print(f"{'endpoint':<40} " + ' '.join(f'{size:>4} orders' for size in SIZES))
+    for name, per_size in counts.items():
+        marker = '' if len(set(per_size)) == 1 else '  <- grows with the page'
+        failed = failed or bool(marker)
+        print(f'{name:<40} ' + ' '.join(f'{count:>11}' for count in per_size) + marker)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
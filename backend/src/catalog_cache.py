@@ -0,0 +1,366 @@
+"""
+Catalog snapshot cache for Livreure
+ذاكرة مؤقتة للقطة كتالوج المطاعم
+
+The public catalog (approved, active restaurants and their menus) changes a
+few dozen times a day but is read on every page view. Each worker keeps an
+immutable snapshot of it with every restaurant summary and detail response
+already serialized to JSON, tagged with the catalog version it was built
+from. Catalog reads only slice and join those prebuilt strings.
+
+Any flush that writes a Restaurant or MenuItem bumps the version row in
+catalog_version inside the same transaction. The committing worker drops its
+snapshot immediately; other workers compare versions with one primary-key
+lookup at most every CATALOG_VERSION_CHECK_INTERVAL seconds and rebuild on
+the next read. Bulk statements that bypass the ORM must call
+bump_catalog_version() themselves.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import DDL, event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, contains_eager, selectinload
+
+from src.models.user import db
+from src.models.restaurant import Restaurant, MenuItem
+from src.pagination import decode_cursor, encode_cursor
+from src.delivery_estimates import delivery_time_range, format_range, load_delivery_stats, MIN_SAMPLES
+
+_CATALOG_MODELS = (Restaurant, MenuItem)
+
+# Price table entries, used to price orders without touching the database
+MenuPrice = namedtuple('MenuPrice', 'restaurant_id name price is_available')
+RestaurantTerms = namedtuple('RestaurantTerms', 'is_open delivery_fee minimum_order estimated_delivery_time')
+
+
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Restaurant ratings (sum of rating_count) already reflected in the catalog; see reviews.publish_ratings
+    published_ratings = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'version': self.version,
+            'published_ratings': self.published_ratings,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+# The single version row exists from the moment the table does, so bumps are a plain UPDATE
+event.listen(CatalogVersion.__table__, 'after_create',
+             DDL('INSERT INTO catalog_version (id, version) VALUES (1, 1)'))
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), sort_keys=True)
+
+
+def restaurant_summary(restaurant, delivery_stats=None):
+    """
+    Public list entry for a restaurant
+    بيانات المطعم في قائمة المطاعم العامة
+    """
+    preparation_time = None
+    if delivery_stats is not None and delivery_stats.sample_size >= MIN_SAMPLES and delivery_stats.prep_p50 is not None:
+        preparation_time = format_range(delivery_stats.prep_p50, delivery_stats.prep_p90)
+    return {
+        'id': restaurant.id,
+        'name': restaurant.name,
+        'description': restaurant.description,
+        'category': restaurant.category,
+        'address': restaurant.address,
+        'phone': restaurant.phone,
+        'is_open': restaurant.is_open,
+        'rating': restaurant.rating,
+        'rating_count': restaurant.rating_count,
+        'delivery_time': delivery_time_range(restaurant, delivery_stats),
+        'preparation_time': preparation_time,
+        'delivery_fee': restaurant.delivery_fee or 0.0,
+        'minimum_order': restaurant.minimum_order or 0.0,
+        'image': f'/static/images/restaurants/{restaurant.id}.jpg'
+    }
+
+
+def menu_item_summary(item):
+    """
+    Public menu entry for a menu item
+    بيانات الطبق في القائمة العامة
+    """
+    return {
+        'id': item.id,
+        'name': item.name,
+        'description': item.description,
+        'price': float(item.price),
+        'category': item.category,
+        'is_available': item.is_available,
+        'image': f'/static/images/menu/{item.id}.jpg'
+    }
+
+
+def _menu_order(entry):
+    # Uncategorized items go last
+    category = entry['category']
+    return (category is None, (category or '').casefold(), (entry['name'] or '').casefold(), entry['id'])
+
+
+def group_menu_by_category(entries):
+    """
+    Menu entries grouped by category, categories and items in display order
+    عناصر القائمة مجمعة حسب الفئة ومرتبة للعرض
+    """
+    groups = []
+    for entry in sorted(entries, key=_menu_order):
+        if not groups or groups[-1]['category'] != entry['category']:
+            groups.append({'category': entry['category'], 'items': []})
+        groups[-1]['items'].append(entry)
+    return groups
+
+
+def load_restaurant_menu(restaurant_id, available_only=True):
+    """
+    A restaurant and its menu items in a single round trip
+    المطعم وأطباقه في استعلام واحد
+
+    Returns (restaurant, items), or (None, []) when the restaurant does not
+    exist. Items are selected with their restaurant joined in, so the
+    restaurant collection is never partially loaded; only a restaurant with
+    no matching items needs a second lookup.
+    """
+    query = MenuItem.query.join(Restaurant, MenuItem.restaurant_id == Restaurant.id)\
+                          .options(contains_eager(MenuItem.restaurant))\
+                          .filter(MenuItem.restaurant_id == restaurant_id)
+    if available_only:
+        query = query.filter(MenuItem.is_available == True)
+    items = query.all()
+    if items:
+        return items[0].restaurant, items
+    return db.session.get(Restaurant, restaurant_id), []
+
+
+class CatalogSnapshot:
+    """
+    Immutable, pre-serialized view of the public catalog at one version
+    نسخة ثابتة ومسلسلة مسبقاً من الكتالوج العام عند إصدار معين
+    """
+
+    def __init__(self, version, restaurants, delivery_stats=None):
+        self.version = version
+        self.built_at = datetime.utcnow()
+        # Keyset order (created_at, id) ascending; list pages walk it backwards
+        self.keys = []
+        self.summaries = {}
+        self.filters = {}
+        self.details = {}
+        self.grouped_details = {}
+        self.prices = {}
+        self.terms = {}
+        for restaurant in sorted(restaurants, key=_sort_key):
+            summary = restaurant_summary(restaurant, (delivery_stats or {}).get(restaurant.id))
+            detail = dict(summary, menu_items=[menu_item_summary(item) for item in restaurant.menu_items])
+            self.keys.append(_sort_key(restaurant))
+            self.summaries[restaurant.id] = _dumps(summary)
+            self.filters[restaurant.id] = ((restaurant.category or '').casefold(), bool(restaurant.is_open))
+            self.details[restaurant.id] = _dumps({'restaurant': detail, 'success': True}).encode('utf-8')
+            grouped = dict(summary, menu=group_menu_by_category(
+                [entry for entry in detail['menu_items'] if entry['is_available']]
+            ))
+            self.grouped_details[restaurant.id] = _dumps({'restaurant': grouped, 'success': True}).encode('utf-8')
+            self.terms[restaurant.id] = RestaurantTerms(
+                bool(restaurant.is_open), restaurant.delivery_fee or 0.0,
+                restaurant.minimum_order or 0.0, restaurant.estimated_delivery_time or 30
+            )
+            for item in restaurant.menu_items:
+                self.prices[item.id] = MenuPrice(restaurant.id, item.name, item.price, bool(item.is_available))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _matches(self, restaurant_id, category, is_open):
+        restaurant_category, restaurant_open = self.filters[restaurant_id]
+        if category and category.casefold() not in restaurant_category:
+            return False
+        if is_open and not restaurant_open:
+            return False
+        return True
+
+    def list_page(self, cursor=None, limit=50, category=None, is_open=False):
+        """
+        One page of the restaurant list as a JSON body, newest first
+        صفحة واحدة من قائمة المطاعم كنص JSON، من الأحدث
+        """
+        end = len(self.keys)
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            end = bisect_left(self.keys, (created_at or datetime.min, row_id))
+        fragments, last_key = [], None
+        has_more = False
+        for index in range(end - 1, -1, -1):
+            key = self.keys[index]
+            if not self._matches(key[1], category, is_open):
+                continue
+            if len(fragments) == limit:
+                has_more = True
+                break
+            fragments.append(self.summaries[key[1]])
+            last_key = key
+        next_cursor = encode_cursor(*last_key) if has_more else None
+        return self._list_body(fragments, next_cursor)
+
+    def ranked_page(self, restaurant_ids, category=None, is_open=False):
+        """
+        The listed restaurants in the given order as a JSON body
+        المطاعم المحددة بالترتيب المعطى كنص JSON
+        """
+        fragments = [self.summaries[rid] for rid in restaurant_ids
+                     if rid in self.summaries and self._matches(rid, category, is_open)]
+        return self._list_body(fragments, None)
+
+    @staticmethod
+    def _list_body(fragments, next_cursor):
+        return ('{"next_cursor":%s,"restaurants":[%s],"success":true}'
+                % (_dumps(next_cursor), ','.join(fragments))).encode('utf-8')
+
+
+def _sort_key(restaurant):
+    return (restaurant.created_at or datetime.min, restaurant.id)
+
+
+def _read_version(connection):
+    return connection.execute(text('SELECT version FROM catalog_version WHERE id = 1')).scalar() or 0
+
+
+def bump_catalog_version(session):
+    """
+    Increment the shared catalog version inside the session's transaction
+    زيادة إصدار الكتالوج المشترك ضمن معاملة الجلسة
+
+    The local snapshot is dropped when that transaction commits. The row is
+    seeded when the table is created; a database created before that only
+    lacks it until the first bump, and when two transactions race to insert
+    it the loser increments the winner's row instead.
+    """
+    connection = session.connection()
+    bump = text('UPDATE catalog_version SET version = version + 1, updated_at = :now WHERE id = 1')
+    if not connection.execute(bump, {'now': datetime.utcnow()}).rowcount:
+        try:
+            # Savepoint, so a duplicate key does not abort the caller's transaction
+            with connection.begin_nested():
+                connection.execute(text(
+                    'INSERT INTO catalog_version (id, version, updated_at) VALUES (1, 2, :now)'
+                ), {'now': datetime.utcnow()})
+        except IntegrityError:
+            connection.execute(bump, {'now': datetime.utcnow()})
+    session.info['catalog_bumped'] = True
+
+
+class CatalogCache:
+    """
+    Holds the current snapshot and decides when to rebuild it
+    يحتفظ باللقطة الحالية ويحدد متى يعاد بناؤها
+    """
+
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._stale = True
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.rebuilds = 0
+        self.version_checks = 0
+
+    def invalidate(self):
+        self._stale = True
+
+    def snapshot(self):
+        """
+        The current snapshot, rebuilding it first if the catalog version moved
+        اللقطة الحالية مع إعادة بنائها إذا تغير إصدار الكتالوج
+        """
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and not self._stale and now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self.version_checks += 1
+            if _read_version(db.session.connection()) != snapshot.version:
+                self._stale = True
+
+        if snapshot is None or self._stale:
+            # One request rebuilds; the others keep serving the previous snapshot
+            if self._lock.acquire(blocking=snapshot is None):
+                try:
+                    if self._snapshot is None or self._stale:
+                        self._rebuild()
+                finally:
+                    self._lock.release()
+            snapshot = self._snapshot
+
+        self.hits += 1
+        return snapshot
+
+    def _rebuild(self):
+        # Clear the flag first so a commit landing mid-build marks it stale again
+        self._stale = False
+        # Read the version before the rows: a concurrent bump then only costs an extra rebuild
+        version = _read_version(db.session.connection())
+        restaurants = Restaurant.query.options(selectinload(Restaurant.menu_items))\
+                                      .filter_by(is_active=True, is_approved=True).all()
+        self._snapshot = CatalogSnapshot(version, restaurants, load_delivery_stats())
+        self._last_check = time.monotonic()
+        self.rebuilds += 1
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version if snapshot else None,
+            'restaurants': len(snapshot) if snapshot else 0,
+            'built_at': snapshot.built_at.isoformat() if snapshot else None,
+            'stale': self._stale,
+            'hits': self.hits,
+            'rebuilds': self.rebuilds,
+            'version_checks': self.version_checks
+        }
+
+
+catalog_cache = CatalogCache(
+    check_interval=float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 2))
+)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_catalog_changes(session, flush_context, instances):
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, _CATALOG_MODELS) and (
+                instance in session.new or instance in session.deleted or session.is_modified(instance)):
+            session.info['catalog_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_catalog_version(session, flush_context):
+    if session.info.pop('catalog_changed', False):
+        bump_catalog_version(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_catalog(session):
+    if session.info.pop('catalog_bumped', False):
+        catalog_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_catalog_changes(session, previous_transaction):
+    session.info.pop('catalog_changed', None)
+    session.info.pop('catalog_bumped', None)
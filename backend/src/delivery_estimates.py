@@ -0,0 +1,343 @@
+"""
+Delivery time estimates for Livreure
+تقديرات أوقات التحضير والتوصيل لمنصة Livreure
+
+A background job turns the timestamps of recently delivered orders (the
+Order columns, filled in from OrderTracking where a column was never set)
+into per-restaurant preparation, delivery and total time percentiles. The
+whole window is processed as numpy arrays: one sort by (restaurant, value)
+and index arithmetic give every restaurant's p50/p90 at once.
+
+Results live in restaurant_delivery_stats. The catalog snapshot reads them
+when it is built and order tracking reads them from a per-worker copy, so no
+request computes anything. Every worker runs the job; a guarded UPDATE of
+the delivery_stats_refresh row lets one of them claim each interval, and
+the catalog version only moves when the stored values actually changed.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db
+from src.models.order import Order
+from src.order_tracking import OrderTracking
+from src.jobs import register_job
+
+WINDOW_DAYS = int(os.environ.get('DELIVERY_STATS_WINDOW_DAYS', 30))
+MIN_SAMPLES = 5  # fewer delivered orders than this and the restaurant's own setting is used
+MAX_MINUTES = 600  # durations beyond this are data errors, not deliveries
+
+
+class RestaurantDeliveryStats(db.Model):
+    __tablename__ = 'restaurant_delivery_stats'
+
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'), primary_key=True)
+    sample_size = db.Column(db.Integer, nullable=False, default=0)
+    prep_p50 = db.Column(db.Float)
+    prep_p90 = db.Column(db.Float)
+    delivery_p50 = db.Column(db.Float)
+    delivery_p90 = db.Column(db.Float)
+    total_p50 = db.Column(db.Float)
+    total_p90 = db.Column(db.Float)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        return {
+            'restaurant_id': self.restaurant_id,
+            'sample_size': self.sample_size,
+            'prep_p50': self.prep_p50,
+            'prep_p90': self.prep_p90,
+            'delivery_p50': self.delivery_p50,
+            'delivery_p90': self.delivery_p90,
+            'total_p50': self.total_p50,
+            'total_p90': self.total_p90,
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
+
+
+class DeliveryStatsRefresh(db.Model):
+    __tablename__ = 'delivery_stats_refresh'
+
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'started_at': self.started_at.isoformat() if self.started_at else None
+        }
+
+
+_STAT_FIELDS = ('sample_size', 'prep_p50', 'prep_p90', 'delivery_p50', 'delivery_p90', 'total_p50', 'total_p90')
+
+
+def grouped_percentiles(groups, values, quantiles=(0.5, 0.9)):
+    """
+    Percentiles of values for every group id at once
+    حساب النسب المئوية لكل مجموعة دفعة واحدة
+
+    Returns (group_ids, counts, [percentiles per quantile]) using linear
+    interpolation, the numpy default. NaN, negative and implausibly long
+    values are ignored.
+    """
+    valid = ~np.isnan(values) & (values >= 0) & (values <= MAX_MINUTES)
+    groups, values = groups[valid], values[valid]
+    if not len(values):
+        return np.array([], dtype=groups.dtype), np.array([], dtype=int), [np.array([]) for _ in quantiles]
+
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    group_ids, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+
+    results = []
+    for q in quantiles:
+        position = q * (counts - 1)
+        lower = np.floor(position).astype(int)
+        upper = np.ceil(position).astype(int)
+        low_values = values[starts + lower]
+        results.append(low_values + (values[starts + upper] - low_values) * (position - lower))
+    return group_ids, counts, results
+
+
+def to_datetimes(values):
+    return np.array(values, dtype='datetime64[us]')
+
+
+def minutes_between(end, start):
+    return (end - start) / np.timedelta64(1, 'm')
+
+
+def first_set(*arrays):
+    """
+    Element-wise first non-NaT value of the given datetime arrays
+    أول قيمة غير فارغة لكل عنصر من مصفوفات التواريخ
+    """
+    result = arrays[0]
+    for fallback in arrays[1:]:
+        result = np.where(np.isnat(result), fallback, result)
+    return result
+
+
+def first_reached_times(window, order_ids, statuses):
+    """
+    When each order first reached each status according to OrderTracking
+    أول وقت وصل فيه كل طلب إلى كل حالة حسب سجل التتبع
+
+    window are the Order filters that selected order_ids. Returns
+    {status: datetime64 array aligned with order_ids}, NaT where the order
+    has no tracking row for the status. Used to fill in Order timestamp
+    columns that were never set.
+    """
+    tracked = {}
+    for order_id, status, reached_at in db.session.query(
+            OrderTracking.order_id, OrderTracking.status, func.min(OrderTracking.actual_time)
+    ).join(Order, Order.id == OrderTracking.order_id).filter(*window)\
+     .filter(OrderTracking.status.in_(statuses))\
+     .group_by(OrderTracking.order_id, OrderTracking.status).all():
+        tracked[(order_id, status)] = reached_at
+    return {status: to_datetimes([tracked.get((order_id, status)) for order_id in order_ids])
+            for status in statuses}
+
+
+def compute_delivery_stats(window_days=WINDOW_DAYS, now=None):
+    """
+    Per-restaurant percentiles from orders delivered in the last window_days
+    حساب النسب المئوية لكل مطعم من الطلبات الموصلة خلال الفترة المحددة
+
+    Returns {restaurant_id: {...}} in minutes.
+    """
+    since = (now or datetime.utcnow()) - timedelta(days=window_days)
+    window = (Order.status == 'delivered', Order.delivered_at >= since)
+
+    rows = db.session.query(
+        Order.id, Order.restaurant_id, Order.created_at, Order.confirmed_at,
+        Order.prepared_at, Order.picked_up_at, Order.delivered_at
+    ).filter(*window).all()
+    if not rows:
+        return {}
+
+    order_ids = [row[0] for row in rows]
+    tracked = first_reached_times(window, order_ids, ('confirmed', 'ready', 'picked_up'))
+    restaurant_ids = np.array([row[1] for row in rows], dtype=np.int64)
+    created = to_datetimes([row[2] for row in rows])
+    confirmed = first_set(to_datetimes([row[3] for row in rows]), tracked['confirmed'], created)
+    ready = first_set(to_datetimes([row[4] for row in rows]), tracked['ready'])
+    picked_up = first_set(to_datetimes([row[5] for row in rows]), tracked['picked_up'])
+    delivered = to_datetimes([row[6] for row in rows])
+
+    metrics = {
+        'prep': minutes_between(ready, confirmed),
+        'delivery': minutes_between(delivered, picked_up),
+        'total': minutes_between(delivered, created)
+    }
+
+    stats = {}
+    for name, values in metrics.items():
+        group_ids, counts, (p50, p90) = grouped_percentiles(restaurant_ids, values)
+        for restaurant_id, count, low, high in zip(group_ids.tolist(), counts.tolist(), p50.tolist(), p90.tolist()):
+            entry = stats.setdefault(restaurant_id, {'sample_size': 0})
+            entry[f'{name}_p50'] = round(low, 1)
+            entry[f'{name}_p90'] = round(high, 1)
+            if name == 'total':
+                entry['sample_size'] = count
+    return stats
+
+
+def claim_refresh(min_age_seconds=0):
+    """
+    Claim this interval's refresh; False if another worker started one within min_age_seconds
+    حجز تحديث هذه الفترة؛ يعيد False إذا بدأ عامل آخر تحديثاً خلال المدة المحددة
+    """
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(DeliveryStatsRefresh)
+        .where(DeliveryStatsRefresh.id == 1,
+               DeliveryStatsRefresh.started_at <= now - timedelta(seconds=min_age_seconds))
+        .values(started_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        db.session.commit()
+        return True
+    if db.session.get(DeliveryStatsRefresh, 1) is not None:
+        db.session.rollback()
+        return False
+    db.session.add(DeliveryStatsRefresh(id=1, started_at=now))
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def _comparable(values):
+    # Minutes are stored rounded to 0.1; single-precision FLOAT columns (MySQL) add noise below that
+    return tuple(round(value, 1) if isinstance(value, float) else value
+                 for value in (values.get(field) for field in _STAT_FIELDS))
+
+
+def _stats_unchanged(stats):
+    stored = {row.restaurant_id: _comparable(row.to_dict()) for row in RestaurantDeliveryStats.query.all()}
+    return stored == {restaurant_id: _comparable(values) for restaurant_id, values in stats.items()}
+
+
+def refresh_delivery_stats(min_age_seconds=0, window_days=WINDOW_DAYS):
+    """
+    Recompute and store the percentiles unless a refresh started within min_age_seconds
+    إعادة حساب النسب المئوية وتخزينها ما لم يبدأ تحديث خلال المدة المحددة
+
+    The claim lets every worker run the job while only one of them computes
+    per interval. Unchanged results are left in place without touching the
+    catalog. Returns the number of restaurants with stats, or None when
+    skipped.
+    """
+    if not claim_refresh(min_age_seconds):
+        return None
+
+    # Imported here: the catalog snapshot itself reads these stats
+    from src.catalog_cache import bump_catalog_version
+
+    stats = compute_delivery_stats(window_days)
+    if _stats_unchanged(stats):
+        db.session.rollback()
+        return len(stats)
+
+    computed_at = datetime.utcnow()
+    try:
+        RestaurantDeliveryStats.query.delete()
+        db.session.bulk_insert_mappings(RestaurantDeliveryStats, [
+            dict(values, restaurant_id=restaurant_id, computed_at=computed_at)
+            for restaurant_id, values in stats.items()
+        ])
+        # Catalog entries show these times
+        bump_catalog_version(db.session)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    delivery_estimates.invalidate()
+    return len(stats)
+
+
+def load_delivery_stats():
+    """
+    All stored stats keyed by restaurant id
+    جميع الإحصائيات المخزنة حسب معرف المطعم
+    """
+    return {row.restaurant_id: row for row in RestaurantDeliveryStats.query.all()}
+
+
+def format_range(low, high):
+    return f'{int(round(low))}-{int(round(high))}'
+
+
+def delivery_time_range(restaurant, stats=None):
+    """
+    The 'p50-p90' minutes shown for a restaurant, or its own estimate without enough data
+    نطاق وقت التوصيل المعروض للمطعم أو تقديره الخاص عند نقص البيانات
+    """
+    if stats is not None and stats.sample_size >= MIN_SAMPLES and stats.total_p50 is not None:
+        return format_range(stats.total_p50, stats.total_p90)
+    estimate = restaurant.estimated_delivery_time or 30
+    return format_range(estimate, estimate + 15)
+
+
+class DeliveryEstimates:
+    """
+    Per-worker copy of restaurant_delivery_stats for order tracking
+    نسخة محلية من إحصائيات التوصيل لاستخدامها في تتبع الطلبات
+    """
+
+    def __init__(self, reload_interval=60.0):
+        self.reload_interval = reload_interval
+        self._stats = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def get(self, restaurant_id):
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at >= self.reload_interval:
+            with self._lock:
+                if self._loaded_at is None or now - self._loaded_at >= self.reload_interval:
+                    self._stats = {
+                        restaurant_id: row.to_dict() for restaurant_id, row in load_delivery_stats().items()
+                        if row.sample_size >= MIN_SAMPLES
+                    }
+                    self._loaded_at = now
+        return self._stats.get(restaurant_id)
+
+    def minutes(self, restaurant_id, field):
+        stats = self.get(restaurant_id)
+        return stats.get(field) if stats else None
+
+
+delivery_estimates = DeliveryEstimates()
+
+DELIVERY_STATS_INTERVAL = float(os.environ.get('DELIVERY_STATS_INTERVAL', 900))
+
+delivery_stats_job = register_job(
+    'delivery_stats',
+    lambda: refresh_delivery_stats(min_age_seconds=DELIVERY_STATS_INTERVAL * 0.9),
+    interval=DELIVERY_STATS_INTERVAL,
+    initial_delay=30.0
+)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from src.main import app
+
+    with app.app_context():
+        db.create_all()
+        print(f'Delivery stats stored for {refresh_delivery_stats()} restaurants')
@@ -0,0 +1,295 @@
+"""
+Learned delivery ETAs for Livreure
+تقدير أوقات الوصول المتعلم لمنصة Livreure
+
+When an order reaches a status, the customer is shown when it should
+arrive. Instead of a fixed number of minutes per status, the remaining time
+is predicted from the history of delivered orders: for each status, minutes
+from reaching it to delivered_at are fitted as
+
+    overall mean + hour-of-day bucket effect + restaurant effect
+                 + slope * (restaurant-to-customer km - mean km)
+
+The effects are fitted together by a few rounds of backfitting, each a
+handful of numpy reductions (np.bincount) over the whole window, and the
+bucket and restaurant effects are shrunk towards zero when they rest on few
+orders. Status times come from the Order timestamp columns, or from
+OrderTracking where a column was never set.
+
+A background job refits the model in every worker (ETA_REFRESH_INTERVAL);
+predictions are a few dictionary lookups on the in-memory copy. Each refit
+also measures the error against actual delivered_at: the model trained on
+the older 80% of the window is scored on the newest 20% next to the fixed
+per-status times, and the estimates that were shown for recently delivered
+orders are compared with when they actually arrived.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from src.models.user import db
+from src.models.restaurant import Restaurant
+from src.models.order import Order
+from src.order_tracking import OrderTrackingService
+from src.delivery_estimates import first_reached_times, first_set, minutes_between, to_datetimes
+from src.geo import haversine_array_km, haversine_km
+from src.jobs import register_job
+
+WINDOW_DAYS = int(os.environ.get('ETA_WINDOW_DAYS', 30))
+REFRESH_INTERVAL = float(os.environ.get('ETA_REFRESH_INTERVAL', 900))
+STAGES = ('pending', 'confirmed', 'preparing', 'ready', 'picked_up')
+HOUR_BUCKETS = (0, 6, 11, 14, 18, 22)  # night, morning, lunch, afternoon, dinner, late
+MIN_SAMPLES = 50  # a status with fewer delivered orders keeps the fixed estimate
+SHRINKAGE = 5.0  # orders' worth of weight pulling a bucket or restaurant effect towards zero
+BACKFIT_ROUNDS = 4
+HOLDOUT_FRACTION = 0.2
+MAX_MINUTES = 600
+MIN_KM_VARIANCE = 0.01  # km²; below this the distances say nothing and no slope is fitted
+
+# What customers were shown before: the per-status times, and the restaurants' default at placement
+FIXED_MINUTES = dict(OrderTrackingService.ESTIMATED_TIMES, pending=30)
+
+_BUCKET_OF_HOUR = [sum(1 for start in HOUR_BUCKETS[1:] if hour >= start) for hour in range(24)]
+
+
+class StageModel:
+    __slots__ = ('mean', 'bucket_effects', 'restaurant_effects', 'slope', 'mean_km', 'samples')
+
+    def __init__(self, mean, bucket_effects, restaurant_effects, slope, mean_km, samples):
+        self.mean = mean
+        self.bucket_effects = bucket_effects  # list indexed by bucket
+        self.restaurant_effects = restaurant_effects  # {restaurant_id: minutes}
+        self.slope = slope  # minutes per km
+        self.mean_km = mean_km
+        self.samples = samples
+
+    def predict(self, restaurant_id, bucket, km):
+        minutes = self.mean + self.bucket_effects[bucket] + self.restaurant_effects.get(restaurant_id, 0.0)
+        if km is not None:
+            minutes += self.slope * (km - self.mean_km)
+        return max(minutes, 1.0)
+
+
+def load_history(window_days=WINDOW_DAYS, now=None):
+    """
+    Delivered orders of the window as numpy arrays
+    الطلبات الموصلة خلال الفترة على شكل مصفوفات numpy
+
+    Returns a dict with restaurant_ids, km (NaN without drop-off
+    coordinates), delivered, shown (the estimate the customer last saw) and
+    reached[status] per stage, oldest delivery first; None without orders.
+    """
+    since = (now or datetime.utcnow()) - timedelta(days=window_days)
+    window = (Order.status == 'delivered', Order.delivered_at >= since)
+    rows = db.session.query(
+        Order.id, Order.restaurant_id, Order.created_at, Order.confirmed_at, Order.prepared_at,
+        Order.picked_up_at, Order.delivered_at, Order.estimated_delivery_time,
+        Order.delivery_latitude, Order.delivery_longitude, Restaurant.latitude, Restaurant.longitude
+    ).join(Restaurant, Restaurant.id == Order.restaurant_id).filter(*window)\
+     .order_by(Order.delivered_at, Order.id).all()
+    if not rows:
+        return None
+
+    order_ids = [row[0] for row in rows]
+    tracked = first_reached_times(window, order_ids, STAGES[1:])
+
+    def column(index):
+        return np.array([np.nan if row[index] is None else row[index] for row in rows], dtype=float)
+
+    return {
+        'restaurant_ids': np.array([row[1] for row in rows], dtype=np.int64),
+        'km': haversine_array_km(column(10), column(11), column(8), column(9)),
+        'delivered': to_datetimes([row[6] for row in rows]),
+        'shown': to_datetimes([row[7] for row in rows]),
+        'reached': {
+            'pending': to_datetimes([row[2] for row in rows]),
+            'confirmed': first_set(to_datetimes([row[3] for row in rows]), tracked['confirmed']),
+            'preparing': tracked['preparing'],
+            'ready': first_set(to_datetimes([row[4] for row in rows]), tracked['ready']),
+            'picked_up': first_set(to_datetimes([row[5] for row in rows]), tracked['picked_up'])
+        }
+    }
+
+
+def _hour_buckets(times):
+    hours = (times.astype('datetime64[h]') - times.astype('datetime64[D]')).astype(int)
+    return np.array(_BUCKET_OF_HOUR, dtype=np.int64)[hours]
+
+
+def stage_samples(history, stage):
+    """
+    (restaurant_ids, buckets, km, minutes remaining) of the orders with a valid time for stage
+    بيانات الطلبات ذات الوقت الصالح لهذه المرحلة
+    """
+    reached = history['reached'][stage]
+    minutes = minutes_between(history['delivered'], reached)
+    valid = ~np.isnat(reached) & (minutes >= 0) & (minutes <= MAX_MINUTES)
+    return (history['restaurant_ids'][valid], _hour_buckets(reached[valid]),
+            history['km'][valid], minutes[valid])
+
+
+def fit_stage(restaurant_ids, buckets, km, minutes):
+    """
+    Fit one status's StageModel by backfitting
+    ملاءمة نموذج مرحلة واحدة بطريقة الملاءمة التراجعية
+    """
+    n_buckets = len(HOUR_BUCKETS)
+    restaurants, restaurant_index = np.unique(restaurant_ids, return_inverse=True)
+    known = ~np.isnan(km)
+    mean_km = float(km[known].mean()) if known.any() else 0.0
+    centred_km = np.where(known, km - mean_km, 0.0)
+    km_var = float(centred_km @ centred_km)
+
+    mean = float(minutes.mean())
+    bucket_effects = np.zeros(n_buckets)
+    restaurant_effects = np.zeros(len(restaurants))
+    slope = 0.0
+    bucket_counts = np.bincount(buckets, minlength=n_buckets)
+    restaurant_counts = np.bincount(restaurant_index, minlength=len(restaurants))
+    for _ in range(BACKFIT_ROUNDS):
+        residual = minutes - mean - slope * centred_km - restaurant_effects[restaurant_index]
+        bucket_effects = np.bincount(buckets, residual, n_buckets) / (bucket_counts + SHRINKAGE)
+        residual = minutes - mean - bucket_effects[buckets] - restaurant_effects[restaurant_index]
+        slope = float(centred_km @ residual) / km_var if km_var > MIN_KM_VARIANCE * len(minutes) else 0.0
+        residual = minutes - mean - bucket_effects[buckets] - slope * centred_km
+        restaurant_effects = np.bincount(restaurant_index, residual, len(restaurants)) / (restaurant_counts + SHRINKAGE)
+
+    return StageModel(mean, bucket_effects.tolist(), dict(zip(restaurants.tolist(), restaurant_effects.tolist())),
+                      slope, mean_km, len(minutes))
+
+
+def _predict_many(model, restaurant_ids, buckets, km):
+    effects = np.array([model.restaurant_effects.get(restaurant_id, 0.0) for restaurant_id in restaurant_ids.tolist()])
+    minutes = model.mean + np.array(model.bucket_effects)[buckets] + effects
+    minutes += np.where(np.isnan(km), 0.0, model.slope * (km - model.mean_km))
+    return np.maximum(minutes, 1.0)
+
+
+def evaluate(history, stages=STAGES):
+    """
+    Holdout mean absolute error in minutes per status, model next to the fixed times
+    متوسط الخطأ المطلق بالدقائق لكل حالة للنموذج مقارنة بالأوقات الثابتة
+
+    The model is fitted on the older orders and scored on the newest
+    HOLDOUT_FRACTION of the window.
+    """
+    result = {}
+    for stage in stages:
+        restaurant_ids, buckets, km, minutes = stage_samples(history, stage)
+        split = int(len(minutes) * (1 - HOLDOUT_FRACTION))
+        if split < MIN_SAMPLES or len(minutes) - split < 10:
+            continue
+        model = fit_stage(restaurant_ids[:split], buckets[:split], km[:split], minutes[:split])
+        predicted = _predict_many(model, restaurant_ids[split:], buckets[split:], km[split:])
+        fixed = FIXED_MINUTES.get(stage, 0)
+        result[stage] = {
+            'samples': len(minutes) - split,
+            'model_mae': round(float(np.abs(predicted - minutes[split:]).mean()), 2),
+            'fixed_mae': round(float(np.abs(fixed - minutes[split:]).mean()), 2)
+        }
+    return result
+
+
+def shown_error(history):
+    """
+    Mean absolute error in minutes of the estimated_delivery_time customers last saw
+    متوسط الخطأ المطلق لوقت التوصيل المتوقع الذي رآه العملاء آخر مرة
+    """
+    shown = history['shown']
+    errors = np.abs(minutes_between(history['delivered'][~np.isnat(shown)], shown[~np.isnat(shown)]))
+    return round(float(errors.mean()), 2) if len(errors) else None
+
+
+class EtaPredictor:
+    """
+    Holds the fitted stage models and serves predictions from memory
+    يحتفظ بنماذج المراحل ويقدم التوقعات من الذاكرة
+    """
+
+    def __init__(self):
+        # (stage models, restaurant coordinates), replaced together on refresh
+        self._state = ({}, {})
+        self.fitted_at = None
+        self.fit_ms = None
+        self.holdout = {}
+        self.shown_mae = None
+        self.predictions = 0
+        self.fallbacks = 0
+
+    def refresh(self, window_days=WINDOW_DAYS):
+        """
+        Refit every status's model from the window; returns the statuses served
+        إعادة ملاءمة نماذج جميع الحالات وإرجاع الحالات المخدومة
+        """
+        started = time.perf_counter()
+        history = load_history(window_days)
+        models = {}
+        if history is not None:
+            for stage in STAGES:
+                samples = stage_samples(history, stage)
+                if len(samples[3]) >= MIN_SAMPLES:
+                    models[stage] = fit_stage(*samples)
+        restaurants = {
+            restaurant_id: (lat, lng) for restaurant_id, lat, lng in
+            db.session.query(Restaurant.id, Restaurant.latitude, Restaurant.longitude)
+                      .filter(Restaurant.latitude.isnot(None), Restaurant.longitude.isnot(None))
+        }
+        self._state = (models, restaurants)
+        self.holdout = evaluate(history) if history is not None else {}
+        self.shown_mae = shown_error(history) if history is not None else None
+        self.fitted_at = datetime.utcnow()
+        self.fit_ms = round((time.perf_counter() - started) * 1000, 2)
+        return sorted(models)
+
+    def remaining_minutes(self, restaurant_id, status, at=None, delivery_lat=None, delivery_lng=None):
+        """
+        Predicted minutes from reaching status at `at` until delivery, or None without a model
+        الدقائق المتوقعة من بلوغ الحالة حتى التوصيل، أو None عند غياب النموذج
+        """
+        models, restaurants = self._state
+        model = models.get(status)
+        if model is None:
+            self.fallbacks += 1
+            return None
+        km = None
+        if delivery_lat is not None and delivery_lng is not None:
+            restaurant = restaurants.get(restaurant_id)
+            if restaurant is not None:
+                km = haversine_km(restaurant[0], restaurant[1], delivery_lat, delivery_lng)
+        self.predictions += 1
+        return model.predict(restaurant_id, _BUCKET_OF_HOUR[(at or datetime.utcnow()).hour], km)
+
+    def stats(self):
+        return {
+            'statuses': {stage: model.samples for stage, model in self._state[0].items()},
+            'fitted_at': self.fitted_at.isoformat() if self.fitted_at else None,
+            'fit_ms': self.fit_ms,
+            'holdout_mae_minutes': self.holdout,
+            'shown_mae_minutes': self.shown_mae,
+            'predictions': self.predictions,
+            'fallbacks': self.fallbacks
+        }
+
+
+eta_predictor = EtaPredictor()
+
+eta_refresh_job = register_job(
+    'eta_refresh',
+    eta_predictor.refresh,
+    interval=REFRESH_INTERVAL,
+    initial_delay=20.0
+)
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from src.main import app
+
+    with app.app_context():
+        db.create_all()
+        eta_predictor.refresh()
+        print(json.dumps(eta_predictor.stats(), indent=2))
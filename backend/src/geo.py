@@ -0,0 +1,218 @@
+"""
+Geospatial helpers for Livreure
+أدوات جغرافية لمنصة Livreure
+
+Restaurants carry a geohash of their coordinates in an indexed column.
+A geohash prefix is a rectangular cell, and every point inside the cell
+has a geohash starting with that prefix, so "restaurants in this cell" is
+an index range scan on the column. Radius and nearest-neighbour discovery
+look only at the cell around the customer and its eight neighbours, then
+compute exact haversine distances on that small candidate set.
+"""
+
+import math
+
+import numpy as np
+from sqlalchemy import and_, or_
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_PRECISION = 9  # about 4.8m x 4.8m, finer than any query needs
+DEFAULT_RADIUS_KM = 10.0
+KNN_START_PRECISION = 6  # about 1.2km x 0.6km, a few city blocks
+MAX_RADIUS_KM = 100.0
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance in kilometres
+    المسافة على سطح الأرض بالكيلومترات
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_array_km(lats1, lngs1, lats2, lngs2):
+    """
+    Great-circle distances in kilometres between numpy arrays of points, broadcast elementwise
+    المسافات بالكيلومترات بين مصفوفات من النقاط عنصراً بعنصر
+    """
+    phi1, phi2 = np.radians(lats1), np.radians(lats2)
+    dlmb = np.radians(lngs2) - np.radians(lngs1)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_matrix_km(lats1, lngs1, lats2, lngs2):
+    """
+    Great-circle distances in kilometres from every point of one set to every point of another
+    المسافات بالكيلومترات من كل نقطة في مجموعة إلى كل نقطة في مجموعة أخرى
+
+    Returns an array of shape (len(lats1), len(lats2)).
+    """
+    return haversine_array_km(np.asarray(lats1, dtype=float)[:, None], np.asarray(lngs1, dtype=float)[:, None],
+                              np.asarray(lats2, dtype=float)[None, :], np.asarray(lngs2, dtype=float)[None, :])
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    """
+    Encode coordinates as a geohash string
+    تحويل الإحداثيات إلى رمز geohash
+    """
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, value, even = 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size_degrees(precision):
+    """
+    (lat, lng) size in degrees of a geohash cell
+    أبعاد خلية geohash بالدرجات (خط العرض، خط الطول)
+    """
+    total_bits = precision * 5
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def _cell_min_km(precision, lat):
+    # Smallest extent of a cell near lat; a circle of this radius around a
+    # point never leaves the point's cell plus its eight neighbours
+    dlat, dlng = cell_size_degrees(precision)
+    km_per_degree = math.pi * EARTH_RADIUS_KM / 180
+    width = dlng * km_per_degree * max(math.cos(math.radians(min(abs(lat) + dlat, 90.0))), 0.0)
+    return min(dlat * km_per_degree, width)
+
+
+def covering_cells(lat, lng, precision):
+    """
+    The geohash cell containing the point and its eight neighbours
+    خلية geohash التي تحتوي النقطة مع الخلايا الثماني المجاورة
+    """
+    dlat, dlng = cell_size_degrees(precision)
+    cells = set()
+    for i in (-1, 0, 1):
+        cell_lat = lat + i * dlat
+        if cell_lat > 90 or cell_lat < -90:
+            continue
+        for j in (-1, 0, 1):
+            cell_lng = (lng + j * dlng + 180) % 360 - 180
+            cells.add(encode_geohash(cell_lat, cell_lng, precision))
+    return sorted(cells)
+
+
+def precision_for_radius(lat, radius_km):
+    """
+    Finest precision whose nine-cell neighbourhood covers radius_km around lat
+    أدق مستوى تغطي خلاياه التسع نصف القطر المطلوب
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        if _cell_min_km(precision, lat) >= radius_km:
+            return precision
+    return 1
+
+
+def _in_cells(column, cells):
+    # Prefix match written as a range so every database can use the index
+    return or_(*[and_(column >= cell, column < cell + '~') for cell in cells])
+
+
+def _with_distances(rows, lat, lng, radius_km=None):
+    result = []
+    for row in rows:
+        distance = haversine_km(lat, lng, row.latitude, row.longitude)
+        if radius_km is None or distance <= radius_km:
+            result.append((row, distance))
+    result.sort(key=lambda pair: pair[1])
+    return result
+
+
+def within_radius(query, model, lat, lng, radius_km=DEFAULT_RADIUS_KM):
+    """
+    Rows of query within radius_km of the point, nearest first, as (row, distance_km)
+    الصفوف ضمن نصف القطر مرتبة من الأقرب مع المسافة بالكيلومترات
+    """
+    radius_km = min(radius_km, MAX_RADIUS_KM)
+    cells = covering_cells(lat, lng, precision_for_radius(lat, radius_km))
+    rows = query.filter(_in_cells(model.geohash, cells)).all()
+    return _with_distances(rows, lat, lng, radius_km)
+
+
+def nearest(query, model, lat, lng, k=10, max_radius_km=MAX_RADIUS_KM):
+    """
+    The k rows of query nearest to the point, as (row, distance_km)
+    أقرب k صفوف إلى النقطة مع المسافة بالكيلومترات
+
+    Starts with cells a few blocks wide and widens one geohash level at a time until
+    k rows are found inside the radius the cells are guaranteed to cover.
+    """
+    precision = KNN_START_PRECISION
+    while True:
+        covered_km = min(_cell_min_km(precision, lat), max_radius_km)
+        cells = covering_cells(lat, lng, precision)
+        candidates = _with_distances(query.filter(_in_cells(model.geohash, cells)).all(), lat, lng)
+        inside = [pair for pair in candidates if pair[1] <= covered_km]
+        if len(inside) >= k or covered_km >= max_radius_km or precision == 1:
+            return inside[:k]
+        precision -= 1
+        # Skip levels whose neighbourhood cannot hold the k-th candidate seen so far
+        if len(candidates) >= k:
+            needed_km = candidates[k - 1][1]
+            while precision > 1 and _cell_min_km(precision, lat) < min(needed_km, max_radius_km):
+                precision -= 1
+
+
+def backfill_geohashes():
+    """
+    Add the restaurants.geohash column if missing and fill it from the coordinates
+    إضافة عمود geohash إذا لم يكن موجوداً وملؤه من الإحداثيات
+    """
+    from sqlalchemy import inspect, text
+    from src.models.user import db
+    from src.models.restaurant import Restaurant
+
+    columns = {column['name'] for column in inspect(db.engine).get_columns('restaurants')}
+    if 'geohash' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE restaurants ADD COLUMN geohash VARCHAR(12)'))
+            connection.execute(text('CREATE INDEX ix_restaurants_geohash ON restaurants (geohash)'))
+
+    updated = 0
+    rows = db.session.query(Restaurant.id, Restaurant.latitude, Restaurant.longitude).all()
+    for restaurant_id, lat, lng in rows:
+        geohash = encode_geohash(lat, lng) if lat is not None and lng is not None else None
+        db.session.query(Restaurant).filter_by(id=restaurant_id).update(
+            {'geohash': geohash}, synchronize_session=False
+        )
+        updated += 1
+    db.session.commit()
+    return updated
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from src.main import app
+
+    with app.app_context():
+        print(f'Geohash set for {backfill_geohashes()} restaurants')
@@ -0,0 +1,345 @@
+"""
+Idempotency keys for Livreure
+مفاتيح عدم التكرار لمنصة Livreure
+
+Clients on unreliable mobile networks retry POSTs whose responses they never
+received. A request carrying an Idempotency-Key header is recorded in the
+idempotency_keys table, unique per (scope, key), before the endpoint runs;
+its response is stored once the endpoint returns. A retry with the same key
+gets the stored response back without the endpoint running again. Stored
+responses are also kept in a per-worker LRU so that retries, which arrive in
+bursts, are answered from memory.
+
+The scope ties a key to the caller and the endpoint, so two customers can use
+the same key. Reusing a key for a different request body is rejected, as is a
+retry that arrives while the first request is still being processed. Keys
+expire after IDEMPOTENCY_KEY_TTL seconds; a background job deletes them.
+
+The claim and the stored response are written in their own transactions,
+around the endpoint's. A claim left pending by a worker that died in between
+is only honoured for IDEMPOTENCY_PENDING_LEASE seconds; after that a retry
+claims the key afresh instead of getting 409 until the key expires.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, g, jsonify, make_response, request
+from sqlalchemy import and_, delete, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db
+from src.jobs import register_job
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+KEY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400))
+PENDING_LEASE_SECONDS = float(os.environ.get('IDEMPOTENCY_PENDING_LEASE', 60))
+PURGE_BATCH_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'key', name='uq_idempotency_keys_scope_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(150), nullable=False)
+    key = db.Column(db.String(MAX_KEY_LENGTH), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)  # NULL while the first request is running
+    response_body = db.Column(db.Text)
+    content_type = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'scope': self.scope,
+            'key': self.key,
+            'status_code': self.status_code,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+
+class StoredResponse:
+    __slots__ = ('request_hash', 'status_code', 'body', 'content_type', 'expires_at')
+
+    def __init__(self, request_hash, status_code, body, content_type, expires_at):
+        self.request_hash = request_hash
+        self.status_code = status_code
+        self.body = body
+        self.content_type = content_type
+        self.expires_at = expires_at  # wall-clock unix seconds, shared with the table
+
+    @property
+    def pending(self):
+        return self.status_code is None
+
+
+class IdempotencyStore:
+    """
+    Stored responses by (scope, key): per-worker LRU in front of idempotency_keys
+    الاستجابات المخزنة حسب المفتاح: ذاكرة LRU لكل عامل أمام جدول المفاتيح
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=KEY_TTL_SECONDS, pending_lease_seconds=PENDING_LEASE_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.pending_lease_seconds = pending_lease_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.table_hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.reclaimed = 0
+        self.store_failures = 0
+        self.purged = 0
+
+    def _remember(self, cache_key, stored):
+        with self._lock:
+            self._entries[cache_key] = stored
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _cached(self, cache_key):
+        with self._lock:
+            stored = self._entries.get(cache_key)
+            if stored is None:
+                return None
+            if stored.expires_at <= time.time():
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return stored
+
+    def lookup(self, scope, key):
+        """
+        The StoredResponse for (scope, key), pending while the first request runs, or None
+        الاستجابة المخزنة للمفتاح، معلقة أثناء تنفيذ الطلب الأول، أو None
+
+        A pending claim older than the lease counts as None, so it can be claimed again.
+        """
+        stored = self._cached((scope, key))
+        if stored is not None:
+            self.memory_hits += 1
+            return stored
+        row = IdempotencyKey.query.filter_by(scope=scope, key=key)\
+                                  .filter(IdempotencyKey.expires_at > datetime.utcnow()).first()
+        if row is None or (row.status_code is None and row.created_at <= self._lease_cutoff()):
+            self.misses += 1
+            return None
+        stored = StoredResponse(row.request_hash, row.status_code, row.response_body, row.content_type,
+                                time.time() + (row.expires_at - datetime.utcnow()).total_seconds())
+        if not stored.pending:
+            self.table_hits += 1
+            self._remember((scope, key), stored)
+        return stored
+
+    def _lease_cutoff(self):
+        return datetime.utcnow() - timedelta(seconds=self.pending_lease_seconds)
+
+    def claim(self, scope, key, request_hash):
+        """
+        Record that a request with this key is running
+        تسجيل بدء تنفيذ طلب بهذا المفتاح
+
+        Returns (claim id, expiry), or None if another request got there first.
+        """
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        # Drop an expired row, or a pending claim past its lease, so the key can be reused
+        dropped = db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.scope == scope, IdempotencyKey.key == key,
+            or_(IdempotencyKey.expires_at <= now,
+                and_(IdempotencyKey.status_code.is_(None), IdempotencyKey.created_at <= self._lease_cutoff()))
+        ))
+        row = IdempotencyKey(scope=scope, key=key, request_hash=request_hash, created_at=now, expires_at=expires_at)
+        db.session.add(row)
+        try:
+            db.session.flush()
+            claim_id = row.id
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            self.conflicts += 1
+            return None
+        if dropped.rowcount:
+            self.reclaimed += 1
+        return claim_id, expires_at
+
+    def complete(self, scope, key, request_hash, claim, response):
+        """
+        Store the response of the request that claimed the key
+        تخزين استجابة الطلب الذي حجز المفتاح
+
+        A failure is logged rather than raised: the endpoint's own work is
+        already committed and its response must still reach the client.
+        The claim then stays pending until its lease runs out.
+        """
+        claim_id, expires_at = claim
+        body = response.get_data(as_text=True)
+        try:
+            # By id: if this request outlived its lease, a retry's newer claim is not overwritten
+            result = db.session.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.id == claim_id)
+                .values(status_code=response.status_code, response_body=body, content_type=response.content_type)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.store_failures += 1
+            logger.exception('Could not store the response for %s key %s', scope, key)
+            return
+        if not result.rowcount:
+            return
+        self._remember((scope, key), StoredResponse(
+            request_hash, response.status_code, body, response.content_type,
+            time.time() + (expires_at - datetime.utcnow()).total_seconds()
+        ))
+
+    def release(self, claim):
+        """
+        Forget a claim whose request failed, so a retry runs it again
+        إلغاء حجز مفتاح فشل طلبه ليتمكن إعادة المحاولة من تنفيذه
+        """
+        claim_id, _ = claim
+        db.session.rollback()
+        db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.id == claim_id, IdempotencyKey.status_code.is_(None)
+        ))
+        db.session.commit()
+
+    def purge_expired(self):
+        """
+        Delete expired keys in batches; returns the number deleted
+        حذف المفاتيح المنتهية على دفعات وإرجاع عددها
+        """
+        deleted = 0
+        while True:
+            ids = [row[0] for row in db.session.query(IdempotencyKey.id)
+                   .filter(IdempotencyKey.expires_at <= datetime.utcnow()).limit(PURGE_BATCH_SIZE)]
+            if not ids:
+                break
+            db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id.in_(ids)))
+            db.session.commit()
+            deleted += len(ids)
+        self.purged += deleted
+        now = time.time()
+        with self._lock:
+            for cache_key in [k for k, stored in self._entries.items() if stored.expires_at <= now]:
+                del self._entries[cache_key]
+        return deleted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {
+            'size': size,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'pending_lease_seconds': self.pending_lease_seconds,
+            'memory_hits': self.memory_hits,
+            'table_hits': self.table_hits,
+            'misses': self.misses,
+            'conflicts': self.conflicts,
+            'reclaimed': self.reclaimed,
+            'store_failures': self.store_failures,
+            'purged': self.purged
+        }
+
+
+idempotency_store = IdempotencyStore(
+    max_entries=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+)
+
+idempotency_purge_job = register_job(
+    'idempotency_purge',
+    idempotency_store.purge_expired,
+    interval=float(os.environ.get('IDEMPOTENCY_PURGE_INTERVAL', 3600)),
+    initial_delay=60.0
+)
+
+
+def _scope(claims):
+    return f"{claims.get('user_type')}:{claims.get('user_id')} {request.method} {request.path}"[:150]
+
+
+def _replay(stored):
+    response = current_app.response_class(stored.body, status=stored.status_code, content_type=stored.content_type)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _error(message, status_code):
+    return jsonify({'success': False, 'message': message}), status_code
+
+
+def idempotent(f):
+    """
+    Honour an Idempotency-Key header on a POST endpoint
+    دعم ترويسة Idempotency-Key في نقطة نهاية POST
+
+    Apply it below token_required so the key is scoped to the caller; on
+    an endpoint without token claims the header is ignored, since keys
+    shared by every anonymous caller would replay one client's response to
+    another. Requests without the header run as before. Responses with a
+    5xx status are not stored: the claim is released and a retry runs the
+    endpoint again.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        claims = getattr(g, 'token_claims', None)
+        if not key or not claims:
+            return f(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters', 400)
+
+        scope = _scope(claims)
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+
+        stored = idempotency_store.lookup(scope, key)
+        claim = None
+        if stored is None:
+            claim = idempotency_store.claim(scope, key, request_hash)
+            if claim is None:
+                # A concurrent request claimed the key between lookup and claim
+                stored = idempotency_store.lookup(scope, key)
+        if claim is None:
+            if stored is not None and stored.request_hash != request_hash:
+                return _error(f'This {HEADER} was already used for a different request', 422)
+            if stored is None or stored.pending:
+                return _error(f'A request with this {HEADER} is still being processed', 409)
+            return _replay(stored)
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            idempotency_store.release(claim)
+            raise
+        if response.status_code >= 500:
+            idempotency_store.release(claim)
+        else:
+            idempotency_store.complete(scope, key, request_hash, claim, response)
+        return response
+    return decorated_function
@@ -0,0 +1,106 @@
+"""
+Background jobs for Livreure
+المهام الخلفية لمنصة Livreure
+
+Periodic work (statistics, model refreshes) runs on a daemon thread per
+worker process instead of inside requests. Each job runs inside an
+application context, and a failing run is logged and retried on the next
+tick. Jobs that must not run once per worker guard themselves, for example
+by checking when their stored results were last computed.
+"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    """
+    Calls fn every interval seconds on a daemon thread
+    تنفيذ دالة كل فترة زمنية محددة في خيط خلفي
+    """
+
+    def __init__(self, name, fn, interval, initial_delay=5.0):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.initial_delay = initial_delay
+        self.runs = 0
+        self.failures = 0
+        self.last_run_at = None
+        self.last_duration_ms = None
+        self.last_error = None
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+
+    def start(self, app):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        pid = os.getpid()
+        if self.interval <= 0 or (self._thread is not None and self._thread_pid == pid):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(app,), name=f'job-{self.name}', daemon=True)
+        self._thread_pid = pid
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self, app):
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                self.fn()
+            self.runs += 1
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.exception('Background job %s failed', self.name)
+        finally:
+            self.last_run_at = time.time()
+            self.last_duration_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def _loop(self, app):
+        if self._stop.wait(self.initial_delay):
+            return
+        while not self._stop.is_set():
+            self.run_once(app)
+            if self._stop.wait(self.interval):
+                return
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_run_at': self.last_run_at,
+            'last_duration_ms': self.last_duration_ms,
+            'last_error': self.last_error
+        }
+
+
+_jobs = {}
+
+
+def register_job(name, fn, interval, initial_delay=5.0):
+    """
+    Register a periodic job; started by start_jobs()
+    تسجيل مهمة دورية تبدأ عند استدعاء start_jobs()
+    """
+    job = PeriodicJob(name, fn, interval, initial_delay)
+    _jobs[name] = job
+    return job
+
+
+def start_jobs(app):
+    for job in _jobs.values():
+        job.start(app)
+
+
+def jobs_stats():
+    return {name: job.stats() for name, job in _jobs.items()}
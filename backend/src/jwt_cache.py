@@ -0,0 +1,142 @@
+"""
+Verified JWT decode cache for Livreure
+ذاكرة تخزين مؤقت لرموز JWT التي تم التحقق منها
+
+Mobile clients send the same 30-day token on every poll, so re-running the
+HMAC verification each time is wasted work. Verified claims are memoized
+under a digest of the raw token and never outlive the token's own exp.
+"""
+
+import hashlib
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+
+class VerifiedTokenCache:
+    """
+    Size-capped LRU of verified claims with expiry-aware eviction
+    ذاكرة LRU محدودة الحجم للبيانات الموثقة مع حذف حسب تاريخ الانتهاء
+    """
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._expiry_heap = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def digest(token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).digest()
+
+    def get(self, key):
+        """
+        Return cached claims for a token digest, or None if missing or expired
+        إرجاع البيانات المخزنة للرمز أو None إذا كانت غير موجودة أو منتهية
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            exp, claims = entry
+            if exp <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def set(self, key, claims):
+        """
+        Store verified claims until the token's exp
+        تخزين البيانات الموثقة حتى تاريخ انتهاء الرمز
+        """
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)):
+            # Tokens without an expiry are never cached
+            return
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            self._entries[key] = (exp, claims)
+            self._entries.move_to_end(key)
+            heapq.heappush(self._expiry_heap, (exp, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            if len(self._expiry_heap) > 2 * self.max_entries:
+                self._expiry_heap = [(e, k) for k, (e, _) in self._entries.items()]
+                heapq.heapify(self._expiry_heap)
+
+    def _purge_expired(self, now):
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            exp, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == exp:
+                del self._entries[key]
+                self.expirations += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expiry_heap = []
+
+    def stats(self):
+        """
+        Get cache counters for monitoring
+        الحصول على عدادات الذاكرة للمراقبة
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+verified_token_cache = VerifiedTokenCache(
+    max_entries=int(os.environ.get('JWT_CACHE_SIZE', 50000))
+)
+
+
+def decode_token(token, secret):
+    """
+    Decode and verify an HS256 token, skipping verification for tokens seen before
+    فك رمز HS256 والتحقق منه مع تخطي التحقق للرموز المعروفة مسبقاً
+
+    Raises the same jwt exceptions as jwt.decode. A cached token that has
+    passed its exp is dropped and re-verified, so ExpiredSignatureError is
+    still raised on time.
+    """
+    key = VerifiedTokenCache.digest(token)
+    claims = verified_token_cache.get(key)
+    if claims is not None:
+        return claims
+
+    claims = jwt.decode(token, secret, algorithms=['HS256'])
+    verified_token_cache.set(key, claims)
+    return claims
@@ -1,14 +1,22 @@
 import os
 import sys
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 from src.models.user import db
-from src.routes.auth import auth_bp
+from src.routes.auth import auth_bp, token_required
 from src.routes.api import api_bp
+from src.password_hashing import HashingPoolSaturated
 
 # Import new models to ensure they are created
 from src.notifications import Notification
 from src.order_tracking import OrderTracking
+from src.token_revocation import RevokedToken
+from src.catalog_cache import CatalogVersion
+from src.reviews import Review
+from src.delivery_estimates import RestaurantDeliveryStats, DeliveryStatsRefresh
+from src.idempotency import IdempotencyKey
+from src.order_dispatch import DispatchLease
+from src.route_batching import DeliveryBatch
 
 # DON'T CHANGE THE FOLLOWING LINES
 # This is to ensure that the application can be run from the project root
@@ -18,7 +26,9 @@ sys.path.append(project_root)
 # DON'T CHANGE THE ABOVE LINES
 
 app = Flask(__name__)
-CORS(app) # Enable CORS for all routes
+# Enable CORS for all routes; browsers only let scripts read the headers listed here
+CORS(app, expose_headers=['X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset',
+                          'X-RateLimit-Cost', 'Retry-After', 'X-Next-Cursor'])
 
 # Database configuration
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///livreure.db")
@@ -34,9 +44,29 @@ app.register_blueprint(api_bp, url_prefix="/api")
 # Register new API blueprints
 from src.routes.notifications_api import notifications_bp
 from src.routes.tracking_api import tracking_bp
+from src.routes.reviews_api import reviews_bp
 
 app.register_blueprint(notifications_bp, url_prefix="/api")
 app.register_blueprint(tracking_bp, url_prefix="/api")
+app.register_blueprint(reviews_bp, url_prefix="/api")
+
+# Background jobs start on the first request of each worker process
+from src.jobs import start_jobs
+import src.eta  # registers the ETA refresh job
+
+@app.before_request
+def ensure_background_jobs():
+    start_jobs(app)
+
+# Login and registration routes re-raise this when the host's hashing slots are taken
+@app.errorhandler(HashingPoolSaturated)
+def hashing_pool_saturated(error):
+    message = 'Too many authentication requests, please retry shortly'
+    if request.blueprint == 'auth':
+        body = {'success': False, 'message': message}
+    else:
+        body = {'error': message}
+    return jsonify(body), 429, {'Retry-After': '1'}
 
 # Serve static files for the frontend
 @app.route("/<path:filename>")
@@ -59,6 +89,33 @@ def serve_admin_index():
 def health_check():
     return jsonify({"status": "ok", "message": "Backend is running!"}), 200
 
+# Capacity and timing internals: admins only
+@app.route("/api/metrics")
+@token_required
+def metrics(current_user):
+    if g.token_claims.get('user_type') != 'admin':
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+
+    from src.principal_cache import principal_cache
+    from src.jwt_cache import verified_token_cache
+    from src.password_hashing import hashing_pool
+    from src.catalog_cache import catalog_cache
+    from src.jobs import jobs_stats
+    from src.idempotency import idempotency_store
+    from src.order_dispatch import dispatcher
+    from src.eta import eta_predictor
+
+    return jsonify({
+        "principal_cache": principal_cache.stats(),
+        "jwt_cache": verified_token_cache.stats(),
+        "password_hashing": hashing_pool.metrics(),
+        "catalog_cache": catalog_cache.stats(),
+        "idempotency": idempotency_store.stats(),
+        "dispatch": dispatcher.stats(),
+        "eta": eta_predictor.stats(),
+        "jobs": jobs_stats()
+    }), 200
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
@@ -0,0 +1,281 @@
+"""
+Streaming menu import for Livreure
+استيراد قوائم الطعام بشكل متدفق لمنصة Livreure
+
+Onboarding a chain means loading thousands of menu items at once. The upload
+(CSV with a header row, or NDJSON with one item object per line) is parsed
+row by row from the stream, never held in memory as a whole. Valid rows are
+upserted by name within the restaurant, one chunk at a time: a single query
+finds which names already exist, then executemany INSERT and UPDATE
+statements apply the chunk. The whole import is one transaction, so a
+failure leaves the menu untouched; invalid rows are skipped and reported with
+their line number. A CSV file that is not valid UTF-8 cannot be split into
+rows reliably, so it fails the import as a whole with the offending line.
+"""
+
+import codecs
+import csv
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from src.models.user import db
+from src.models.restaurant import MenuItem
+from src.catalog_cache import bump_catalog_version
+from src.menu_operations import MenuValidationError, update_menu_items, validate_menu_fields
+from src.search_index import index_menu_items_by_id, index_new_menu_rows
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+
+def _encoding_name(encoding):
+    # 'utf-8-sig' only means a leading byte order mark is dropped
+    return encoding.upper().replace('-SIG', '')
+
+
+def _decoded_lines(stream, encoding):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for line_number, raw in enumerate(stream, start=1):
+        try:
+            yield decoder.decode(raw)
+        except UnicodeDecodeError:
+            raise MenuValidationError(f'Line {line_number} is not valid {_encoding_name(encoding)}')
+
+
+def iter_csv_rows(stream, encoding='utf-8-sig'):
+    """
+    Iterator of (line, row, error) for each record of a binary CSV stream
+    إرجاع سجلات ملف CSV واحداً تلو الآخر من التدفق
+
+    The header row is read and checked immediately. Header names are
+    case-insensitive; empty cells are left out so they keep the column
+    default (or the existing value when the row updates an item).
+    """
+    reader = csv.DictReader(_decoded_lines(stream, encoding))
+    if not reader.fieldnames:
+        raise MenuValidationError('The file is empty')
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    if 'name' not in reader.fieldnames or 'price' not in reader.fieldnames:
+        raise MenuValidationError('The header row must contain name and price columns')
+    return ((reader.line_num, {k: v for k, v in row.items() if k and v not in (None, '')}, None)
+            for row in reader)
+
+
+def iter_ndjson_rows(stream, encoding='utf-8-sig'):
+    """
+    Yield (line, row, error) for each line of a binary NDJSON stream
+    إرجاع أسطر ملف NDJSON واحداً تلو الآخر من التدفق
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for line_number, raw in enumerate(stream, start=1):
+        try:
+            line = decoder.decode(raw)
+        except UnicodeDecodeError:
+            yield line_number, None, f'Line is not valid {_encoding_name(encoding)}'
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'Invalid JSON: {e.msg}'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'Each line must be a JSON object'
+            continue
+        yield line_number, row, None
+
+
+def iter_import_rows(stream, import_format):
+    if import_format == 'csv':
+        return iter_csv_rows(stream)
+    if import_format == 'ndjson':
+        return iter_ndjson_rows(stream)
+    raise MenuValidationError(f'format must be one of {", ".join(IMPORT_FORMATS)}')
+
+
+def detect_format(filename=None, content_type=None):
+    """
+    Import format from a file name or content type, or None
+    تحديد صيغة الاستيراد من اسم الملف أو نوع المحتوى
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv' or (content_type or '').startswith('text/csv'):
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl') or (content_type or '').startswith(('application/x-ndjson', 'application/jsonl')):
+        return 'ndjson'
+    return None
+
+
+class MenuImport:
+    """
+    Chunked upsert of menu rows into one restaurant, with running counters
+    إدراج وتحديث أطباق مطعم على دفعات مع عدادات للتقدم
+    """
+
+    def __init__(self, restaurant_id, chunk_size=CHUNK_SIZE):
+        self.restaurant_id = restaurant_id
+        self.chunk_size = chunk_size
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.committed = False
+        self._now = datetime.utcnow()
+
+    def _error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def _existing_ids(self, names):
+        rows = db.session.query(MenuItem.name, MenuItem.id).filter(
+            MenuItem.restaurant_id == self.restaurant_id, MenuItem.name.in_(names)
+        ).order_by(MenuItem.id.desc())
+        # Descending so that with duplicate names the oldest item wins
+        return {name: item_id for name, item_id in rows}
+
+    def _apply_chunk(self, chunk):
+        # A name repeated inside the chunk: the last row wins
+        by_name = {}
+        for values in chunk:
+            by_name[values['name']] = values
+        existing = self._existing_ids(list(by_name))
+
+        new_rows = [dict(values, restaurant_id=self.restaurant_id, created_at=self._now, updated_at=self._now)
+                    for name, values in by_name.items() if name not in existing]
+        updates = [dict(values, id=existing[name]) for name, values in by_name.items() if name in existing]
+
+        # executemany needs the same columns in every row
+        groups = {}
+        for row in new_rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            db.session.execute(insert(MenuItem), group)
+        update_menu_items(updates, self._now)
+
+        connection = db.session.connection()
+        if new_rows:
+            # New rows are indexed from the values in hand rather than reloaded
+            created_ids = self._existing_ids([row['name'] for row in new_rows])
+            index_new_menu_rows(connection, [dict(row, id=created_ids[row['name']]) for row in new_rows])
+        index_menu_items_by_id(connection, [row['id'] for row in updates])
+        self.created += len(new_rows)
+        self.updated += len(updates)
+
+    def steps(self, rows):
+        """
+        Import (line, row, error) tuples, yielding after each applied chunk
+        استيراد السجلات مع التوقف بعد كل دفعة لإتاحة تقرير التقدم
+
+        Nothing is committed until the rows are exhausted; closing the
+        generator early rolls the import back.
+        """
+        chunk = []
+        try:
+            for line, row, error in rows:
+                self.processed += 1
+                if error is None:
+                    try:
+                        chunk.append(validate_menu_fields(row))
+                    except MenuValidationError as e:
+                        error = str(e)
+                if error is not None:
+                    self._error(line, error)
+                if len(chunk) >= self.chunk_size:
+                    self._apply_chunk(chunk)
+                    chunk = []
+                    yield self
+            if chunk:
+                self._apply_chunk(chunk)
+            if self.created or self.updated:
+                bump_catalog_version(db.session)
+            db.session.commit()
+            self.committed = True
+        except BaseException:
+            db.session.rollback()
+            raise
+        yield self
+
+    def run(self, rows, progress=None):
+        """
+        Import all rows; progress(self) is called after each chunk
+        استيراد جميع السجلات واستدعاء progress بعد كل دفعة
+        """
+        for _ in self.steps(rows):
+            if progress:
+                progress(self)
+        return self.summary()
+
+    def progress(self):
+        return {
+            'processed': self.processed,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed
+        }
+
+    def succeeded(self):
+        # Committed, and either something was imported or there was nothing wrong to import
+        return self.committed and (self.created + self.updated > 0 or not self.failed)
+
+    def summary(self):
+        return dict(
+            self.progress(),
+            success=self.succeeded(),
+            restaurant_id=self.restaurant_id,
+            errors=self.errors,
+            errors_truncated=self.failed > len(self.errors)
+        )
+
+
+def ensure_menu_name_index():
+    """
+    Create the (restaurant_id, name) index the upsert looks names up with, on existing databases
+    إنشاء الفهرس الذي يستخدمه الاستيراد للبحث عن الأسماء في قواعد البيانات الموجودة
+    """
+    for index in MenuItem.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+
+def import_menu(restaurant_id, stream, import_format, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Stream-parse an upload and upsert its rows into a restaurant's menu
+    تحليل الملف المرفوع بشكل متدفق وإدراج أطباقه في قائمة المطعم
+    """
+    return MenuImport(restaurant_id, chunk_size).run(iter_import_rows(stream, import_format), progress)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from src.main import app
+
+    parser = argparse.ArgumentParser(description='Import a CSV or NDJSON menu file into a restaurant')
+    parser.add_argument('restaurant_id', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=IMPORT_FORMATS)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    import_format = args.format or detect_format(args.path)
+    if import_format is None:
+        parser.error('cannot tell the format from the file name, pass --format')
+
+    def report(job):
+        print(f'{job.processed} rows read, {job.created} created, {job.updated} updated, {job.failed} failed',
+              file=sys.stderr)
+
+    with app.app_context(), open(args.path, 'rb') as upload:
+        db.create_all()
+        ensure_menu_name_index()
+        summary = import_menu(args.restaurant_id, upload, import_format, args.chunk_size, report)
+    for error in summary['errors']:
+        print(f"line {error['line']}: {error['error']}")
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,254 @@
+"""
+Bulk menu operations for Livreure
+العمليات الجماعية على قوائم الطعام لمنصة Livreure
+
+Restaurants change many menu items at once (sold out at closing time, a new
+season's dishes). A batch of create/update/delete/availability operations is
+validated item by item, then applied in one transaction with one
+executemany-style statement per kind of change. Those statements bypass the
+ORM flush hooks, so the batch re-indexes its items for search and bumps the
+catalog version once itself.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import delete, insert, update
+
+from src.models.user import db
+from src.models.restaurant import MenuItem
+from src.models.order import OrderItem
+from src.catalog_cache import bump_catalog_version
+from src.search_index import index_menu_items_by_id, remove_documents
+
+MAX_BULK_OPERATIONS = 1000
+
+# field -> (type, max length or None)
+MENU_FIELDS = {
+    'name': (str, 100),
+    'description': (str, None),
+    'price': (float, None),
+    'category': (str, 50),
+    'image_url': (str, 255),
+    'is_available': (bool, None),
+    'preparation_time': (int, None),
+    'calories': (int, None),
+    'ingredients': (str, None),
+    'allergens': (str, 255),
+    'is_vegetarian': (bool, None),
+    'is_vegan': (bool, None),
+    'is_gluten_free': (bool, None)
+}
+
+REQUIRED_FIELDS = ('name', 'price')
+
+
+class MenuValidationError(ValueError):
+    """
+    Raised when menu item data is invalid
+    يُرفع عندما تكون بيانات الطبق غير صالحة
+    """
+
+
+def validate_menu_fields(data, partial=False):
+    """
+    Return the known menu fields of data, type-checked and normalized
+    إرجاع حقول الطبق المعروفة بعد التحقق من أنواعها وتوحيدها
+
+    partial allows missing required fields (updates).
+    """
+    if not isinstance(data, dict):
+        raise MenuValidationError('Item must be an object')
+    values = {}
+    for field, (kind, max_length) in MENU_FIELDS.items():
+        if field not in data:
+            continue
+        value = data[field]
+        if value is None or value == '':
+            if field in REQUIRED_FIELDS:
+                raise MenuValidationError(f'{field} is required')
+            values[field] = None
+            continue
+        if kind is bool:
+            if isinstance(value, str) and value.lower() in ('true', 'false', '1', '0', 'yes', 'no'):
+                value = value.lower() in ('true', '1', 'yes')
+            elif not isinstance(value, bool):
+                raise MenuValidationError(f'{field} must be a boolean')
+        elif kind in (int, float):
+            if isinstance(value, bool):
+                raise MenuValidationError(f'{field} must be a number')
+            try:
+                value = kind(value)
+            except (TypeError, ValueError):
+                raise MenuValidationError(f'{field} must be a number')
+            if value < 0:
+                raise MenuValidationError(f'{field} cannot be negative')
+        else:
+            value = str(value).strip()
+            if max_length and len(value) > max_length:
+                raise MenuValidationError(f'{field} is longer than {max_length} characters')
+        values[field] = value
+
+    if not partial:
+        for field in REQUIRED_FIELDS:
+            if values.get(field) is None:
+                raise MenuValidationError(f'{field} is required')
+    return values
+
+
+def insert_menu_items(rows):
+    """
+    Insert menu item rows with one batched statement, returning their ids in order
+    إدراج الأطباق بعملية مجمعة واحدة وإرجاع معرفاتها بالترتيب
+    """
+    if not rows:
+        return []
+    dialect = db.session.get_bind().dialect
+    if getattr(dialect, 'insert_executemany_returning_sort_by_parameter_order', False):
+        result = db.session.execute(
+            insert(MenuItem).returning(MenuItem.id, sort_by_parameter_order=True), rows
+        )
+        return [row[0] for row in result]
+    # Without RETURNING for executemany (MySQL) each row reports its own key
+    return [db.session.execute(insert(MenuItem), [row]).inserted_primary_key[0] for row in rows]
+
+
+def update_menu_items(rows, now=None):
+    """
+    Apply {'id': ..., field: value} updates, one executemany per set of changed fields
+    تطبيق التعديلات على الأطباق بعملية مجمعة واحدة لكل مجموعة حقول
+    """
+    now = now or datetime.utcnow()
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(dict(row, updated_at=now))
+    for group in groups.values():
+        db.session.execute(update(MenuItem), group)
+
+
+def _result(index, op, item_id=None, status='error', error=None):
+    result = {'index': index, 'op': op, 'id': item_id, 'status': status}
+    if error:
+        result['error'] = error
+    return result
+
+
+def apply_bulk_operations(restaurant_id, operations, atomic=False):
+    """
+    Validate and apply a batch of menu operations in one transaction
+    التحقق من مجموعة عمليات على القائمة وتطبيقها في معاملة واحدة
+
+    Each operation is {"op": "create", ...fields}, {"op": "update", "id", ...fields},
+    {"op": "delete", "id"} or {"op": "set_availability", "id", "is_available"}.
+    Returns (results, applied): one result per operation, in order. Invalid
+    operations are reported and skipped, unless atomic is set, in which case
+    nothing is applied when any operation is invalid.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise MenuValidationError('operations must be a non-empty list')
+    if len(operations) > MAX_BULK_OPERATIONS:
+        raise MenuValidationError(f'At most {MAX_BULK_OPERATIONS} operations per request')
+
+    results = [None] * len(operations)
+    creates, updates, deletes, availability = [], [], [], {True: [], False: []}
+    targeted = set()
+
+    # Items the batch refers to, checked for ownership with a single query
+    referenced = {op.get('id') for op in operations
+                  if isinstance(op, dict) and isinstance(op.get('id'), int) and op.get('op') != 'create'}
+    owned = {row[0] for row in db.session.query(MenuItem.id).filter(
+        MenuItem.restaurant_id == restaurant_id, MenuItem.id.in_(referenced)
+    )} if referenced else set()
+
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        try:
+            if op == 'create':
+                values = validate_menu_fields(operation)
+                values['restaurant_id'] = restaurant_id
+                creates.append((index, values))
+                continue
+            if op not in ('update', 'delete', 'set_availability'):
+                raise MenuValidationError('op must be create, update, delete or set_availability')
+
+            item_id = operation.get('id')
+            if not isinstance(item_id, int) or item_id not in owned:
+                raise MenuValidationError('Menu item not found')
+            if item_id in targeted:
+                raise MenuValidationError('Only one operation per item is allowed in a batch')
+            targeted.add(item_id)
+
+            if op == 'update':
+                values = validate_menu_fields({k: v for k, v in operation.items() if k not in ('op', 'id')}, partial=True)
+                if not values:
+                    raise MenuValidationError('No fields to update')
+                updates.append((index, item_id, values))
+            elif op == 'delete':
+                deletes.append((index, item_id))
+            else:
+                is_available = validate_menu_fields({'is_available': operation.get('is_available')}, partial=True)
+                if is_available.get('is_available') is None:
+                    raise MenuValidationError('is_available is required')
+                availability[is_available['is_available']].append((index, item_id))
+        except MenuValidationError as e:
+            results[index] = _result(index, op, operation.get('id') if isinstance(operation, dict) else None, error=str(e))
+
+    # Items already on orders keep their row so order history stays intact
+    if deletes:
+        on_orders = {row[0] for row in db.session.query(OrderItem.menu_item_id).filter(
+            OrderItem.menu_item_id.in_([item_id for _, item_id in deletes])
+        ).distinct()}
+        for index, item_id in deletes:
+            if item_id in on_orders:
+                results[index] = _result(index, 'delete', item_id,
+                                         error='Item appears in orders; mark it unavailable instead')
+        deletes = [(index, item_id) for index, item_id in deletes if item_id not in on_orders]
+
+    if atomic and any(result is not None for result in results):
+        for index, result in enumerate(results):
+            if result is None:
+                operation = operations[index]
+                results[index] = _result(index, operation.get('op'), operation.get('id'), 'skipped')
+        return results, False
+
+    now = datetime.utcnow()
+    try:
+        created_ids = insert_menu_items([values for _, values in creates])
+        for (index, _), item_id in zip(creates, created_ids):
+            results[index] = _result(index, 'create', item_id, 'created')
+
+        update_menu_items([dict(values, id=item_id) for _, item_id, values in updates], now)
+        for index, item_id, _ in updates:
+            results[index] = _result(index, 'update', item_id, 'updated')
+
+        for is_available, entries in availability.items():
+            if entries:
+                db.session.execute(
+                    update(MenuItem).where(MenuItem.id.in_([item_id for _, item_id in entries]))
+                                    .values(is_available=is_available, updated_at=now)
+                                    .execution_options(synchronize_session=False)
+                )
+                for index, item_id in entries:
+                    results[index] = _result(index, 'set_availability', item_id, 'updated')
+
+        if deletes:
+            db.session.execute(
+                delete(MenuItem).where(MenuItem.id.in_([item_id for _, item_id in deletes]))
+                                .execution_options(synchronize_session=False)
+            )
+            for index, item_id in deletes:
+                results[index] = _result(index, 'delete', item_id, 'deleted')
+
+        changed = created_ids + [item_id for _, item_id, _ in updates]
+        if changed or deletes:
+            connection = db.session.connection()
+            index_menu_items_by_id(connection, created_ids, replace=False)
+            index_menu_items_by_id(connection, [item_id for _, item_id, _ in updates])
+            remove_documents(connection, [('menu_item', item_id) for _, item_id in deletes])
+        if changed or deletes or any(availability.values()):
+            bump_catalog_version(db.session)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return results, True
@@ -3,6 +3,9 @@ from datetime import datetime
 
 class Customer(db.Model):
     __tablename__ = 'customers'
+    __table_args__ = (
+        db.Index('ix_customers_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
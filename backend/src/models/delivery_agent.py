@@ -1,8 +1,12 @@
 from src.models.user import db
 from datetime import datetime
+from sqlalchemy import event, inspect
 
 class DeliveryAgent(db.Model):
     __tablename__ = 'delivery_agents'
+    __table_args__ = (
+        db.Index('ix_delivery_agents_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -17,7 +21,10 @@ class DeliveryAgent(db.Model):
     is_available = db.Column(db.Boolean, default=False)
     current_latitude = db.Column(db.Float)
     current_longitude = db.Column(db.Float)
+    location_updated_at = db.Column(db.DateTime)  # Stamped whenever current_latitude/longitude change
     rating = db.Column(db.Float, default=0.0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)  # Running totals maintained by ReviewService
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
     total_deliveries = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -39,9 +46,17 @@ class DeliveryAgent(db.Model):
             'is_available': self.is_available,
             'current_latitude': self.current_latitude,
             'current_longitude': self.current_longitude,
+            'location_updated_at': self.location_updated_at.isoformat() if self.location_updated_at else None,
             'rating': self.rating,
+            'rating_count': self.rating_count,
             'total_deliveries': self.total_deliveries,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+@event.listens_for(DeliveryAgent, 'before_insert')
+@event.listens_for(DeliveryAgent, 'before_update')
+def _stamp_location(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.current_latitude.history.has_changes() or state.attrs.current_longitude.history.has_changes():
+        target.location_updated_at = datetime.utcnow()
@@ -3,6 +3,13 @@ from datetime import datetime
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Keyset pagination indexes: newest first on (created_at, id)
+        db.Index('ix_orders_created_at_id', 'created_at', 'id'),
+        db.Index('ix_orders_customer_created_at_id', 'customer_id', 'created_at', 'id'),
+        db.Index('ix_orders_restaurant_created_at_id', 'restaurant_id', 'created_at', 'id'),
+        db.Index('ix_orders_agent_created_at_id', 'delivery_agent_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False)
@@ -33,6 +40,7 @@ class Order(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     confirmed_at = db.Column(db.DateTime)
     prepared_at = db.Column(db.DateTime)
+    dispatched_at = db.Column(db.DateTime)  # when the dispatcher offered the ready order to its agent
     picked_up_at = db.Column(db.DateTime)
     delivered_at = db.Column(db.DateTime)
     estimated_delivery_time = db.Column(db.DateTime)
@@ -61,6 +69,7 @@ class Order(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'confirmed_at': self.confirmed_at.isoformat() if self.confirmed_at else None,
             'prepared_at': self.prepared_at.isoformat() if self.prepared_at else None,
+            'dispatched_at': self.dispatched_at.isoformat() if self.dispatched_at else None,
             'picked_up_at': self.picked_up_at.isoformat() if self.picked_up_at else None,
             'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None,
             'estimated_delivery_time': self.estimated_delivery_time.isoformat() if self.estimated_delivery_time else None
@@ -72,6 +81,7 @@ class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
     menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_items.id'), nullable=False)
+    item_name = db.Column(db.String(100))  # Menu item name at order time; unit_price is the price at order time
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
@@ -85,6 +95,7 @@ class OrderItem(db.Model):
             'id': self.id,
             'order_id': self.order_id,
             'menu_item_id': self.menu_item_id,
+            'item_name': self.item_name,
             'quantity': self.quantity,
             'unit_price': self.unit_price,
             'total_price': self.total_price,
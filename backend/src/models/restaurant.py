@@ -1,8 +1,13 @@
 from src.models.user import db
+from src.geo import encode_geohash
+from sqlalchemy import event
 from datetime import datetime
 
 class Restaurant(db.Model):
     __tablename__ = 'restaurants'
+    __table_args__ = (
+        db.Index('ix_restaurants_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -14,11 +19,14 @@ class Restaurant(db.Model):
     category = db.Column(db.String(50), default='general')  # Added category field
     image_url = db.Column(db.String(255))
     rating = db.Column(db.Float, default=0.0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)  # Running totals maintained by ReviewService
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
     is_active = db.Column(db.Boolean, default=True)
     is_open = db.Column(db.Boolean, default=True)  # Added is_open field
     is_approved = db.Column(db.Boolean, default=False)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)  # Kept in sync with latitude/longitude
     delivery_fee = db.Column(db.Float, default=0.0)
     minimum_order = db.Column(db.Float, default=0.0)
     estimated_delivery_time = db.Column(db.Integer, default=30)  # in minutes
@@ -40,6 +48,7 @@ class Restaurant(db.Model):
             'category': self.category,
             'image_url': self.image_url,
             'rating': self.rating,
+            'rating_count': self.rating_count,
             'is_active': self.is_active,
             'is_open': self.is_open,
             'is_approved': self.is_approved,
@@ -52,8 +61,19 @@ class Restaurant(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+@event.listens_for(Restaurant, 'before_insert')
+@event.listens_for(Restaurant, 'before_update')
+def _sync_geohash(mapper, connection, target):
+    if target.latitude is not None and target.longitude is not None:
+        target.geohash = encode_geohash(target.latitude, target.longitude)
+    else:
+        target.geohash = None
+
 class MenuItem(db.Model):
     __tablename__ = 'menu_items'
+    __table_args__ = (
+        db.Index('ix_menu_items_restaurant_id_name', 'restaurant_id', 'name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'), nullable=False)
@@ -206,10 +206,13 @@ class NotificationTemplates:
         'type': 'promotion'
     }
 
-def send_order_notification(order, status, user_type='customer'):
+def order_notification(order, status, user_type='customer'):
     """
-    Send notification based on order status
-    إرسال إشعار بناءً على حالة الطلب
+    Columns of the notification for an order status, or None if user_type gets none
+    أعمدة إشعار حالة الطلب، أو None إذا لم يكن لهذا المستخدم إشعار
+    
+    order only needs id, order_number, total_amount and the customer,
+    restaurant and delivery agent ids, so a query row will do.
     """
     templates = {
         'confirmed': NotificationTemplates.ORDER_CONFIRMED,
@@ -221,7 +224,7 @@ def send_order_notification(order, status, user_type='customer'):
     }
     
     if status not in templates:
-        return False
+        return None
     
     template = templates[status]
     
@@ -235,23 +238,38 @@ def send_order_notification(order, status, user_type='customer'):
         user_id = order.delivery_agent_id
         template = NotificationTemplates.DELIVERY_ASSIGNED
     else:
-        return False
+        return None
     
     # Format message with order data
-    title = template['title']
-    message = template['message'].format(
-        order_number=order.order_number,
-        total_amount=order.total_amount
-    )
+    return {
+        'user_id': user_id,
+        'user_type': user_type,
+        'title': template['title'],
+        'message': template['message'].format(
+            order_number=order.order_number,
+            total_amount=order.total_amount
+        ),
+        'type': template['type'],
+        'data': {'order_id': order.id, 'order_number': order.order_number}
+    }
+
+def send_order_notification(order, status, user_type='customer'):
+    """
+    Send notification based on order status
+    إرسال إشعار بناءً على حالة الطلب
+    """
+    notification = order_notification(order, status, user_type)
+    if notification is None:
+        return False
     
     # Create notification
     return NotificationService.create_notification(
-        user_id=user_id,
-        user_type=user_type,
-        title=title,
-        message=message,
-        notification_type=template['type'],
-        data={'order_id': order.id, 'order_number': order.order_number}
+        user_id=notification['user_id'],
+        user_type=notification['user_type'],
+        title=notification['title'],
+        message=notification['message'],
+        notification_type=notification['type'],
+        data=notification['data']
     )
 
 def send_welcome_notification(user_id, user_type):
@@ -0,0 +1,519 @@
+"""
+Order dispatch for Livreure
+توزيع الطلبات على عمال التوصيل لمنصة Livreure
+
+When several delivery agents accept the same ready order at once, exactly
+one of them must get it. A claim is a transition to picked_up through the
+order state machine (order_state) whose UPDATE assigns the order only while
+it is still ready and unassigned; the database applies it to at most one
+agent and the affected row count says who won. Agents who lose write
+nothing, and the winner's tracking row and notification are written in the
+same transaction.
+
+The dispatcher assigns orders without waiting for agents to pick them. Every
+few seconds it loads the ready, unassigned orders and the available agents
+who are not already delivering, groups orders from the same restaurant going
+to nearby addresses into batches (route_batching), computes the
+agent-to-restaurant distance matrix with numpy and solves the minimum-cost
+assignment (each agent gets at most one batch; batches further than
+DISPATCH_MAX_PICKUP_KM are left for the next run). All assignments are
+written in one transaction by a single UPDATE, a CASE mapping each order to
+its agent, under the same conditions as a claim, so an order an agent
+accepted by hand in the meantime is left alone; the rest of that order's
+batch goes back to the pool rather than leaving an agent a partial trip. Assigned orders stay 'ready'
+until the agent reports the pickup: they are listed first among the agent's
+available orders, and accepting one is that pickup. Agents whose position is
+older than DISPATCH_LOCATION_MAX_AGE seconds are not matched, since their
+pickup distance would be a guess.
+
+An offer is stamped in dispatched_at. Each round first hands back to the
+pool the offers not picked up within DISPATCH_OFFER_TIMEOUT seconds and
+those whose agent has since gone unavailable, so they are matched again
+instead of waiting on an agent who is not coming.
+
+Only one worker process dispatches at a time: each run first takes a lease
+row in dispatch_lease, and a lease whose holder stopped renewing it expires.
+"""
+
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import case, exists, func, inspect, or_, text, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db
+from src.models.restaurant import Restaurant
+from src.models.delivery_agent import DeliveryAgent
+from src.models.order import Order
+from src.geo import haversine_matrix_km
+from src.order_history import with_order_relations
+from src.order_state import claim_transition
+from src.route_batching import BATCH_SIZE, DeliveryBatch, build_batches, record_batches
+from src.jobs import register_job
+
+CLAIMABLE_STATUS = 'ready'
+CLAIMED_STATUS = 'picked_up'
+ACTIVE_STATUSES = ('ready', 'picked_up')  # an agent with an order in these is busy
+
+DISPATCH_INTERVAL = float(os.environ.get('DISPATCH_INTERVAL', 5))
+MAX_PICKUP_KM = float(os.environ.get('DISPATCH_MAX_PICKUP_KM', 10))
+LOCATION_MAX_AGE = float(os.environ.get('DISPATCH_LOCATION_MAX_AGE', 300))
+OFFER_TIMEOUT = float(os.environ.get('DISPATCH_OFFER_TIMEOUT', 180))
+DISPATCH_METHOD = os.environ.get('DISPATCH_METHOD', 'optimal')  # or 'greedy'
+MAX_BATCH = 5000  # orders or agents considered per run
+COMMIT_CHUNK = 1000  # assignments per UPDATE statement
+OPTIMAL_MAX_PAIRS = 1_000_000  # larger rounds fall back to greedy to stay within the interval
+WAIT_CREDIT_KM_PER_MINUTE = 0.1  # a minute of waiting outweighs 100m of extra distance
+MAX_WAIT_CREDIT_KM = 3.0
+_INFEASIBLE = 1e9
+
+
+class DispatchLease(db.Model):
+    __tablename__ = 'dispatch_lease'
+
+    id = db.Column(db.Integer, primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'holder': self.holder,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+
+def claim_order(order_id, agent_id):
+    """
+    Assign a ready, unassigned order to an agent; True if this agent got it
+    إسناد طلب جاهز غير مسند إلى عامل توصيل؛ يعيد True إذا حصل عليه هذا العامل
+
+    A ready order the dispatcher already gave this agent is picked up instead.
+    """
+    return claim_transition(order_id, CLAIMED_STATUS, agent_id)
+
+
+def claim_refusal(order_id, agent_id=None):
+    """
+    Why an order could not be claimed by agent_id, as (message, status_code)
+    سبب تعذر إسناد الطلب إلى العامل على شكل (رسالة، رمز الحالة)
+    """
+    row = db.session.query(Order.delivery_agent_id, Order.status).filter(Order.id == order_id).first()
+    if row is None:
+        return 'Order not found', 404
+    if row.delivery_agent_id is not None and row.delivery_agent_id != agent_id:
+        return 'Order already assigned to another delivery agent', 400
+    return 'Order is not ready for pickup', 400
+
+
+def agent_route(agent_id, *relations):
+    """
+    The agent's ready and picked-up orders in visiting order, and their batch
+    طلبات العامل الجاهزة والمستلمة بترتيب الزيارة مع دفعتها
+
+    Orders of the agent's latest batch come in the order of its route, any
+    others after them, oldest first. relations are Order relationships to
+    load with the orders, as for with_order_relations. The batch is None when
+    none of the orders belongs to one.
+    """
+    orders = with_order_relations(
+        Order.query.filter(Order.delivery_agent_id == agent_id, Order.status.in_(ACTIVE_STATUSES)), *relations
+    ).order_by(Order.created_at, Order.id).all()
+    if not orders:
+        return [], None
+    batch = DeliveryBatch.query.filter_by(delivery_agent_id=agent_id).order_by(DeliveryBatch.id.desc()).first()
+    position = {order_id: index for index, order_id in enumerate(batch.order_ids)} if batch else {}
+    orders.sort(key=lambda order: position.get(order.id, len(position)))
+    return orders, batch if batch and any(order.id in position for order in orders) else None
+
+
+def greedy_assignment(cost):
+    """
+    Repeatedly pair the cheapest remaining (row, column); returns (rows, columns)
+    اختيار أرخص زوج متبقٍ بشكل متكرر؛ يعيد (الصفوف، الأعمدة)
+    """
+    n_rows, n_cols = cost.shape
+    order = np.argsort(cost, axis=None, kind='stable')
+    order = order[cost.ravel()[order] < _INFEASIBLE]
+    row_taken = np.zeros(n_rows, dtype=bool)
+    col_taken = np.zeros(n_cols, dtype=bool)
+    rows, cols = [], []
+    limit = min(n_rows, n_cols)
+    for row, col in zip(*np.divmod(order, n_cols)):
+        if row_taken[row] or col_taken[col]:
+            continue
+        row_taken[row] = col_taken[col] = True
+        rows.append(row)
+        cols.append(col)
+        if len(rows) == limit:
+            break
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+
+def optimal_assignment(cost):
+    """
+    Minimum total cost assignment of rows to columns; returns (rows, columns)
+    التوزيع ذو التكلفة الإجمالية الدنيا للصفوف على الأعمدة؛ يعيد (الصفوف، الأعمدة)
+
+    Shortest augmenting paths with dual potentials (the Jonker-Volgenant
+    form of the Hungarian method); each path search is a loop of vectorized
+    updates over all columns. Pairs costing _INFEASIBLE or more are dropped.
+    """
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n_rows, n_cols = cost.shape
+    u = np.zeros(n_rows)
+    v = np.zeros(n_cols)
+    col_for_row = np.full(n_rows, -1, dtype=int)
+    row_for_col = np.full(n_cols, -1, dtype=int)
+
+    for current in range(n_rows):
+        shortest = np.full(n_cols, np.inf)
+        path = np.full(n_cols, -1, dtype=int)
+        visited_rows = np.zeros(n_rows, dtype=bool)
+        visited_cols = np.zeros(n_cols, dtype=bool)
+        row, min_value, sink = current, 0.0, -1
+        while sink < 0:
+            visited_rows[row] = True
+            reduced = min_value + cost[row] - u[row] - v
+            improved = ~visited_cols & (reduced < shortest)
+            path[improved] = row
+            shortest[improved] = reduced[improved]
+            candidates = np.where(visited_cols, np.inf, shortest)
+            col = int(np.argmin(candidates))
+            min_value = candidates[col]
+            visited_cols[col] = True
+            if row_for_col[col] < 0:
+                sink = col
+            else:
+                row = row_for_col[col]
+
+        u[current] += min_value
+        others = visited_rows.copy()
+        others[current] = False
+        u[others] += min_value - shortest[col_for_row[others]]
+        v[visited_cols] -= min_value - shortest[visited_cols]
+
+        col = sink
+        while True:
+            row = path[col]
+            row_for_col[col] = row
+            col_for_row[row], col = col, col_for_row[row]
+            if row == current:
+                break
+
+    rows = np.arange(n_rows)
+    keep = cost[rows, col_for_row] < _INFEASIBLE
+    rows, cols = rows[keep], col_for_row[keep]
+    return (cols, rows) if transposed else (rows, cols)
+
+
+ASSIGNMENT_METHODS = {'optimal': optimal_assignment, 'greedy': greedy_assignment}
+
+
+def dispatch_cost(agent_lats, agent_lngs, pickup_lats, pickup_lngs, waited_minutes,
+                  max_pickup_km=MAX_PICKUP_KM):
+    """
+    Agent-by-order cost matrix: pickup distance in km, less a credit for waiting
+    مصفوفة تكلفة العمال والطلبات: مسافة الاستلام ناقص رصيد الانتظار
+    """
+    distance = haversine_matrix_km(agent_lats, agent_lngs, pickup_lats, pickup_lngs)
+    credit = np.minimum(np.asarray(waited_minutes, dtype=float) * WAIT_CREDIT_KM_PER_MINUTE, MAX_WAIT_CREDIT_KM)
+    return np.where(distance <= max_pickup_km, distance - credit[None, :], _INFEASIBLE), distance
+
+
+class Dispatcher:
+    """
+    Periodically matches ready orders to available agents
+    يطابق الطلبات الجاهزة مع العمال المتاحين بشكل دوري
+    """
+
+    def __init__(self, method=DISPATCH_METHOD, max_pickup_km=MAX_PICKUP_KM, batch_size=BATCH_SIZE,
+                 lease_seconds=None, location_max_age=LOCATION_MAX_AGE, offer_timeout=OFFER_TIMEOUT):
+        if method not in ASSIGNMENT_METHODS:
+            raise ValueError(f'method must be one of {", ".join(ASSIGNMENT_METHODS)}')
+        self.method = method
+        self.max_pickup_km = max_pickup_km
+        self.batch_size = batch_size
+        self.location_max_age = location_max_age
+        self.offer_timeout = offer_timeout
+        self.lease_seconds = lease_seconds or max(3 * DISPATCH_INTERVAL, 15.0)
+        self.holder = f'{socket.gethostname()}:{os.getpid()}'[:100]
+        self.runs = 0
+        self.skipped = 0
+        self.assigned = 0
+        self.batched = 0
+        self.conflicts = 0
+        self.released = 0
+        self.last_result = None
+
+    def acquire_lease(self):
+        """
+        Take or renew the dispatch lease; False if another worker holds it
+        أخذ عقد التوزيع أو تجديده؛ يعيد False إذا كان لدى عامل آخر
+        """
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        result = db.session.execute(
+            update(DispatchLease)
+            .where(DispatchLease.id == 1, or_(DispatchLease.expires_at <= now, DispatchLease.holder == self.holder))
+            .values(holder=self.holder, expires_at=expires_at)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            db.session.commit()
+            return True
+        db.session.add(DispatchLease(id=1, holder=self.holder, expires_at=expires_at))
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    def release_stale_offers(self):
+        """
+        Return expired offers and offers to unavailable agents to the pool; returns how many
+        إعادة العروض المنتهية والعروض المسندة لعمال غير متاحين إلى المجموعة؛ يعيد عددها
+
+        Only ready orders are touched, so an order picked up meanwhile keeps its agent.
+        """
+        expired = datetime.utcnow() - timedelta(seconds=self.offer_timeout)
+        agent_available = exists().where(
+            DeliveryAgent.id == Order.delivery_agent_id, DeliveryAgent.is_available.is_(True),
+            DeliveryAgent.is_approved.is_(True), DeliveryAgent.is_active.is_(True)
+        )
+        try:
+            result = db.session.execute(
+                update(Order)
+                .where(Order.status == CLAIMABLE_STATUS, Order.delivery_agent_id.isnot(None),
+                       or_(Order.dispatched_at.is_(None), Order.dispatched_at <= expired, ~agent_available))
+                .values(delivery_agent_id=None, dispatched_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return result.rowcount
+
+    def load(self):
+        """
+        (orders, agents) to match
+        الطلبات والعمال المطلوب مطابقتهم
+
+        orders are (id, restaurant_id, pickup lat, pickup lng, drop-off lat,
+        drop-off lng, ready_at) rows, oldest first, as build_batches takes
+        them; agents are (id, lat, lng) rows.
+        """
+        ready_at = func.coalesce(Order.prepared_at, Order.created_at)
+        orders = db.session.query(Order.id, Order.restaurant_id, Restaurant.latitude, Restaurant.longitude,
+                                  Order.delivery_latitude, Order.delivery_longitude, ready_at)\
+            .join(Restaurant, Restaurant.id == Order.restaurant_id)\
+            .filter(Order.status == CLAIMABLE_STATUS, Order.delivery_agent_id.is_(None),
+                    Restaurant.latitude.isnot(None), Restaurant.longitude.isnot(None))\
+            .order_by(ready_at, Order.id).limit(MAX_BATCH).all()
+        if not orders:
+            return orders, []
+        busy = exists().where(Order.delivery_agent_id == DeliveryAgent.id, Order.status.in_(ACTIVE_STATUSES))
+        located_since = datetime.utcnow() - timedelta(seconds=self.location_max_age)
+        agents = db.session.query(DeliveryAgent.id, DeliveryAgent.current_latitude, DeliveryAgent.current_longitude)\
+            .filter(DeliveryAgent.is_available.is_(True), DeliveryAgent.is_approved.is_(True),
+                    DeliveryAgent.is_active.is_(True), DeliveryAgent.current_latitude.isnot(None),
+                    DeliveryAgent.current_longitude.isnot(None),
+                    DeliveryAgent.location_updated_at >= located_since, ~busy)\
+            .order_by(DeliveryAgent.id).limit(MAX_BATCH).all()
+        return orders, agents
+
+    def match(self, orders, agents, now=None):
+        """
+        (Batch, agent_id, pickup_km) triples of the minimum-cost assignment
+        ثلاثيات (الدفعة، العامل، مسافة الاستلام) للتوزيع الأقل تكلفة
+
+        Orders are first grouped into batches (see route_batching); each agent
+        gets at most one batch. Rounds with more than OPTIMAL_MAX_PAIRS
+        agent-batch pairs use the greedy method.
+        """
+        if not orders or not agents:
+            return []
+        batches = build_batches(orders, self.batch_size)
+        now = now or datetime.utcnow()
+        waited = [(now - batch.ready_at).total_seconds() / 60 if batch.ready_at else 0.0 for batch in batches]
+        cost, distance = dispatch_cost(
+            [agent[1] for agent in agents], [agent[2] for agent in agents],
+            [batch.latitude for batch in batches], [batch.longitude for batch in batches],
+            waited, self.max_pickup_km
+        )
+        method = self.method if cost.size <= OPTIMAL_MAX_PAIRS else 'greedy'
+        rows, cols = ASSIGNMENT_METHODS[method](cost)
+        return [(batches[col], agents[row][0], round(float(distance[row, col]), 3))
+                for row, col in zip(rows, cols)]
+
+    def commit(self, assignments):
+        """
+        Write all assignments and batch routes in one transaction; returns the orders assigned
+        كتابة جميع الإسنادات ومسارات الدفعات في معاملة واحدة؛ يعيد عدد الطلبات المسندة
+        """
+        agent_for_order = {order_id: agent_id for batch, agent_id, _ in assignments for order_id in batch.order_ids}
+        if not agent_for_order:
+            return 0
+        order_ids = list(agent_for_order)
+        assigned = 0
+        now = datetime.utcnow()
+        try:
+            for start in range(0, len(order_ids), COMMIT_CHUNK):
+                chunk = {order_id: agent_for_order[order_id] for order_id in order_ids[start:start + COMMIT_CHUNK]}
+                result = db.session.execute(
+                    update(Order)
+                    .where(Order.id.in_(list(chunk)), Order.delivery_agent_id.is_(None),
+                           Order.status == CLAIMABLE_STATUS)
+                    .values(delivery_agent_id=case(chunk, value=Order.id), dispatched_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                assigned += result.rowcount
+            complete = assignments
+            if assigned < len(order_ids):
+                complete, released = self._settle_partial_batches(assignments, order_ids)
+                assigned -= released
+            record_batches([(batch, agent_id) for batch, agent_id, _ in complete])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return assigned
+
+    def _settle_partial_batches(self, assignments, order_ids):
+        # Some orders were taken by hand since load(). A batch missing some of
+        # its orders was planned for a trip that no longer exists: its other
+        # orders are handed back, to be batched again next round, and it is
+        # not recorded. Returns (fully assigned batches, orders released).
+        owner = {}
+        for start in range(0, len(order_ids), COMMIT_CHUNK):
+            owner.update(db.session.query(Order.id, Order.delivery_agent_id)
+                         .filter(Order.id.in_(order_ids[start:start + COMMIT_CHUNK])).all())
+        complete, partial = [], []
+        for assignment in assignments:
+            batch, agent_id, _ = assignment
+            got = [order_id for order_id in batch.order_ids if owner.get(order_id) == agent_id]
+            if len(got) == len(batch.order_ids):
+                complete.append(assignment)
+            else:
+                partial.extend((order_id, agent_id) for order_id in got)
+        released = 0
+        for start in range(0, len(partial), COMMIT_CHUNK):
+            chunk = dict(partial[start:start + COMMIT_CHUNK])
+            # Still ready: only orders this round assigned, never one an agent has picked up
+            result = db.session.execute(
+                update(Order)
+                .where(Order.id.in_(list(chunk)), Order.status == CLAIMABLE_STATUS,
+                       Order.delivery_agent_id == case(chunk, value=Order.id))
+                .values(delivery_agent_id=None, dispatched_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            released += result.rowcount
+        return complete, released
+
+    def run(self):
+        """
+        One dispatch round; returns a summary, or None if another worker holds the lease
+        جولة توزيع واحدة؛ تعيد ملخصاً أو None إذا كان العقد لدى عامل آخر
+        """
+        if not self.acquire_lease():
+            self.skipped += 1
+            return None
+        started = time.perf_counter()
+        released = self.release_stale_offers()
+        orders, agents = self.load()
+        matched = time.perf_counter()
+        assignments = self.match(orders, agents)
+        solved = time.perf_counter()
+        assigned = self.commit(assignments)
+        offered = sum(len(batch.order_ids) for batch, _, _ in assignments)
+        batched = sum(len(batch.order_ids) for batch, _, _ in assignments if len(batch.order_ids) > 1)
+
+        self.runs += 1
+        self.assigned += assigned
+        self.batched += batched
+        self.conflicts += offered - assigned
+        self.released += released
+        self.last_result = {
+            'released': released,
+            'orders': len(orders),
+            'agents': len(agents),
+            'assigned': assigned,
+            'batched': batched,
+            'mean_pickup_km': round(sum(pickup_km for _, _, pickup_km in assignments) / len(assignments), 3)
+                              if assignments else None,
+            'load_ms': round((matched - started) * 1000, 2),
+            'solve_ms': round((solved - matched) * 1000, 2),
+            'total_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+        return self.last_result
+
+    def stats(self):
+        return {
+            'method': self.method,
+            'max_pickup_km': self.max_pickup_km,
+            'batch_size': self.batch_size,
+            'location_max_age': self.location_max_age,
+            'offer_timeout': self.offer_timeout,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'assigned': self.assigned,
+            'batched': self.batched,
+            'conflicts': self.conflicts,
+            'released': self.released,
+            'last_run': self.last_result
+        }
+
+
+dispatcher = Dispatcher()
+
+dispatch_job = register_job(
+    'order_dispatch',
+    dispatcher.run,
+    interval=DISPATCH_INTERVAL,
+    initial_delay=10.0
+)
+
+
+def add_location_timestamp_column():
+    """
+    Add delivery_agents.location_updated_at to existing databases
+    إضافة عمود وقت تحديث الموقع إلى جدول عمال التوصيل الموجود
+
+    Agents keep their last position but are not dispatched until they next report one.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('delivery_agents')}
+    if 'location_updated_at' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE delivery_agents ADD COLUMN location_updated_at DATETIME'))
+
+
+def add_dispatched_at_column():
+    """
+    Add orders.dispatched_at to existing databases
+    إضافة عمود وقت العرض إلى جدول الطلبات الموجود
+
+    Offers made before it existed have no timestamp; the next dispatch round
+    hands them back to the pool.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('orders')}
+    if 'dispatched_at' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE orders ADD COLUMN dispatched_at DATETIME'))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from src.main import app
+
+    with app.app_context():
+        add_location_timestamp_column()
+        add_dispatched_at_column()
+        print('delivery_agents.location_updated_at and orders.dispatched_at ready')
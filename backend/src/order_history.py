@@ -0,0 +1,84 @@
+"""
+Order history for Livreure
+سجل الطلبات لمنصة Livreure
+
+Order lines keep what the customer actually ordered: item_name and
+unit_price are copied from the menu when the order is placed. History
+listings are built from orders and their lines alone, so they need no
+menu lookups and stay correct after the menu is edited or an item removed.
+
+Order listings load the related customer, restaurant, delivery agent and
+lines for the whole page with one IN query per relation (selectinload), so
+a listing runs the same number of queries whatever its page size.
+"""
+
+from sqlalchemy import func, inspect, select, text, update
+from sqlalchemy.orm import selectinload
+
+from src.models.user import db
+from src.models.restaurant import MenuItem
+from src.models.order import Order, OrderItem
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def order_line_summary(item):
+    """
+    One order line as shown in order history
+    سطر من الطلب كما يظهر في سجل الطلبات
+    """
+    return {
+        'name': item.item_name or 'Unknown Item',
+        'quantity': item.quantity,
+        'price': float(item.unit_price)
+    }
+
+
+def with_order_relations(query, *relations):
+    """
+    Batch-load the named Order relations for every order the query returns
+    تحميل علاقات الطلبات المحددة دفعة واحدة لجميع الطلبات المسترجعة
+
+    relations are Order relationship names: 'customer', 'restaurant',
+    'delivery_agent' and 'order_items'.
+    """
+    return query.options(*(selectinload(getattr(Order, relation)) for relation in relations))
+
+
+def backfill_item_names(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Add order_items.item_name if missing and fill it from the menu for existing rows
+    إضافة عمود اسم الطبق إلى أسطر الطلبات إذا لم يكن موجوداً وملؤه للأسطر الحالية
+
+    Works through id ranges so each UPDATE holds its locks briefly. Lines
+    whose menu item no longer exists keep a NULL name.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('order_items')}
+    if 'item_name' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE order_items ADD COLUMN item_name VARCHAR(100)'))
+
+    max_id = db.session.query(func.max(OrderItem.id)).scalar() or 0
+    name = select(MenuItem.name).where(MenuItem.id == OrderItem.menu_item_id).scalar_subquery()
+    updated = 0
+    for start in range(0, max_id, batch_size):
+        result = db.session.execute(
+            update(OrderItem)
+            .where(OrderItem.id > start, OrderItem.id <= start + batch_size,
+                   OrderItem.item_name.is_(None), name.is_not(None))
+            .values(item_name=name)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        updated += result.rowcount
+    return updated
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from src.main import app
+
+    with app.app_context():
+        print(f'Item names set on {backfill_item_names()} order lines')
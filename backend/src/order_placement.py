@@ -0,0 +1,176 @@
+"""
+Order placement for Livreure
+تقديم الطلبات لمنصة Livreure
+
+Carts are priced on the server against the price table of the catalog
+snapshot (the same versioned, in-memory copy of the menus that customers
+browse), so a client can no longer choose what it pays and pricing needs no
+queries. The order row and all of its lines are then written with one INSERT
+per table inside a single transaction.
+
+A client that sends the total it displayed gets a 409 with the server's
+pricing when the two differ, for example after a price change.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from src.models.user import db
+from src.models.order import Order, OrderItem
+from src.catalog_cache import catalog_cache
+
+MAX_LINES = 100
+MAX_QUANTITY = 50
+PAYMENT_METHODS = ('cash', 'card', 'wallet')
+TOTAL_TOLERANCE = 0.01
+
+
+class OrderError(ValueError):
+    """
+    Raised when an order cannot be placed
+    يُرفع عندما لا يمكن تقديم الطلب
+    """
+
+    def __init__(self, message, status_code=400, pricing=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.pricing = pricing
+
+
+def _money(value):
+    return round(value + 1e-9, 2)
+
+
+def _as_id(value, field):
+    # JSON clients often send ids as strings; anything else is a client error, not a missing row
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise OrderError(f'{field} must be an integer')
+    return value
+
+
+def price_cart(restaurant_id, items, snapshot=None):
+    """
+    Price cart lines against the catalog price table
+    تسعير سلة الطلب من جدول أسعار الكتالوج
+
+    items are {"menu_item_id" (or "id"), "quantity", "special_instructions"}.
+    Returns a dict with the priced lines, subtotal, delivery_fee, tax_amount
+    and total_amount. Raises OrderError for unknown, unavailable or foreign
+    items, a closed restaurant or a subtotal under its minimum_order.
+    """
+    restaurant_id = _as_id(restaurant_id, 'restaurant_id')
+    snapshot = snapshot or catalog_cache.snapshot()
+    terms = snapshot.terms.get(restaurant_id)
+    if terms is None:
+        raise OrderError('Restaurant not found', 404)
+    if not terms.is_open:
+        raise OrderError('Restaurant is closed')
+    if not isinstance(items, list) or not items:
+        raise OrderError('Items are required')
+    if len(items) > MAX_LINES:
+        raise OrderError(f'An order can have at most {MAX_LINES} lines')
+
+    lines = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise OrderError('Each item must be an object')
+        item_id = _as_id(item.get('menu_item_id', item.get('id')), 'menu_item_id')
+        quantity = item.get('quantity', 1)
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or not 1 <= quantity <= MAX_QUANTITY:
+            raise OrderError(f'quantity must be an integer between 1 and {MAX_QUANTITY}')
+        price = snapshot.prices.get(item_id)
+        if price is None or price.restaurant_id != restaurant_id:
+            raise OrderError(f'Menu item {item_id} is not on this restaurant\'s menu')
+        if not price.is_available:
+            raise OrderError(f'{price.name} is not available')
+        lines.append({
+            'menu_item_id': item_id,
+            'item_name': price.name,
+            'quantity': quantity,
+            'unit_price': price.price,
+            'total_price': _money(price.price * quantity),
+            'special_instructions': item.get('special_instructions') or ''
+        })
+
+    subtotal = _money(sum(line['total_price'] for line in lines))
+    if subtotal < terms.minimum_order:
+        raise OrderError(f'The minimum order for this restaurant is {terms.minimum_order:g}', 422)
+    return {
+        'restaurant_id': restaurant_id,
+        'catalog_version': snapshot.version,
+        'lines': lines,
+        'subtotal': subtotal,
+        'delivery_fee': terms.delivery_fee,
+        'tax_amount': 0.0,
+        'total_amount': _money(subtotal + terms.delivery_fee),
+        'estimated_delivery_time': terms.estimated_delivery_time
+    }
+
+
+def _estimated_minutes(restaurant_id, default, delivery_latitude=None, delivery_longitude=None):
+    # Imported here: delivery_estimates is loaded by the catalog cache itself
+    from src.eta import eta_predictor
+    from src.delivery_estimates import delivery_estimates
+    measured = eta_predictor.remaining_minutes(restaurant_id, 'pending', None, delivery_latitude, delivery_longitude) \
+        or delivery_estimates.minutes(restaurant_id, 'total_p50')
+    return int(round(measured)) if measured else default
+
+
+def place_order(customer_id, restaurant_id, items, delivery_address, payment_method='cash',
+                delivery_latitude=None, delivery_longitude=None, delivery_notes='', expected_total=None):
+    """
+    Price a cart and write the order with its lines in one transaction
+    تسعير السلة وكتابة الطلب مع أسطره في معاملة واحدة
+
+    Returns (order, pricing); order is built from the inserted values and
+    not attached to the session. expected_total, when given, must match the
+    server's total.
+    """
+    if not delivery_address:
+        raise OrderError('delivery_address is required')
+    if payment_method not in PAYMENT_METHODS:
+        raise OrderError(f'payment_method must be one of {", ".join(PAYMENT_METHODS)}')
+
+    pricing = price_cart(restaurant_id, items)
+    restaurant_id = pricing['restaurant_id']
+    if expected_total is not None:
+        try:
+            expected_total = float(expected_total)
+        except (TypeError, ValueError):
+            raise OrderError('total must be a number')
+        if abs(expected_total - pricing['total_amount']) > TOTAL_TOLERANCE:
+            raise OrderError('Prices have changed, please review your order', 409, pricing)
+
+    now = datetime.utcnow()
+    minutes = _estimated_minutes(restaurant_id, pricing['estimated_delivery_time'], delivery_latitude, delivery_longitude)
+    order_row = {
+        'customer_id': customer_id,
+        'restaurant_id': restaurant_id,
+        'order_number': f"LVR{now.strftime('%Y%m%d')}{str(uuid.uuid4())[:8].upper()}",
+        'status': 'pending',
+        'subtotal': pricing['subtotal'],
+        'delivery_fee': pricing['delivery_fee'],
+        'tax_amount': pricing['tax_amount'],
+        'total_amount': pricing['total_amount'],
+        'delivery_address': delivery_address,
+        'delivery_latitude': delivery_latitude,
+        'delivery_longitude': delivery_longitude,
+        'delivery_notes': delivery_notes or '',
+        'payment_method': payment_method,
+        'payment_status': 'pending',
+        'created_at': now,
+        'estimated_delivery_time': now + timedelta(minutes=minutes)
+    }
+    try:
+        order_id = db.session.execute(insert(Order).values(order_row)).inserted_primary_key[0]
+        db.session.execute(insert(OrderItem), [dict(line, order_id=order_id) for line in pricing['lines']])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return Order(id=order_id, **order_row), pricing
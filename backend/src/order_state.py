@@ -0,0 +1,300 @@
+"""
+Order state machine for Livreure
+آلة حالات الطلب لمنصة Livreure
+
+Every change of an order's status goes through transition_orders: the
+tracking API, the order status endpoints of the API and the dashboards,
+agents claiming and delivering orders, and bulk updates such as a
+restaurant marking fifteen orders ready at once. A transition is allowed
+when OrderTrackingService.STATUS_FLOW lists it from the order's current
+status and, for requests made on behalf of a user, when ACTOR_STATUSES lets
+that kind of user set it on an order of theirs.
+
+Any number of orders moves in one transaction of set-based statements: one
+SELECT reads them, one UPDATE moves the allowed ones (guarded by the
+statuses they may come from, with a CASE giving each its estimated delivery
+time), then one INSERT writes their tracking rows and one their
+notifications. Delivered orders add to their agents' delivery counts with
+one more UPDATE. The rows are read FOR UPDATE where the database supports
+it; where it does not, an order changed by another request between the read
+and the write makes the guarded UPDATE match fewer rows than expected, and
+the transition is rolled back and retried against the new statuses.
+
+A delivery agent claiming a single order takes a shorter path, claim_transition:
+no locking read and no retry, just one UPDATE that only one agent can win.
+"""
+
+import json
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import case, func, or_, update
+
+from src.models.user import db
+from src.models.order import Order
+from src.models.delivery_agent import DeliveryAgent
+from src.notifications import Notification, order_notification
+from src.order_tracking import OrderTracking, OrderTrackingService
+from src.principal_cache import principal_cache
+
+MAX_BULK_TRANSITIONS = 500
+MAX_ATTEMPTS = 3
+
+STATUS_FLOW = OrderTrackingService.STATUS_FLOW
+
+# Order column stamped when the order reaches a status
+TIMESTAMP_COLUMNS = {
+    'confirmed': 'confirmed_at',
+    'ready': 'prepared_at',
+    'picked_up': 'picked_up_at',
+    'delivered': 'delivered_at'
+}
+
+# Statuses each kind of user may set on their own orders; admins may set any
+ACTOR_STATUSES = {
+    'restaurant': ('confirmed', 'preparing', 'ready', 'cancelled'),
+    'delivery_agent': ('picked_up', 'delivered'),
+    'customer': ('cancelled',)
+}
+OWNER_COLUMNS = {
+    'restaurant': 'restaurant_id',
+    'delivery_agent': 'delivery_agent_id',
+    'customer': 'customer_id'
+}
+CUSTOMER_CANCELLABLE = ('pending',)  # customers can only cancel orders nobody has confirmed
+
+# Why an order was left as it was
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+INVALID = 'invalid_transition'
+ASSIGNED = 'already_assigned'
+
+REFUSALS = {
+    NOT_FOUND: ('Order not found', 404),
+    FORBIDDEN: ('Not allowed to set this status on the order', 403),
+    INVALID: ('Cannot change status from {current} to {new}', 400),
+    ASSIGNED: ('Order already assigned to another delivery agent', 400)
+}
+
+# updated: ids of the orders moved; refused: order id -> reason; previous: order id -> status before
+Transition = namedtuple('Transition', 'updated refused previous')
+
+_COLUMNS = (Order.id, Order.status, Order.customer_id, Order.restaurant_id, Order.delivery_agent_id,
+            Order.order_number, Order.total_amount, Order.delivery_latitude, Order.delivery_longitude)
+
+
+class _Conflict(Exception):
+    pass
+
+
+def refusal_message(reason, current_status=None, new_status=None):
+    """
+    English message and HTTP status for a refusal reason, as (message, status_code)
+    الرسالة ورمز HTTP لسبب الرفض على شكل (رسالة، رمز الحالة)
+    """
+    message, status_code = REFUSALS[reason]
+    return message.format(current=current_status, new=new_status), status_code
+
+
+def refusal(order, new_status, updated_by=None, updated_by_type=None, authorize=False, assign_to=None):
+    """
+    Why order may not move to new_status, or None if it may
+    سبب منع انتقال الطلب إلى الحالة الجديدة، أو None إذا كان مسموحاً
+    """
+    if authorize and updated_by_type != 'admin':
+        owner = OWNER_COLUMNS.get(updated_by_type)
+        if owner is None or getattr(order, owner) != updated_by:
+            return FORBIDDEN
+        if new_status not in ACTOR_STATUSES[updated_by_type]:
+            return FORBIDDEN
+        if updated_by_type == 'customer' and order.status not in CUSTOMER_CANCELLABLE:
+            return FORBIDDEN
+    if new_status not in STATUS_FLOW.get(order.status, []):
+        return INVALID
+    if assign_to is not None and order.delivery_agent_id is not None:
+        return ASSIGNED
+    return None
+
+
+def transition_orders(order_ids, new_status, updated_by=None, updated_by_type=None, notes=None,
+                      location_lat=None, location_lng=None, authorize=False, assign_to=None, atomic=False):
+    """
+    Move orders to new_status in one transaction; returns a Transition
+    نقل الطلبات إلى الحالة الجديدة في معاملة واحدة؛ يعيد Transition
+
+    updated_by and updated_by_type are recorded on the tracking rows; with
+    authorize they are also checked against ACTOR_STATUSES and the orders'
+    owners. assign_to gives unassigned orders to that delivery agent as they
+    move. Orders that may not move are reported in refused and the others
+    are moved, unless atomic is set, in which case nothing moves when any
+    order is refused.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            rows = db.session.query(*_COLUMNS).filter(Order.id.in_(order_ids)).with_for_update().all()
+            previous = {row.id: row.status for row in rows}
+            refused = {order_id: NOT_FOUND for order_id in order_ids if order_id not in previous}
+            allowed = []
+            for row in rows:
+                reason = refusal(row, new_status, updated_by, updated_by_type, authorize, assign_to)
+                if reason:
+                    refused[row.id] = reason
+                else:
+                    allowed.append(row)
+
+            delivering_agents = []
+            if allowed and not (atomic and refused):
+                delivering_agents = _apply(allowed, new_status, updated_by, updated_by_type, notes,
+                                           location_lat, location_lng, assign_to)
+            else:
+                allowed = []
+            db.session.commit()
+            # Agent principals carry total_deliveries
+            for agent_id in delivering_agents:
+                principal_cache.invalidate('delivery_agent', agent_id)
+            return Transition([row.id for row in allowed], refused, previous)
+        except _Conflict:
+            db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            raise
+    raise RuntimeError('Orders kept changing during the status update; try again')
+
+
+def claim_transition(order_id, new_status, agent_id):
+    """
+    Move one order to new_status as agent_id's, without locking; True if this agent got it
+    نقل طلب واحد إلى الحالة الجديدة باسم العامل دون قفل؛ يعيد True إذا حصل عليه هذا العامل
+
+    The order may be unassigned or already assigned to agent_id. It is read
+    without a lock and moved by one UPDATE guarded by the statuses it may
+    come from and by its assignment, so the database applies it for at most
+    one agent and the affected row count says who won. Agents who lose
+    write nothing and are not retried; the winner's tracking row and
+    notification are written in the same transaction.
+    """
+    row = db.session.query(*_COLUMNS).filter(Order.id == order_id).first()
+    if row is None or refusal(row, new_status) or row.delivery_agent_id not in (None, agent_id):
+        db.session.rollback()
+        return False
+    try:
+        now = datetime.utcnow()
+        arrivals = _arrivals([row], new_status, now)
+        values = dict(_status_values(new_status, now), delivery_agent_id=agent_id)
+        if arrivals:
+            values['estimated_delivery_time'] = arrivals[order_id]
+        # Built before the UPDATE so the winner holds the order's lock for as few round trips as possible
+        records = _records([SimpleNamespace(**dict(row._asdict(), delivery_agent_id=agent_id))],
+                           new_status, now, arrivals, agent_id, 'delivery_agent')
+        result = db.session.execute(
+            update(Order)
+            .where(Order.id == order_id, Order.status.in_(_sources(new_status)),
+                   or_(Order.delivery_agent_id.is_(None), Order.delivery_agent_id == agent_id))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            return False
+        _insert_records(*records)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True
+
+
+def _sources(new_status):
+    # Statuses an order may move to new_status from
+    return [status for status, following in STATUS_FLOW.items() if new_status in following]
+
+
+def _arrivals(rows, new_status, now):
+    arrivals = {}
+    if new_status in OrderTrackingService.ESTIMATED_TIMES:
+        for row in rows:
+            minutes = OrderTrackingService.estimated_minutes(
+                row.restaurant_id, new_status, row.delivery_latitude, row.delivery_longitude
+            )
+            if minutes > 0:
+                arrivals[row.id] = now + timedelta(minutes=minutes)
+    return arrivals
+
+
+def _status_values(new_status, now):
+    values = {'status': new_status}
+    if new_status in TIMESTAMP_COLUMNS:
+        values[TIMESTAMP_COLUMNS[new_status]] = now
+    if new_status == 'delivered':
+        # Cash is collected at the door; other methods are settled when the order is placed
+        values['payment_status'] = case((Order.payment_method == 'cash', 'paid'), else_=Order.payment_status)
+    return values
+
+
+def _records(rows, new_status, now, arrivals, updated_by, updated_by_type, notes=None,
+             location_lat=None, location_lng=None):
+    # (tracking rows, notifications) for orders moving to new_status
+    tracking = [{
+        'order_id': row.id,
+        'status': new_status,
+        'location_latitude': location_lat,
+        'location_longitude': location_lng,
+        'notes': notes,
+        'estimated_arrival': arrivals.get(row.id),
+        'actual_time': now,
+        'updated_by': updated_by,
+        'updated_by_type': updated_by_type
+    } for row in rows]
+
+    notifications = []
+    for row in rows:
+        for user_type in OrderTrackingService.notified_user_types(row, new_status):
+            notification = order_notification(row, new_status, user_type)
+            if notification:
+                notification.update(data=json.dumps(notification['data']), is_read=False, created_at=now)
+                notifications.append(notification)
+    return tracking, notifications
+
+
+def _insert_records(tracking, notifications):
+    db.session.execute(OrderTracking.__table__.insert(), tracking)
+    if notifications:
+        db.session.execute(Notification.__table__.insert(), notifications)
+
+
+def _apply(rows, new_status, updated_by, updated_by_type, notes, location_lat, location_lng, assign_to):
+    now = datetime.utcnow()
+    arrivals = _arrivals(rows, new_status, now)
+
+    values = _status_values(new_status, now)
+    if arrivals:
+        values['estimated_delivery_time'] = case(arrivals, value=Order.id, else_=Order.estimated_delivery_time)
+    conditions = [Order.id.in_([row.id for row in rows]), Order.status.in_(_sources(new_status))]
+    if assign_to is not None:
+        values['delivery_agent_id'] = assign_to
+        conditions.append(Order.delivery_agent_id.is_(None))
+
+    result = db.session.execute(
+        update(Order).where(*conditions).values(**values).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(rows):
+        raise _Conflict()
+
+    if assign_to is not None:
+        rows = [SimpleNamespace(**dict(row._asdict(), delivery_agent_id=assign_to)) for row in rows]
+    _insert_records(*_records(rows, new_status, now, arrivals, updated_by, updated_by_type,
+                              notes, location_lat, location_lng))
+
+    deliveries = Counter(row.delivery_agent_id for row in rows if row.delivery_agent_id)
+    if new_status == 'delivered' and deliveries:
+        db.session.execute(
+            update(DeliveryAgent)
+            .where(DeliveryAgent.id.in_(list(deliveries)))
+            .values(total_deliveries=func.coalesce(DeliveryAgent.total_deliveries, 0)
+                    + case(deliveries, value=DeliveryAgent.id, else_=0))
+            .execution_options(synchronize_session=False)
+        )
+        return list(deliveries)
+    return []
@@ -6,7 +6,6 @@ Enhanced Order Tracking System for Livreure
 from datetime import datetime, timedelta
 from src.models.user import db
 from src.models.order import Order
-from src.notifications import send_order_notification
 import json
 
 class OrderTracking(db.Model):
@@ -68,7 +67,7 @@ class OrderTrackingService:
         'cancelled': 'تم إلغاء الطلب'
     }
     
-    # Estimated time for each status (in minutes)
+    # Estimated time for each status (in minutes), used until src.eta has enough delivered orders
     ESTIMATED_TIMES = {
         'confirmed': 5,
         'preparing': 25,
@@ -77,6 +76,35 @@ class OrderTrackingService:
         'delivered': 0
     }
     
+    # Measured percentile used instead of ESTIMATED_TIMES once a restaurant has enough history
+    MEASURED_TIMES = {
+        'preparing': 'prep_p50',
+        'picked_up': 'delivery_p50'
+    }
+    
+    @staticmethod
+    def estimated_minutes(restaurant_id, status, delivery_lat=None, delivery_lng=None):
+        """
+        Minutes until delivery once the order reaches status
+        الدقائق المتوقعة حتى التوصيل عند بلوغ الطلب هذه الحالة
+        
+        Predicted by the learned ETA model when it covers the status, else taken
+        from the restaurant's delivery history or the fixed ESTIMATED_TIMES.
+        """
+        # Imported here: both modules read the tracking table defined above
+        from src.eta import eta_predictor
+        from src.delivery_estimates import delivery_estimates
+        
+        predicted = eta_predictor.remaining_minutes(restaurant_id, status, datetime.utcnow(), delivery_lat, delivery_lng)
+        if predicted is not None:
+            return predicted
+        field = OrderTrackingService.MEASURED_TIMES.get(status)
+        if field:
+            measured = delivery_estimates.minutes(restaurant_id, field)
+            if measured:
+                return measured
+        return OrderTrackingService.ESTIMATED_TIMES.get(status, 0)
+    
     @staticmethod
     def update_order_status(order_id, new_status, updated_by=None, updated_by_type=None, 
                           location_lat=None, location_lng=None, notes=None):
@@ -84,63 +112,24 @@ class OrderTrackingService:
         Update order status with tracking
         تحديث حالة الطلب مع التتبع
         """
+        # Imported here: the state machine builds on this service
+        from src.order_state import NOT_FOUND, transition_orders
+        
         try:
-            order = Order.query.get(order_id)
-            if not order:
-                return False, "الطلب غير موجود"
-            
-            # Check if status transition is valid
-            current_status = order.status
-            if new_status not in OrderTrackingService.STATUS_FLOW.get(current_status, []):
-                return False, f"لا يمكن تغيير الحالة من {current_status} إلى {new_status}"
-            
-            # Calculate estimated arrival time
-            estimated_arrival = None
-            if new_status in OrderTrackingService.ESTIMATED_TIMES:
-                estimated_minutes = OrderTrackingService.ESTIMATED_TIMES[new_status]
-                if estimated_minutes > 0:
-                    estimated_arrival = datetime.utcnow() + timedelta(minutes=estimated_minutes)
-            
-            # Create tracking record
-            tracking = OrderTracking(
-                order_id=order_id,
-                status=new_status,
-                location_latitude=location_lat,
-                location_longitude=location_lng,
-                notes=notes,
-                estimated_arrival=estimated_arrival,
-                updated_by=updated_by,
-                updated_by_type=updated_by_type
+            result = transition_orders(
+                [order_id], new_status, updated_by, updated_by_type,
+                notes=notes, location_lat=location_lat, location_lng=location_lng
             )
-            
-            # Update order status and timestamps
-            order.status = new_status
-            
-            if new_status == 'confirmed':
-                order.confirmed_at = datetime.utcnow()
-            elif new_status == 'ready':
-                order.prepared_at = datetime.utcnow()
-            elif new_status == 'picked_up':
-                order.picked_up_at = datetime.utcnow()
-            elif new_status == 'delivered':
-                order.delivered_at = datetime.utcnow()
-            
-            # Update estimated delivery time
-            if estimated_arrival:
-                order.estimated_delivery_time = estimated_arrival
-            
-            db.session.add(tracking)
-            db.session.commit()
-            
-            # Send notifications
-            OrderTrackingService._send_status_notifications(order, new_status)
-            
-            return True, "تم تحديث حالة الطلب بنجاح"
-            
         except Exception as e:
-            db.session.rollback()
             print(f"Error updating order status: {e}")
             return False, "حدث خطأ في تحديث حالة الطلب"
+        
+        reason = result.refused.get(order_id)
+        if reason == NOT_FOUND:
+            return False, "الطلب غير موجود"
+        if reason:
+            return False, f"لا يمكن تغيير الحالة من {result.previous[order_id]} إلى {new_status}"
+        return True, "تم تحديث حالة الطلب بنجاح"
     
     @staticmethod
     def get_order_tracking_history(order_id):
@@ -254,21 +243,23 @@ class OrderTrackingService:
         return metrics
     
     @staticmethod
-    def _send_status_notifications(order, new_status):
+    def notified_user_types(order, new_status):
         """
-        Send notifications for status updates
-        إرسال إشعارات لتحديثات الحالة
+        Who is notified when an order reaches new_status
+        من يتم إشعاره عند بلوغ الطلب الحالة الجديدة
         """
-        # Send to customer
-        send_order_notification(order, new_status, 'customer')
+        # The customer hears about every status
+        user_types = ['customer']
         
-        # Send to restaurant for new orders
+        # The restaurant about new orders
         if new_status == 'confirmed':
-            send_order_notification(order, new_status, 'restaurant')
+            user_types.append('restaurant')
         
-        # Send to delivery agent when order is ready
+        # The delivery agent when the order is ready
         if new_status == 'ready' and order.delivery_agent_id:
-            send_order_notification(order, new_status, 'delivery_agent')
+            user_types.append('delivery_agent')
+        
+        return user_types
     
     @staticmethod
     def get_restaurant_orders_summary(restaurant_id, date=None):
@@ -0,0 +1,92 @@
+"""
+Keyset Pagination for Livreure list endpoints
+ترقيم الصفحات بالمفاتيح لنقاط النهاية الخاصة بالقوائم
+
+Pages are ordered newest first on (created_at, id) and continue from an
+opaque cursor holding the last row's (created_at, id), so fetching page N
+costs the same index range scan as page 1 (no OFFSET).
+
+Rows without a created_at sort after every dated row (SQLite and MySQL
+order NULL lowest, so they come last in a descending scan) and page by id
+alone among themselves; their cursors carry a null created_at.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor cannot be decoded
+    يُرفع عندما يتعذر فك المؤشر
+    """
+
+
+def encode_cursor(created_at, row_id):
+    payload = json.dumps([created_at.isoformat() if created_at else None, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return (datetime.fromisoformat(created_at) if created_at is not None else None), int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor('Invalid pagination cursor')
+
+
+def page_args():
+    """
+    Read cursor and limit from the query string, capping the page size
+    قراءة المؤشر وحجم الصفحة من الطلب مع تحديد الحد الأقصى
+    """
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    return request.args.get('cursor'), limit
+
+
+def paginate_keyset(query, model, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return (rows, next_cursor) for one page of query, newest first
+    إرجاع (الصفوف، المؤشر التالي) لصفحة واحدة مرتبة من الأحدث
+
+    next_cursor is None on the last page.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        if created_at is None:
+            query = query.filter(model.created_at.is_(None), model.id < row_id)
+        else:
+            query = query.filter(or_(
+                model.created_at < created_at,
+                and_(model.created_at == created_at, model.id < row_id),
+                model.created_at.is_(None)
+            ))
+
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+
+def next_page_headers(next_cursor):
+    """
+    Response headers for list-shaped endpoints whose body is a bare JSON array
+    ترويسات الاستجابة لنقاط النهاية التي تُرجع مصفوفة JSON مباشرة
+
+    X-Next-Cursor is listed in the CORS expose_headers in main.py, otherwise
+    browser clients could not read it and would never get past page one.
+    """
+    return {'X-Next-Cursor': next_cursor} if next_cursor else {}
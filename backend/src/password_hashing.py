@@ -0,0 +1,168 @@
+"""
+Bounded password hashing for Livreure
+تحديد عدد عمليات تشفير كلمات المرور المتزامنة
+
+generate_password_hash/check_password_hash are deliberately slow and CPU
+bound. Running them unchecked lets a login burst occupy every gunicorn worker
+and every core. At most PASSWORD_HASH_WORKERS hashes run at once on the host,
+a limit shared by all gunicorn workers through lock files, which caps the CPU
+hashing may use whatever the number of workers.
+
+A login that finds every slot taken is turned away with 429 at once. It never
+waits for a slot: the deployed workers are sync, and a worker waiting on a
+hash is a worker not serving anything else. Once started a hash runs to
+completion in the request's own thread (hashlib releases the GIL, so
+threaded workers keep serving). Where fcntl is unavailable the limit falls
+back to the current process.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: limits apply per process
+    fcntl = None
+
+class HashingPoolSaturated(Exception):
+    """
+    Raised when every hashing slot on the host is taken
+    يُرفع عندما تكون جميع خانات التشفير على الخادم مشغولة
+    """
+
+
+class HostSlots:
+    """
+    A fixed number of slots shared by every process on the host
+    عدد ثابت من الخانات مشترك بين جميع العمليات على الخادم
+
+    Each slot is a lock file held with flock(); the lock is dropped when its
+    file is closed, including when the process holding it dies.
+    """
+
+    def __init__(self, directory, name, count):
+        self.count = count
+        self._paths = [os.path.join(directory, f'{name}-{index}.lock') for index in range(count)]
+        self._local = threading.BoundedSemaphore(count) if fcntl is None and count > 0 else None
+        if fcntl is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self):
+        """
+        Take a free slot without waiting; returns a handle for release() or None
+        حجز خانة حرة دون انتظار؛ يعيد مقبضاً لـ release() أو None
+        """
+        if self._local is not None:
+            return True if self._local.acquire(blocking=False) else None
+        for path in self._paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def release(self, handle):
+        if self._local is not None:
+            self._local.release()
+        else:
+            os.close(handle)
+
+
+class PasswordHashingPool:
+    """
+    Host-wide concurrency limit for hashing, with latency metrics
+    حد التزامن للتشفير على مستوى الخادم مع مقاييس زمن الاستجابة
+    """
+
+    def __init__(self, workers=2, latency_window=1024, lock_dir=None):
+        self.workers = workers
+        lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), 'livreure-password-hashing')
+        self._running = HostSlots(lock_dir, 'running', workers) if workers > 0 else None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def run(self, fn, *args):
+        """
+        Run fn(*args) in a free slot, raising HashingPoolSaturated at once when there is none
+        تنفيذ الدالة في خانة حرة مع رفع استثناء فوراً عند عدم وجودها
+        """
+        running = self._running.try_acquire() if self._running else True
+        if running is None:
+            with self._lock:
+                self.rejected += 1
+            raise HashingPoolSaturated('Password hashing is at capacity')
+
+        started = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            result = fn(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            if self._running:
+                self._running.release(running)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.completed += 1
+            self._latencies.append(elapsed_ms)
+        return result
+
+    def metrics(self):
+        """
+        Get queue depth and latency metrics
+        الحصول على عمق القائمة ومقاييس زمن الاستجابة
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            in_flight = self.in_flight
+            completed = self.completed
+            rejected = self.rejected
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2)
+
+        return {
+            'scope': 'host' if fcntl is not None else 'process',
+            'workers': self.workers,
+            'in_flight': in_flight,  # this worker's hashes running
+            'completed': completed,
+            'rejected': rejected,
+            'latency_ms_p50': percentile(0.50),
+            'latency_ms_p95': percentile(0.95),
+            'latency_ms_max': round(latencies[-1], 2) if latencies else None
+        }
+
+
+hashing_pool = PasswordHashingPool(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+    lock_dir=os.environ.get('PASSWORD_HASH_LOCK_DIR')
+)
+
+
+def hash_password(password):
+    """
+    Hash a password within the hashing limit
+    تشفير كلمة المرور ضمن حد التشفير
+    """
+    return hashing_pool.run(generate_password_hash, password)
+
+
+def check_password(password_hash, password):
+    """
+    Verify a password against its hash within the hashing limit
+    التحقق من كلمة المرور مقابل التشفير ضمن حد التشفير
+    """
+    return hashing_pool.run(check_password_hash, password_hash, password)
@@ -0,0 +1,230 @@
+"""
+Authenticated principal cache for Livreure
+ذاكرة تخزين مؤقت للمستخدمين المصادق عليهم
+
+token_required used to run one SELECT per request just to turn the JWT
+claims back into a Customer/Restaurant/DeliveryAgent/Admin row. This module
+keeps a bounded, TTL-based copy of those rows keyed by (user_type, user_id)
+and re-attaches them to the request session without touching the database.
+
+Writes made through the ORM in this worker drop the entry at once. Writes
+from other workers or from bulk UPDATE statements are not seen by those
+hooks, so an entry whose account status (SECURITY_COLUMNS) has not been
+checked for PRINCIPAL_RECHECK_INTERVAL seconds is re-read with one narrow
+SELECT before it is served: a suspended account loses access within that
+interval instead of the full TTL. The same SELECT reads the counters that
+reviews and deliveries move with bulk UPDATEs (COUNTER_COLUMNS), so a new
+rating or delivery shows up on every worker within the interval too.
+Password hashes are never cached; routes that need one load it from the
+database.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from src.models.user import db
+from src.models.customer import Customer
+from src.models.restaurant import Restaurant
+from src.models.delivery_agent import DeliveryAgent
+from src.models.admin import Admin
+
+# Models a JWT user_type can resolve to
+PRINCIPAL_MODELS = {
+    'customer': Customer,
+    'restaurant': Restaurant,
+    'delivery_agent': DeliveryAgent,
+    'admin': Admin
+}
+
+_MODEL_TYPES = {model: user_type for user_type, model in PRINCIPAL_MODELS.items()}
+
+# Account status and counter columns re-read every recheck interval, and columns never cached
+SECURITY_COLUMNS = ('is_active', 'is_approved')
+COUNTER_COLUMNS = ('rating_count', 'total_deliveries')
+UNCACHED_COLUMNS = ('password_hash',)
+
+
+class PrincipalCache:
+    """
+    Bounded LRU cache of principal column values with a per-entry TTL
+    ذاكرة LRU محدودة لبيانات المستخدمين مع مدة صلاحية لكل عنصر
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=300, recheck_seconds=10):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.recheck_seconds = recheck_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.rechecks = 0
+
+    def get(self, user_type, user_id):
+        """
+        Return (column values, recheck due) or None on miss/expiry
+        إرجاع (القيم المخزنة، هل حان وقت إعادة التحقق) أو None في حالة عدم الوجود أو انتهاء الصلاحية
+        """
+        key = (user_type, user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, recheck_at, values = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return values, recheck_at <= now
+
+    def set(self, user_type, user_id, values):
+        """
+        Store column values for a principal, evicting the least recently used entry
+        تخزين بيانات المستخدم مع حذف العنصر الأقل استخداماً
+        """
+        key = (user_type, user_id)
+        with self._lock:
+            now = time.monotonic()
+            self._entries[key] = (now + self.ttl_seconds, now + self.recheck_seconds, values)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def confirm(self, user_type, user_id):
+        """
+        Mark a principal's account status as just checked
+        تسجيل أن حالة حساب المستخدم تم التحقق منها للتو
+        """
+        key = (user_type, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], time.monotonic() + self.recheck_seconds, entry[2])
+            self.rechecks += 1
+
+    def invalidate(self, user_type, user_id):
+        """
+        Drop a principal so the next request reloads it
+        حذف المستخدم ليتم تحميله من جديد في الطلب التالي
+        """
+        with self._lock:
+            if self._entries.pop((user_type, user_id), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get cache counters for monitoring
+        الحصول على عدادات الذاكرة للمراقبة
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'recheck_seconds': self.recheck_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'rechecks': self.rechecks
+            }
+
+
+principal_cache = PrincipalCache(
+    max_entries=int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000)),
+    ttl_seconds=float(os.environ.get('PRINCIPAL_CACHE_TTL', 300)),
+    recheck_seconds=float(os.environ.get('PRINCIPAL_RECHECK_INTERVAL', 10))
+)
+
+
+def _snapshot(instance):
+    state = inspect(instance)
+    return {
+        attr.key: getattr(instance, attr.key)
+        for attr in state.mapper.column_attrs
+        if attr.key not in state.unloaded and attr.key not in UNCACHED_COLUMNS
+    }
+
+
+def _security_state_current(model, user_type, user_id, values):
+    # One narrow SELECT of the rechecked columns; False when they changed or the row is gone
+    columns = [column for column in SECURITY_COLUMNS + COUNTER_COLUMNS if hasattr(model, column)]
+    row = db.session.query(*[getattr(model, column) for column in columns]).filter(model.id == user_id).first()
+    if row is None or any(values.get(column) != current for column, current in zip(columns, row)):
+        principal_cache.invalidate(user_type, user_id)
+        return False
+    principal_cache.confirm(user_type, user_id)
+    return True
+
+
+def load_principal(user_type, user_id):
+    """
+    Resolve a JWT principal to a session-bound model instance, using the cache when possible
+    تحويل بيانات JWT إلى كائن المستخدم مع استخدام الذاكرة المؤقتة عند الإمكان
+    """
+    model = PRINCIPAL_MODELS.get(user_type)
+    if model is None:
+        return None
+
+    cached = principal_cache.get(user_type, user_id)
+    values = None
+    if cached is not None:
+        values, recheck = cached
+        if recheck and not _security_state_current(model, user_type, user_id, values):
+            values = None
+    if values is not None:
+        # Rebuild a detached instance and merge it without emitting a SELECT;
+        # uncached columns stay unloaded and are fetched on first access
+        instance = model()
+        for key, value in values.items():
+            setattr(instance, key, value)
+        make_transient_to_detached(instance)
+        return db.session.merge(instance, load=False)
+
+    instance = model.query.get(user_id)
+    if instance is not None:
+        principal_cache.set(user_type, user_id, _snapshot(instance))
+    return instance
+
+
+# Invalidate cached principals whenever one of their rows is written.
+# Keys are collected at flush time and dropped once the transaction commits.
+
+@event.listens_for(Session, 'before_flush')
+def _collect_principal_changes(session, flush_context, instances):
+    changed = session.info.setdefault('principal_changes', set())
+    for instance in list(session.dirty) + list(session.deleted):
+        user_type = _MODEL_TYPES.get(type(instance))
+        if user_type is None or instance.id is None:
+            continue
+        if instance in session.deleted or session.is_modified(instance):
+            changed.add((user_type, instance.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_principal_changes(session):
+    for user_type, user_id in session.info.pop('principal_changes', ()):
+        principal_cache.invalidate(user_type, user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_principal_changes(session, previous_transaction):
+    session.info.pop('principal_changes', None)
@@ -0,0 +1,278 @@
+"""
+Shared rate limit storage backends for Livreure
+واجهات تخزين مشتركة لمحدد معدل الطلبات
+
+The in-process limiter only sees the requests handled by its own gunicorn
+worker, so with three workers the effective limit is three times the
+configured one. These backends hold the per-window counters somewhere every
+worker on the host (SQLite file) or in the cluster (Redis) can see them.
+
+Every backend implements one batched, atomic operation:
+
+    increment([(key, window, window_seconds, amount), ...])
+        -> [(current_count, previous_count), ...]
+
+which adds amount to the counter of (key, window) and returns the counts
+of that window and the one before it after the increment. An amount of 0
+is a plain read.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class RateLimitBackend:
+    """
+    Interface for rate limit counter stores
+    واجهة مخازن عدادات تحديد المعدل
+    """
+
+    def increment(self, entries):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """
+    Process-local counters, mainly for development and tests
+    عدادات محلية للعملية، للتطوير والاختبار أساساً
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def increment(self, entries):
+        now = time.time()
+        results = []
+        with self._lock:
+            for key, window, window_seconds, amount in entries:
+                current = self._counts.get((key, window), (0, 0))[0] + amount
+                self._counts[(key, window)] = (current, now + 2 * window_seconds)
+                previous = self._counts.get((key, window - 1), (0, 0))[0]
+                results.append((current, previous))
+            if len(self._counts) > 10000:
+                self._counts = {k: v for k, v in self._counts.items() if v[1] > now}
+        return results
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """
+    Counters in a SQLite file shared by every worker on the host
+    عدادات في ملف SQLite مشترك بين جميع العمليات على الخادم
+    """
+
+    def __init__(self, path, cleanup_interval=60):
+        self.path = path
+        self.cleanup_interval = cleanup_interval
+        self._conn = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    def _connection(self):
+        # Connections must not be shared across a fork
+        pid = os.getpid()
+        if self._conn is None or self._conn_pid != pid:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limit_counters ('
+                'key TEXT NOT NULL, window_index INTEGER NOT NULL, count INTEGER NOT NULL, '
+                'expires_at REAL NOT NULL, PRIMARY KEY (key, window_index)) WITHOUT ROWID'
+            )
+            self._conn = conn
+            self._conn_pid = pid
+        return self._conn
+
+    def increment(self, entries):
+        now = time.time()
+        results = []
+        with self._lock:
+            conn = self._connection()
+            # BEGIN IMMEDIATE takes the write lock up front, making the batch atomic
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key, window, window_seconds, amount in entries:
+                    if amount:
+                        conn.execute(
+                            'INSERT INTO rate_limit_counters (key, window_index, count, expires_at) '
+                            'VALUES (?, ?, ?, ?) '
+                            'ON CONFLICT (key, window_index) DO UPDATE SET count = count + excluded.count',
+                            (key, window, amount, now + 2 * window_seconds)
+                        )
+                    counts = dict(conn.execute(
+                        'SELECT window_index, count FROM rate_limit_counters '
+                        'WHERE key = ? AND window_index IN (?, ?)',
+                        (key, window, window - 1)
+                    ).fetchall())
+                    results.append((counts.get(window, 0), counts.get(window - 1, 0)))
+                if now - self._last_cleanup >= self.cleanup_interval:
+                    conn.execute('DELETE FROM rate_limit_counters WHERE expires_at < ?', (now,))
+                    self._last_cleanup = now
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return results
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Counters in Redis, spoken over a minimal RESP client
+    عدادات في Redis عبر عميل RESP بسيط
+
+    Each batch is sent as a single pipeline of INCRBY/EXPIRE/GET commands,
+    so any server speaking the Redis protocol works, including a local
+    stand-in for tests.
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=1.0, prefix='rl:'):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.prefix = prefix
+        self._sock = None
+        self._sock_pid = None
+        self._buffer = b''
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip('/') or 0)
+        return cls(host=parsed.hostname or 'localhost', port=parsed.port or 6379,
+                   db=db, password=parsed.password)
+
+    def _connect(self):
+        pid = os.getpid()
+        if self._sock is None or self._sock_pid != pid:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._sock = sock
+            self._sock_pid = pid
+            self._buffer = b''
+            setup = []
+            if self.password:
+                setup.append(('AUTH', self.password))
+            if self.db:
+                setup.append(('SELECT', self.db))
+            if setup:
+                self._pipeline(setup)
+        return self._sock
+
+    @staticmethod
+    def _encode(command):
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _readline(self):
+        while b'\r\n' not in self._buffer:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('Redis connection closed')
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\r\n', 1)
+        return line
+
+    def _read_reply(self):
+        line = self._readline()
+        kind, payload = line[:1], line[1:]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise RuntimeError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            while len(self._buffer) < length + 2:
+                chunk = self._sock.recv(65536)
+                if not chunk:
+                    raise ConnectionError('Redis connection closed')
+                self._buffer += chunk
+            data, self._buffer = self._buffer[:length], self._buffer[length + 2:]
+            return data
+        if kind == b'*':
+            count = int(payload)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise RuntimeError(f'Unexpected Redis reply: {line!r}')
+
+    def _pipeline(self, commands):
+        self._sock.sendall(b''.join(self._encode(command) for command in commands))
+        return [self._read_reply() for _ in commands]
+
+    def increment(self, entries):
+        commands = []
+        for key, window, window_seconds, amount in entries:
+            current_key = f'{self.prefix}{key}:{window}'
+            commands.append(('INCRBY', current_key, amount))
+            commands.append(('EXPIRE', current_key, int(2 * window_seconds)))
+            commands.append(('GET', f'{self.prefix}{key}:{window - 1}'))
+
+        with self._lock:
+            try:
+                self._connect()
+                replies = self._pipeline(commands)
+            except (OSError, ConnectionError, RuntimeError):
+                # Drop the connection (it may hold unread replies); the next call reconnects
+                self.close_socket()
+                raise
+
+        results = []
+        for i in range(0, len(replies), 3):
+            previous = replies[i + 2]
+            results.append((replies[i], int(previous) if previous is not None else 0))
+        return results
+
+    def close_socket(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._buffer = b''
+
+    def close(self):
+        with self._lock:
+            self.close_socket()
+
+
+def create_backend(url):
+    """
+    Build a backend from a RATE_LIMIT_BACKEND style URL
+    إنشاء واجهة تخزين من عنوان بصيغة RATE_LIMIT_BACKEND
+
+    sqlite:////var/run/livreure/ratelimit.db, redis://host:6379/0 or memory://
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else parsed.path
+        return SQLiteRateLimitBackend(path)
+    if parsed.scheme in ('redis', 'tcp'):
+        return RedisRateLimitBackend.from_url(url)
+    if parsed.scheme == 'memory':
+        return MemoryRateLimitBackend()
+    raise ValueError(f'Unsupported rate limit backend: {url}')
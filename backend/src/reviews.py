@@ -0,0 +1,225 @@
+"""
+Reviews and Ratings for Livreure Platform
+نظام التقييمات والمراجعات لمنصة Livreure
+
+A customer can rate each delivered order once: the restaurant, and the
+delivery agent when there was one. Restaurants and delivery agents keep a
+running rating_sum/rating_count next to their rating column; a new review
+updates all three with one atomic UPDATE per rated party, so the average is
+always precomputed and nothing runs AVG() at request time.
+
+The public catalog shows restaurant ratings, but a review does not bump the
+catalog version itself: that would make every worker rebuild its snapshot
+for each review. A background job bumps it at most once every
+RATING_PUBLISH_INTERVAL seconds, and only when reviews came in since the
+last bump. Agent and restaurant principals cached by other workers pick up
+the new rating_count on their next recheck.
+"""
+
+import os
+from datetime import datetime
+
+from sqlalchemy import func, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db
+from src.models.restaurant import Restaurant
+from src.models.delivery_agent import DeliveryAgent
+from src.models.order import Order
+from src.catalog_cache import CatalogVersion
+from src.jobs import register_job
+from src.pagination import paginate_keyset
+from src.principal_cache import principal_cache
+
+MIN_RATING = 1
+MAX_RATING = 5
+
+
+class Review(db.Model):
+    __tablename__ = 'reviews'
+    __table_args__ = (
+        db.Index('ix_reviews_restaurant_created_at_id', 'restaurant_id', 'created_at', 'id'),
+        db.Index('ix_reviews_agent_created_at_id', 'delivery_agent_id', 'created_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), unique=True, nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False)
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'), nullable=False)
+    delivery_agent_id = db.Column(db.Integer, db.ForeignKey('delivery_agents.id'), nullable=True)
+    restaurant_rating = db.Column(db.Integer, nullable=False)
+    agent_rating = db.Column(db.Integer)
+    comment = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'customer_id': self.customer_id,
+            'restaurant_id': self.restaurant_id,
+            'delivery_agent_id': self.delivery_agent_id,
+            'restaurant_rating': self.restaurant_rating,
+            'agent_rating': self.agent_rating,
+            'comment': self.comment,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class ReviewError(ValueError):
+    """
+    Raised when a review cannot be accepted
+    يُرفع عندما لا يمكن قبول التقييم
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _add_rating(model, row_id, rating):
+    # rating is assigned first so it is computed from the pre-update sum and
+    # count on every database (MySQL applies SET clauses left to right)
+    db.session.execute(
+        update(model).where(model.id == row_id).ordered_values(
+            (model.rating, (model.rating_sum + rating) * 1.0 / (model.rating_count + 1)),
+            (model.rating_sum, model.rating_sum + rating),
+            (model.rating_count, model.rating_count + 1)
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def _validate_rating(value, field):
+    if isinstance(value, bool) or not isinstance(value, int) or not MIN_RATING <= value <= MAX_RATING:
+        raise ReviewError(f'{field} must be an integer between {MIN_RATING} and {MAX_RATING}')
+    return value
+
+
+class ReviewService:
+    """
+    Service class for handling reviews
+    فئة الخدمة للتعامل مع التقييمات
+    """
+
+    @staticmethod
+    def submit_review(order_id, customer_id, restaurant_rating, agent_rating=None, comment=None):
+        """
+        Rate a delivered order and fold the ratings into the running aggregates
+        تقييم طلب تم توصيله وإضافة التقييم إلى المعدلات التراكمية
+        """
+        restaurant_rating = _validate_rating(restaurant_rating, 'restaurant_rating')
+        order = db.session.get(Order, order_id)
+        if order is None or order.customer_id != customer_id:
+            raise ReviewError('Order not found', 404)
+        if order.status != 'delivered':
+            raise ReviewError('Only delivered orders can be reviewed')
+        if agent_rating is not None:
+            if order.delivery_agent_id is None:
+                raise ReviewError('This order had no delivery agent to rate')
+            agent_rating = _validate_rating(agent_rating, 'agent_rating')
+        if Review.query.filter_by(order_id=order_id).first():
+            raise ReviewError('This order has already been reviewed', 409)
+
+        review = Review(
+            order_id=order.id,
+            customer_id=customer_id,
+            restaurant_id=order.restaurant_id,
+            delivery_agent_id=order.delivery_agent_id,
+            restaurant_rating=restaurant_rating,
+            agent_rating=agent_rating,
+            comment=comment
+        )
+        try:
+            db.session.add(review)
+            # The unique order_id makes a concurrent duplicate fail here, before any aggregate moves
+            db.session.flush()
+            _add_rating(Restaurant, order.restaurant_id, restaurant_rating)
+            if agent_rating is not None:
+                _add_rating(DeliveryAgent, order.delivery_agent_id, agent_rating)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise ReviewError('This order has already been reviewed', 409)
+        except Exception:
+            db.session.rollback()
+            raise
+
+        # Other workers notice the rating_count change on their next recheck
+        principal_cache.invalidate('restaurant', review.restaurant_id)
+        if agent_rating is not None:
+            principal_cache.invalidate('delivery_agent', review.delivery_agent_id)
+        return review
+
+    @staticmethod
+    def get_restaurant_reviews(restaurant_id, cursor=None, limit=50):
+        """
+        One keyset page of a restaurant's reviews, newest first
+        صفحة من تقييمات المطعم مرتبة من الأحدث
+        """
+        query = Review.query.filter_by(restaurant_id=restaurant_id)
+        return paginate_keyset(query, Review, cursor, limit)
+
+
+def publish_ratings():
+    """
+    Bump the catalog version if restaurant ratings changed since it was last bumped
+    زيادة إصدار الكتالوج إذا تغيرت تقييمات المطاعم منذ آخر زيادة
+
+    The marker is the total restaurant rating_count, which a review moves in
+    the same transaction that inserts it, so a review that commits late is
+    still seen on the next run (a created_at cutoff could already have
+    stepped past it). One guarded UPDATE, so when every worker runs the job
+    only the first one after new reviews bumps. Returns True when the
+    version moved.
+    """
+    rated = select(func.coalesce(func.sum(Restaurant.rating_count), 0)).scalar_subquery()
+    try:
+        result = db.session.execute(
+            update(CatalogVersion).where(CatalogVersion.id == 1, CatalogVersion.published_ratings != rated)
+            .values(version=CatalogVersion.version + 1, updated_at=datetime.utcnow(), published_ratings=rated)
+            .execution_options(synchronize_session=False)
+        )
+        bumped = bool(result.rowcount)
+        if bumped:
+            db.session.info['catalog_bumped'] = True
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return bumped
+
+
+RATING_PUBLISH_INTERVAL = float(os.environ.get('RATING_PUBLISH_INTERVAL', 60))
+
+rating_publish_job = register_job('rating_publish', publish_ratings, interval=RATING_PUBLISH_INTERVAL)
+
+
+def add_rating_columns():
+    """
+    Add rating_sum/rating_count to existing restaurants and delivery_agents
+    tables, and the published rating marker to catalog_version
+    إضافة أعمدة المجموع والعدد إلى جداول المطاعم وعمال التوصيل الموجودة
+    """
+    for table in ('restaurants', 'delivery_agents'):
+        columns = {column['name'] for column in inspect(db.engine).get_columns(table)}
+        with db.engine.begin() as connection:
+            if 'rating_sum' not in columns:
+                connection.execute(text(f'ALTER TABLE {table} ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0'))
+            if 'rating_count' not in columns:
+                connection.execute(text(f'ALTER TABLE {table} ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0'))
+
+    columns = {column['name'] for column in inspect(db.engine).get_columns('catalog_version')}
+    if 'published_ratings' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE catalog_version ADD COLUMN published_ratings INTEGER NOT NULL DEFAULT 0'))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from src.main import app
+
+    with app.app_context():
+        add_rating_columns()
+        db.create_all()
+        print('Rating columns and reviews table ready')
@@ -0,0 +1,197 @@
+"""
+Delivery batching for Livreure
+تجميع الطلبات في جولات توصيل لمنصة Livreure
+
+At peak times a restaurant often has several orders ready within minutes of
+each other for customers who live close together. Carrying them on one trip
+saves a return to the restaurant per order. Before each dispatch round the
+ready orders are grouped by restaurant: the oldest ungrouped order is joined
+by up to BATCH_SIZE - 1 orders that became ready within the batching window
+and whose drop-off is within DISPATCH_BATCH_DROPOFF_KM of its own. The
+dispatcher then offers each batch to one agent.
+
+The stops of a batch are visited in the order given by a nearest-neighbour
+tour from the restaurant, improved with 2-opt moves, over the haversine
+distance matrix of the restaurant and the drop-offs. The route is stored in
+delivery_batches for the agent's app.
+"""
+
+import os
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from src.models.user import db
+from src.geo import haversine_matrix_km
+
+BATCH_SIZE = int(os.environ.get('DISPATCH_BATCH_SIZE', 3))  # 1 disables batching
+BATCH_DROPOFF_KM = float(os.environ.get('DISPATCH_BATCH_DROPOFF_KM', 2.0))
+BATCH_WINDOW_MINUTES = float(os.environ.get('DISPATCH_BATCH_WINDOW_MINUTES', 10))
+
+# One dispatchable unit: order_ids are in visiting order, ready_at is the oldest order's and
+# route_km runs from the restaurant to the last drop-off (None without drop-off coordinates)
+Batch = namedtuple('Batch', 'order_ids restaurant_id latitude longitude ready_at route_km')
+
+
+class DeliveryBatch(db.Model):
+    __tablename__ = 'delivery_batches'
+
+    id = db.Column(db.Integer, primary_key=True)
+    delivery_agent_id = db.Column(db.Integer, db.ForeignKey('delivery_agents.id'), nullable=False, index=True)
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'), nullable=False)
+    stops = db.Column(db.String(500), nullable=False)  # order ids in visiting order, comma separated
+    route_km = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def order_ids(self):
+        return [int(order_id) for order_id in self.stops.split(',') if order_id]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'delivery_agent_id': self.delivery_agent_id,
+            'restaurant_id': self.restaurant_id,
+            'order_ids': self.order_ids,
+            'route_km': self.route_km,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+def path_km(distance, path):
+    return float(distance[path[:-1], path[1:]].sum()) if len(path) > 1 else 0.0
+
+
+def nearest_neighbour_path(distance):
+    """
+    Open path from node 0 that always moves to the nearest unvisited node
+    مسار مفتوح من العقدة 0 ينتقل دائماً إلى أقرب عقدة لم تتم زيارتها
+    """
+    n = distance.shape[0]
+    path = [0]
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    for _ in range(n - 1):
+        candidates = np.where(visited, np.inf, distance[path[-1]])
+        nearest = int(np.argmin(candidates))
+        visited[nearest] = True
+        path.append(nearest)
+    return np.array(path, dtype=int)
+
+
+def two_opt(distance, path):
+    """
+    Reverse segments of an open path while that shortens it; node 0 stays first
+    عكس مقاطع من المسار المفتوح ما دام ذلك يقصره مع إبقاء العقدة 0 أولاً
+    """
+    path = path.copy()
+    n = len(path)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                before, first, last = path[i - 1], path[i], path[j]
+                delta = distance[before, last] - distance[before, first]
+                if j + 1 < n:
+                    after = path[j + 1]
+                    delta += distance[first, after] - distance[last, after]
+                if delta < -1e-9:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    improved = True
+    return path
+
+
+def plan_route(start, stops):
+    """
+    Visiting order for stops starting from start; returns (stop indexes, km)
+    ترتيب زيارة نقاط التسليم انطلاقاً من نقطة البداية؛ يعيد (الفهارس، المسافة)
+
+    start is (lat, lng) and stops a list of (lat, lng).
+    """
+    points = [start] + list(stops)
+    lats = [point[0] for point in points]
+    lngs = [point[1] for point in points]
+    distance = haversine_matrix_km(lats, lngs, lats, lngs)
+    path = two_opt(distance, nearest_neighbour_path(distance))
+    return [int(node) - 1 for node in path[1:]], path_km(distance, path)
+
+
+def build_batches(orders, batch_size=BATCH_SIZE, dropoff_km=BATCH_DROPOFF_KM,
+                  window_minutes=BATCH_WINDOW_MINUTES):
+    """
+    Group ready orders into Batches
+    تجميع الطلبات الجاهزة في دفعات
+
+    orders are rows of (id, restaurant_id, pickup latitude, pickup longitude,
+    drop-off latitude, drop-off longitude, ready_at), oldest first. Orders
+    without drop-off coordinates are never batched. Returns the batches in
+    the order of their oldest order.
+    """
+    by_restaurant = {}
+    for row in orders:
+        by_restaurant.setdefault(row[1], []).append(row)
+
+    batches = []
+    for restaurant_id, rows in by_restaurant.items():
+        _, _, pickup_lat, pickup_lng = rows[0][:4]
+        located = [row[4] is not None and row[5] is not None for row in rows]
+        if batch_size > 1 and sum(located) > 1:
+            lats = [row[4] if ok else 0.0 for row, ok in zip(rows, located)]
+            lngs = [row[5] if ok else 0.0 for row, ok in zip(rows, located)]
+            dropoff_distance = haversine_matrix_km(lats, lngs, lats, lngs)
+            near = (dropoff_distance <= dropoff_km) & np.outer(located, located)
+        else:
+            near = None
+
+        taken = [False] * len(rows)
+        for i, seed in enumerate(rows):
+            if taken[i]:
+                continue
+            taken[i] = True
+            members = [i]
+            if near is not None and located[i]:
+                candidates = np.flatnonzero(near[i])
+                for j in candidates[np.argsort(dropoff_distance[i, candidates], kind='stable')]:
+                    if len(members) == batch_size:
+                        break
+                    if taken[j] or not _within_window(seed[6], rows[j][6], window_minutes):
+                        continue
+                    taken[j] = True
+                    members.append(int(j))
+
+            if not located[i]:
+                batches.append(Batch((seed[0],), restaurant_id, pickup_lat, pickup_lng, seed[6], None))
+                continue
+            stops, route_km = plan_route((pickup_lat, pickup_lng), [(rows[m][4], rows[m][5]) for m in members])
+            batches.append(Batch(tuple(rows[members[stop]][0] for stop in stops), restaurant_id,
+                                 pickup_lat, pickup_lng, seed[6], round(route_km, 3)))
+
+    batches.sort(key=lambda batch: (batch.ready_at or datetime.min, batch.order_ids[0]))
+    return batches
+
+
+def _within_window(first, second, window_minutes):
+    if first is None or second is None:
+        return True
+    return abs((second - first).total_seconds()) <= window_minutes * 60
+
+
+def record_batches(assignments):
+    """
+    Store the route of every multi-order batch given to an agent, in the current transaction
+    تخزين مسار كل دفعة متعددة الطلبات أسندت إلى عامل ضمن المعاملة الحالية
+
+    assignments are (Batch, agent_id) pairs.
+    """
+    rows = [{
+        'delivery_agent_id': agent_id,
+        'restaurant_id': batch.restaurant_id,
+        'stops': ','.join(str(order_id) for order_id in batch.order_ids),
+        'route_km': batch.route_km,
+        'created_at': datetime.utcnow()
+    } for batch, agent_id in assignments if len(batch.order_ids) > 1]
+    if rows:
+        db.session.execute(DeliveryBatch.__table__.insert(), rows)
+    return len(rows)
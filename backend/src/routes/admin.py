@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from src.password_hashing import HashingPoolSaturated, check_password
 from src.models.admin import db, Admin
 from src.models.customer import Customer
 from src.models.restaurant import Restaurant
@@ -7,6 +7,8 @@ from src.models.delivery_agent import DeliveryAgent
 from src.models.order import Order
 from datetime import datetime, timedelta
 from sqlalchemy import func
+from src.pagination import InvalidCursor, page_args, paginate_keyset, next_page_headers
+from src.order_history import with_order_relations
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -17,7 +19,7 @@ def login_admin():
         data = request.get_json()
         admin = Admin.query.filter_by(username=data['username']).first()
         
-        if admin and check_password_hash(admin.password_hash, data['password']):
+        if admin and check_password(admin.password_hash, data['password']):
             if not admin.is_active:
                 return jsonify({'error': 'Admin account is deactivated'}), 403
                 
@@ -32,6 +34,8 @@ def login_admin():
         else:
             return jsonify({'error': 'Invalid credentials'}), 401
             
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -66,7 +70,7 @@ def get_dashboard_stats():
         ).scalar() or 0
         
         # Recent orders
-        recent_orders = Order.query.order_by(Order.created_at.desc()).limit(10).all()
+        recent_orders = with_order_relations(Order.query, 'customer', 'restaurant').order_by(Order.created_at.desc()).limit(10).all()
         recent_orders_data = []
         for order in recent_orders:
             order_dict = order.to_dict()
@@ -128,9 +132,12 @@ def get_all_restaurants():
         elif status == 'rejected':
             query = query.filter_by(is_active=False)
         
-        restaurants = query.order_by(Restaurant.created_at.desc()).all()
-        return jsonify([restaurant.to_dict() for restaurant in restaurants]), 200
+        cursor, limit = page_args()
+        restaurants, next_cursor = paginate_keyset(query, Restaurant, cursor, limit)
+        return jsonify([restaurant.to_dict() for restaurant in restaurants]), 200, next_page_headers(next_cursor)
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -182,9 +189,12 @@ def get_all_delivery_agents():
         elif status == 'rejected':
             query = query.filter_by(is_active=False)
         
-        agents = query.order_by(DeliveryAgent.created_at.desc()).all()
-        return jsonify([agent.to_dict() for agent in agents]), 200
+        cursor, limit = page_args()
+        agents, next_cursor = paginate_keyset(query, DeliveryAgent, cursor, limit)
+        return jsonify([agent.to_dict() for agent in agents]), 200, next_page_headers(next_cursor)
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -226,9 +236,12 @@ def reject_delivery_agent(agent_id):
 @admin_bp.route('/admin/customers', methods=['GET'])
 def get_all_customers():
     try:
-        customers = Customer.query.order_by(Customer.created_at.desc()).all()
-        return jsonify([customer.to_dict() for customer in customers]), 200
+        cursor, limit = page_args()
+        customers, next_cursor = paginate_keyset(Customer.query, Customer, cursor, limit)
+        return jsonify([customer.to_dict() for customer in customers]), 200, next_page_headers(next_cursor)
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -240,7 +253,7 @@ def get_all_orders():
         date_from = request.args.get('date_from')
         date_to = request.args.get('date_to')
         
-        query = Order.query
+        query = with_order_relations(Order.query, 'customer', 'restaurant', 'delivery_agent')
         
         if status:
             query = query.filter_by(status=status)
@@ -251,7 +264,8 @@ def get_all_orders():
         if date_to:
             query = query.filter(Order.created_at <= datetime.fromisoformat(date_to))
         
-        orders = query.order_by(Order.created_at.desc()).all()
+        cursor, limit = page_args()
+        orders, next_cursor = paginate_keyset(query, Order, cursor, limit)
         
         # Include related data
         orders_data = []
@@ -262,8 +276,10 @@ def get_all_orders():
             order_dict['delivery_agent_name'] = order.delivery_agent.name if order.delivery_agent else None
             orders_data.append(order_dict)
         
-        return jsonify(orders_data), 200
+        return jsonify(orders_data), 200, next_page_headers(next_cursor)
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1,65 +1,59 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, g, request, jsonify, stream_with_context
 from src.routes.auth import token_required
 from src.models.user import db
 from src.models.customer import Customer
 from src.models.restaurant import Restaurant, MenuItem
 from src.models.delivery_agent import DeliveryAgent
 from src.models.order import Order, OrderItem
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, or_
+from src.pagination import InvalidCursor, page_args
+from src.catalog_cache import catalog_cache
+from src.search_index import search_catalog, search_restaurant_ids
+from src.order_history import order_line_summary, with_order_relations
+from src.order_placement import OrderError, place_order
+from src.idempotency import idempotent
+from src.order_dispatch import agent_route, claim_order, claim_refusal
+from src.order_state import MAX_BULK_TRANSITIONS, refusal_message, transition_orders
+from src.geo import haversine_km
+from src.menu_operations import MenuValidationError, apply_bulk_operations
+from src.menu_import import MenuImport, detect_format, iter_import_rows
 import datetime
+import json
 
 api_bp = Blueprint('api', __name__)
 
 # Restaurant endpoints
+def _catalog_response(body):
+    return current_app.response_class(body, status=200, mimetype='application/json')
+
 @api_bp.route('/restaurants', methods=['GET'])
 def get_restaurants():
     try:
         # Get query parameters
         category = request.args.get('category')
         search = request.args.get('search')
-        is_open = request.args.get('is_open')
-        
-        # Build query
-        query = Restaurant.query
+        is_open = request.args.get('is_open') == 'true'
         
-        if category and category != 'all':
-            query = query.filter(Restaurant.category.ilike(f'%{category}%'))
+        if category == 'all':
+            category = None
         
+        # Served from the pre-serialized catalog snapshot
+        snapshot = catalog_cache.snapshot()
+        cursor, limit = page_args()
         if search:
-            query = query.filter(
-                Restaurant.name.ilike(f'%{search}%') |
-                Restaurant.description.ilike(f'%{search}%')
-            )
-        
-        if is_open == 'true':
-            query = query.filter(Restaurant.is_open == True)
+            # Ranked results come back best match first, in a single page
+            ranked_ids = search_restaurant_ids(search, limit=limit)
+            body = snapshot.ranked_page(ranked_ids, category=category, is_open=is_open)
+        else:
+            body = snapshot.list_page(cursor, limit, category=category, is_open=is_open)
         
-        restaurants = query.all()
-        
-        restaurants_data = []
-        for restaurant in restaurants:
-            # Calculate average rating (mock data for now)
-            avg_rating = 4.5  # In real app, calculate from reviews
-            
-            restaurants_data.append({
-                'id': restaurant.id,
-                'name': restaurant.name,
-                'description': restaurant.description,
-                'category': restaurant.category,
-                'address': restaurant.address,
-                'phone': restaurant.phone,
-                'is_open': restaurant.is_open,
-                'rating': avg_rating,
-                'delivery_time': '30-45',  # Mock data
-                'delivery_fee': 100,  # Mock data
-                'image': f'/static/images/restaurants/{restaurant.id}.jpg'
-            })
+        return _catalog_response(body)
         
+    except InvalidCursor:
         return jsonify({
-            'success': True,
-            'restaurants': restaurants_data
-        }), 200
-        
+            'success': False,
+            'message': 'Invalid cursor'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -69,99 +63,121 @@ def get_restaurants():
 @api_bp.route('/restaurants/<int:restaurant_id>', methods=['GET'])
 def get_restaurant_details(restaurant_id):
     try:
-        restaurant = Restaurant.query.get(restaurant_id)
-        
-        if not restaurant:
+        snapshot = catalog_cache.snapshot()
+        if request.args.get('group_by') == 'category':
+            # Available items only, grouped and ordered by category
+            body = snapshot.grouped_details.get(restaurant_id)
+        else:
+            body = snapshot.details.get(restaurant_id)
+        
+        if body is None:
             return jsonify({
                 'success': False,
                 'message': 'Restaurant not found'
             }), 404
         
-        # Get menu items
-        menu_items = MenuItem.query.filter_by(restaurant_id=restaurant_id).all()
-        
-        menu_data = []
-        for item in menu_items:
-            menu_data.append({
-                'id': item.id,
-                'name': item.name,
-                'description': item.description,
-                'price': float(item.price),
-                'category': item.category,
-                'is_available': item.is_available,
-                'image': f'/static/images/menu/{item.id}.jpg'
-            })
-        
-        restaurant_data = {
-            'id': restaurant.id,
-            'name': restaurant.name,
-            'description': restaurant.description,
-            'category': restaurant.category,
-            'address': restaurant.address,
-            'phone': restaurant.phone,
-            'is_open': restaurant.is_open,
-            'rating': 4.5,  # Mock data
-            'delivery_time': '30-45',
-            'delivery_fee': 100,
-            'image': f'/static/images/restaurants/{restaurant.id}.jpg',
-            'menu_items': menu_data
-        }
+        return _catalog_response(body)
         
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Failed to fetch restaurant details: {str(e)}'
+        }), 500
+
+@api_bp.route('/search', methods=['GET'])
+def search():
+    try:
+        query_text = request.args.get('q', '').strip()
+        doc_type = request.args.get('type')
+        limit = max(1, min(request.args.get('limit', 20, type=int) or 20, 100))
+
+        if doc_type not in (None, 'restaurant', 'menu_item'):
+            return jsonify({
+                'success': False,
+                'message': 'type must be restaurant or menu_item'
+            }), 400
+
+        hits = search_catalog(query_text, doc_type=doc_type, limit=limit)
+
+        restaurant_ids = [hit['doc_id'] for hit in hits if hit['doc_type'] == 'restaurant']
+        item_ids = [hit['doc_id'] for hit in hits if hit['doc_type'] == 'menu_item']
+        restaurants = {r.id: r for r in Restaurant.query.filter(Restaurant.id.in_(restaurant_ids)).all()} if restaurant_ids else {}
+        items = {i.id: i for i in MenuItem.query.filter(MenuItem.id.in_(item_ids)).all()} if item_ids else {}
+
+        results = []
+        for hit in hits:
+            if hit['doc_type'] == 'restaurant' and hit['doc_id'] in restaurants:
+                restaurant = restaurants[hit['doc_id']]
+                results.append({
+                    'type': 'restaurant',
+                    'id': restaurant.id,
+                    'name': restaurant.name,
+                    'category': restaurant.category,
+                    'score': round(hit['score'], 4)
+                })
+            elif hit['doc_type'] == 'menu_item' and hit['doc_id'] in items:
+                item = items[hit['doc_id']]
+                results.append({
+                    'type': 'menu_item',
+                    'id': item.id,
+                    'restaurant_id': item.restaurant_id,
+                    'name': item.name,
+                    'price': float(item.price),
+                    'category': item.category,
+                    'score': round(hit['score'], 4)
+                })
+
         return jsonify({
             'success': True,
-            'restaurant': restaurant_data
+            'results': results
         }), 200
-        
+
     except Exception as e:
         return jsonify({
             'success': False,
-            'message': f'Failed to fetch restaurant details: {str(e)}'
+            'message': f'Search failed: {str(e)}'
         }), 500
 
 # Order endpoints
 @api_bp.route('/orders', methods=['POST'])
 @token_required
+@idempotent
 def create_order(current_user):
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         
-        if not data.get('items') or not data.get('total'):
+        if not data.get('items') or not data.get('restaurant_id'):
             return jsonify({
                 'success': False,
-                'message': 'Items and total are required'
+                'message': 'Items and restaurant_id are required'
             }), 400
         
-        # Create order
-        new_order = Order(
+        # Prices come from the catalog; a client total is only checked against them
+        order, pricing = place_order(
             customer_id=current_user.id,
-            restaurant_id=data.get('restaurant_id', 1),  # Default restaurant
-            total_amount=float(data['total']),
-            delivery_address=data.get('delivery_address', current_user.address if hasattr(current_user, 'address') else ''),
-            status='pending',
-            created_at=datetime.datetime.utcnow()
+            restaurant_id=data['restaurant_id'],
+            items=data['items'],
+            delivery_address=data.get('delivery_address') or getattr(current_user, 'address', None),
+            payment_method=data.get('payment_method', 'cash'),
+            delivery_latitude=data.get('delivery_latitude'),
+            delivery_longitude=data.get('delivery_longitude'),
+            delivery_notes=data.get('delivery_notes'),
+            expected_total=data.get('total')
         )
         
-        db.session.add(new_order)
-        db.session.flush()  # Get the order ID
-        
-        # Add order items
-        for item in data['items']:
-            order_item = OrderItem(
-                order_id=new_order.id,
-                menu_item_id=item['id'],
-                quantity=item['quantity'],
-                price=float(item['price'])
-            )
-            db.session.add(order_item)
-        
-        db.session.commit()
-        
         return jsonify({
             'success': True,
             'message': 'Order created successfully',
-            'order_id': new_order.id
+            'order_id': order.id,
+            'order': order.to_dict(),
+            'items': pricing['lines']
         }), 201
         
+    except OrderError as e:
+        response = {'success': False, 'message': str(e)}
+        if e.pricing:
+            response['pricing'] = e.pricing
+        return jsonify(response), e.status_code
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -173,7 +189,7 @@ def create_order(current_user):
 @token_required
 def update_order_status(current_user, order_id):
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         
         if not data.get('status'):
             return jsonify({
@@ -181,19 +197,18 @@ def update_order_status(current_user, order_id):
                 'message': 'Status is required'
             }), 400
         
-        order = Order.query.get(order_id)
+        result = transition_orders(
+            [order_id], data['status'], current_user.id, g.token_claims['user_type'],
+            notes=data.get('notes'), authorize=True
+        )
         
-        if not order:
+        reason = result.refused.get(order_id)
+        if reason:
+            message, status_code = refusal_message(reason, result.previous.get(order_id), data['status'])
             return jsonify({
                 'success': False,
-                'message': 'Order not found'
-            }), 404
-        
-        # Update order status
-        order.status = data['status']
-        order.updated_at = datetime.datetime.utcnow()
-        
-        db.session.commit()
+                'message': message
+            }), status_code
         
         return jsonify({
             'success': True,
@@ -207,6 +222,54 @@ def update_order_status(current_user, order_id):
             'message': f'Failed to update order status: {str(e)}'
         }), 500
 
+@api_bp.route('/orders/bulk-status', methods=['POST'])
+@token_required
+def bulk_update_order_status(current_user):
+    try:
+        data = request.get_json() or {}
+        order_ids, new_status = data.get('order_ids'), data.get('status')
+        
+        if not new_status:
+            return jsonify({
+                'success': False,
+                'message': 'Status is required'
+            }), 400
+        if (not isinstance(order_ids, list) or not order_ids
+                or not all(isinstance(order_id, int) and not isinstance(order_id, bool) for order_id in order_ids)):
+            return jsonify({
+                'success': False,
+                'message': 'order_ids must be a non-empty list of order ids'
+            }), 400
+        if len(order_ids) > MAX_BULK_TRANSITIONS:
+            return jsonify({
+                'success': False,
+                'message': f'At most {MAX_BULK_TRANSITIONS} orders per request'
+            }), 400
+        
+        result = transition_orders(
+            order_ids, new_status, current_user.id, g.token_claims['user_type'],
+            notes=data.get('notes'), authorize=True, atomic=bool(data.get('atomic'))
+        )
+        
+        refused = []
+        for order_id, reason in result.refused.items():
+            message, _ = refusal_message(reason, result.previous.get(order_id), new_status)
+            refused.append({'order_id': order_id, 'reason': reason, 'message': message})
+        
+        applied = bool(result.updated) or not refused
+        return jsonify({
+            'success': applied,
+            'updated': result.updated,
+            'refused': refused
+        }), 200 if applied else 422
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Failed to update order statuses: {str(e)}'
+        }), 500
+
 # Restaurant management endpoints
 @api_bp.route('/restaurant/stats', methods=['GET'])
 @token_required
@@ -237,7 +300,8 @@ def get_restaurant_stats(current_user):
             'today_orders': today_orders,
             'pending_orders': pending_orders,
             'today_revenue': float(today_revenue),
-            'rating': 4.8  # Mock data
+            'rating': current_user.rating,
+            'rating_count': current_user.rating_count
         }
         
         return jsonify({
@@ -257,7 +321,9 @@ def get_restaurant_orders(current_user):
     try:
         status_filter = request.args.get('status')
         
-        query = Order.query.filter(Order.restaurant_id == current_user.id)
+        query = with_order_relations(
+            Order.query.filter(Order.restaurant_id == current_user.id), 'customer', 'order_items'
+        )
         
         if status_filter and status_filter != 'all':
             query = query.filter(Order.status == status_filter)
@@ -266,29 +332,14 @@ def get_restaurant_orders(current_user):
         
         orders_data = []
         for order in orders:
-            # Get customer info
-            customer = Customer.query.get(order.customer_id)
-            
-            # Get order items
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            items_data = []
-            
-            for item in order_items:
-                menu_item = MenuItem.query.get(item.menu_item_id)
-                items_data.append({
-                    'name': menu_item.name if menu_item else 'Unknown Item',
-                    'quantity': item.quantity,
-                    'price': float(item.price)
-                })
-            
             orders_data.append({
                 'id': order.id,
-                'customer_name': customer.name if customer else 'Unknown Customer',
+                'customer_name': order.customer.name if order.customer else 'Unknown Customer',
                 'total': float(order.total_amount),
                 'status': order.status,
                 'created_at': order.created_at.isoformat(),
                 'delivery_address': order.delivery_address,
-                'items': items_data
+                'items': [order_line_summary(item) for item in order.order_items]
             })
         
         return jsonify({
@@ -329,6 +380,121 @@ def update_restaurant_status(current_user):
             'message': f'Failed to update restaurant status: {str(e)}'
         }), 500
 
+def _manages_restaurant(current_user, restaurant_id):
+    # The restaurant itself or an admin
+    user_type = g.token_claims['user_type']
+    return user_type == 'admin' or (user_type == 'restaurant' and current_user.id == restaurant_id)
+
+@api_bp.route('/restaurants/<int:restaurant_id>/menu/bulk', methods=['POST'])
+@token_required
+def bulk_menu_operations(current_user, restaurant_id):
+    try:
+        if not _manages_restaurant(current_user, restaurant_id):
+            return jsonify({
+                'success': False,
+                'message': 'Only the restaurant or an admin can edit this menu'
+            }), 403
+        if not db.session.get(Restaurant, restaurant_id):
+            return jsonify({
+                'success': False,
+                'message': 'Restaurant not found'
+            }), 404
+        
+        data = request.get_json() or {}
+        results, applied = apply_bulk_operations(
+            restaurant_id, data.get('operations'), atomic=bool(data.get('atomic'))
+        )
+        
+        failed = sum(1 for result in results if result['status'] == 'error')
+        return jsonify({
+            'success': applied,
+            'applied': applied,
+            'succeeded': len(results) - failed if applied else 0,
+            'failed': failed,
+            'results': results
+        }), 200 if applied else 422
+        
+    except MenuValidationError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Failed to update menu: {str(e)}'
+        }), 500
+
+@api_bp.route('/restaurants/<int:restaurant_id>/menu/import', methods=['POST'])
+@token_required
+def import_menu(current_user, restaurant_id):
+    try:
+        if not _manages_restaurant(current_user, restaurant_id):
+            return jsonify({
+                'success': False,
+                'message': 'Only the restaurant or an admin can import this menu'
+            }), 403
+        if not db.session.get(Restaurant, restaurant_id):
+            return jsonify({
+                'success': False,
+                'message': 'Restaurant not found'
+            }), 404
+        
+        # Either a multipart upload in "file" or the raw file as the request body
+        upload = request.files.get('file')
+        if upload:
+            stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+        else:
+            stream, filename, content_type = request.stream, None, request.mimetype
+        import_format = request.args.get('format') or detect_format(filename, content_type)
+        if import_format is None:
+            return jsonify({
+                'success': False,
+                'message': 'Cannot tell the file format; pass ?format=csv or ?format=ndjson'
+            }), 400
+        
+        chunk_size = min(max(request.args.get('chunk_size', 1000, type=int), 1), 5000)
+        job = MenuImport(restaurant_id, chunk_size)
+        steps = job.steps(iter_import_rows(stream, import_format))
+        
+        # Clients asking for NDJSON get a progress line per chunk, then the summary
+        if request.accept_mimetypes.best == 'application/x-ndjson':
+            # The first chunk runs before the status code is sent, so a bad
+            # header, an early encoding error or a small file's outcome still
+            # sets it; later failures are reported by the final line
+            next(steps)
+            if job.committed and not job.succeeded():
+                return jsonify(job.summary()), 422
+            
+            def generate():
+                yield json.dumps(job.progress()) + '\n'
+                try:
+                    for _ in steps:
+                        yield json.dumps(job.progress()) + '\n'
+                except Exception as e:
+                    # The import was rolled back
+                    yield json.dumps(dict(job.summary(), message=str(e))) + '\n'
+                    return
+                yield json.dumps(job.summary()) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        for _ in steps:
+            pass
+        return jsonify(job.summary()), 200 if job.succeeded() else 422
+        
+    except MenuValidationError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Failed to import menu: {str(e)}'
+        }), 500
+
 # Delivery agent endpoints
 @api_bp.route('/delivery/stats', methods=['GET'])
 @token_required
@@ -349,7 +515,8 @@ def get_delivery_stats(current_user):
         stats = {
             'completed_deliveries': completed_deliveries,
             'today_earnings': today_earnings,
-            'rating': 4.9,  # Mock data
+            'rating': current_user.rating,
+            'rating_count': current_user.rating_count,
             'avg_delivery_time': 18  # Mock data
         }
         
@@ -368,26 +535,31 @@ def get_delivery_stats(current_user):
 @token_required
 def get_available_orders(current_user):
     try:
-        # Get orders that are ready for delivery
-        orders = Order.query.filter(
+        # Ready orders nobody has, and first those the dispatcher gave this agent
+        agent_id = current_user.id if g.token_claims['user_type'] == 'delivery_agent' else None
+        orders = with_order_relations(Order.query.filter(
             Order.status == 'ready',
-            Order.delivery_agent_id.is_(None)
-        ).order_by(Order.created_at).limit(20).all()
+            or_(Order.delivery_agent_id.is_(None), Order.delivery_agent_id == agent_id)
+        ), 'restaurant', 'customer').order_by(Order.delivery_agent_id.is_(None), Order.created_at).limit(20).all()
+        
+        agent_lat = getattr(current_user, 'current_latitude', None)
+        agent_lng = getattr(current_user, 'current_longitude', None)
         
         orders_data = []
         for order in orders:
-            # Get restaurant and customer info
-            restaurant = Restaurant.query.get(order.restaurant_id)
-            customer = Customer.query.get(order.customer_id)
-            
+            restaurant = order.restaurant
+            distance = None
+            if None not in (agent_lat, agent_lng) and restaurant and None not in (restaurant.latitude, restaurant.longitude):
+                distance = round(haversine_km(agent_lat, agent_lng, restaurant.latitude, restaurant.longitude), 2)
             orders_data.append({
                 'id': order.id,
                 'restaurant_name': restaurant.name if restaurant else 'Unknown Restaurant',
-                'customer_name': customer.name if customer else 'Unknown Customer',
+                'customer_name': order.customer.name if order.customer else 'Unknown Customer',
                 'delivery_address': order.delivery_address,
                 'total': float(order.total_amount),
-                'delivery_fee': 150,  # Mock data
-                'distance': 2.5,  # Mock data
+                'delivery_fee': float(order.delivery_fee or 0),
+                'distance': distance,  # km from the agent to the restaurant, None when either location is unknown
+                'assigned_to_you': order.delivery_agent_id is not None,
                 'created_at': order.created_at.isoformat()
             })
         
@@ -406,26 +578,12 @@ def get_available_orders(current_user):
 @token_required
 def accept_delivery_order(current_user, order_id):
     try:
-        order = Order.query.get(order_id)
-        
-        if not order:
+        if not claim_order(order_id, current_user.id):
+            message, status_code = claim_refusal(order_id, current_user.id)
             return jsonify({
                 'success': False,
-                'message': 'Order not found'
-            }), 404
-        
-        if order.delivery_agent_id:
-            return jsonify({
-                'success': False,
-                'message': 'Order already assigned to another delivery agent'
-            }), 400
-        
-        # Assign order to delivery agent
-        order.delivery_agent_id = current_user.id
-        order.status = 'out_for_delivery'
-        order.updated_at = datetime.datetime.utcnow()
-        
-        db.session.commit()
+                'message': message
+            }), status_code
         
         return jsonify({
             'success': True,
@@ -439,6 +597,38 @@ def accept_delivery_order(current_user, order_id):
             'message': f'Failed to accept order: {str(e)}'
         }), 500
 
+@api_bp.route('/delivery/route', methods=['GET'])
+@token_required
+def get_delivery_route(current_user):
+    try:
+        orders, batch = agent_route(current_user.id, 'restaurant', 'customer')
+        
+        stops = []
+        for order in orders:
+            stops.append({
+                'id': order.id,
+                'order_number': order.order_number,
+                'status': order.status,
+                'restaurant_name': order.restaurant.name if order.restaurant else 'Unknown Restaurant',
+                'customer_name': order.customer.name if order.customer else 'Unknown Customer',
+                'delivery_address': order.delivery_address,
+                'delivery_latitude': order.delivery_latitude,
+                'delivery_longitude': order.delivery_longitude,
+                'total': float(order.total_amount)
+            })
+        
+        return jsonify({
+            'success': True,
+            'stops': stops,
+            'route_km': batch.route_km if batch else None
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Failed to fetch delivery route: {str(e)}'
+        }), 500
+
 @api_bp.route('/delivery/status', methods=['PUT'])
 @token_required
 def update_delivery_status(current_user):
@@ -471,35 +661,20 @@ def update_delivery_status(current_user):
 @token_required
 def get_customer_orders(current_user):
     try:
-        orders = Order.query.filter(
+        orders = with_order_relations(Order.query.filter(
             Order.customer_id == current_user.id
-        ).order_by(desc(Order.created_at)).limit(50).all()
+        ), 'restaurant', 'order_items').order_by(desc(Order.created_at)).limit(50).all()
         
         orders_data = []
         for order in orders:
-            # Get restaurant info
-            restaurant = Restaurant.query.get(order.restaurant_id)
-            
-            # Get order items
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            items_data = []
-            
-            for item in order_items:
-                menu_item = MenuItem.query.get(item.menu_item_id)
-                items_data.append({
-                    'name': menu_item.name if menu_item else 'Unknown Item',
-                    'quantity': item.quantity,
-                    'price': float(item.price)
-                })
-            
             orders_data.append({
                 'id': order.id,
-                'restaurant_name': restaurant.name if restaurant else 'Unknown Restaurant',
+                'restaurant_name': order.restaurant.name if order.restaurant else 'Unknown Restaurant',
                 'total': float(order.total_amount),
                 'status': order.status,
                 'created_at': order.created_at.isoformat(),
                 'delivery_address': order.delivery_address,
-                'items': items_data
+                'items': [order_line_summary(item) for item in order.order_items]
             })
         
         return jsonify({
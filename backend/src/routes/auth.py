@@ -1,14 +1,18 @@
-from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, request, jsonify, g
 import jwt
 import datetime
 import os
+import secrets
 from functools import wraps
 from src.models.user import db, User
 from src.models.customer import Customer
 from src.models.restaurant import Restaurant
 from src.models.delivery_agent import DeliveryAgent
 from src.models.admin import Admin
+from src.principal_cache import PRINCIPAL_MODELS, load_principal
+from src.jwt_cache import decode_token
+from src.token_revocation import revocation_list
+from src.password_hashing import HashingPoolSaturated, hash_password, check_password
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -27,30 +31,32 @@ def token_required(f):
             if token.startswith('Bearer '):
                 token = token[7:]
             
-            data = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+            data = decode_token(token, JWT_SECRET)
             current_user_id = data['user_id']
             current_user_type = data['user_type']
             
-            # Get user based on type
-            if current_user_type == 'customer':
-                current_user = Customer.query.get(current_user_id)
-            elif current_user_type == 'restaurant':
-                current_user = Restaurant.query.get(current_user_id)
-            elif current_user_type == 'delivery_agent':
-                current_user = DeliveryAgent.query.get(current_user_id)
-            elif current_user_type == 'admin':
-                current_user = Admin.query.get(current_user_id)
-            else:
+            if revocation_list.is_revoked(data.get('jti')):
+                return jsonify({'success': False, 'message': 'Token has been revoked'}), 401
+            
+            # Get user based on type (served from the principal cache when warm)
+            if current_user_type not in PRINCIPAL_MODELS:
                 return jsonify({'success': False, 'message': 'Invalid user type'}), 401
             
+            current_user = load_principal(current_user_type, current_user_id)
+            
             if not current_user:
                 return jsonify({'success': False, 'message': 'User not found'}), 401
+            
+            # Suspended accounts lose access within PRINCIPAL_RECHECK_INTERVAL
+            if current_user.is_active is False:
+                return jsonify({'success': False, 'message': 'Account is deactivated'}), 403
                 
         except jwt.ExpiredSignatureError:
             return jsonify({'success': False, 'message': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'success': False, 'message': 'Token is invalid'}), 401
         
+        g.token_claims = data
         return f(current_user, *args, **kwargs)
     
     return decorated
@@ -99,7 +105,7 @@ def register():
             }), 400
         
         # Hash password
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
         
         # Create user based on type
         if user_type == 'customer':
@@ -137,7 +143,8 @@ def register():
         token = jwt.encode({
             'user_id': new_user.id,
             'user_type': user_type,
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(days=30)
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(days=30),
+            'jti': secrets.token_urlsafe(16)
         }, JWT_SECRET, algorithm='HS256')
         
         return jsonify({
@@ -153,6 +160,8 @@ def register():
             }
         }), 201
         
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -187,7 +196,7 @@ def login():
         elif user_type == 'admin':
             user = Admin.query.filter_by(email=email).first()
         
-        if not user or not check_password_hash(user.password, password):
+        if not user or not check_password(user.password, password):
             return jsonify({
                 'success': False,
                 'message': 'Invalid email or password'
@@ -197,7 +206,8 @@ def login():
         token = jwt.encode({
             'user_id': user.id,
             'user_type': user_type,
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(days=30)
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(days=30),
+            'jti': secrets.token_urlsafe(16)
         }, JWT_SECRET, algorithm='HS256')
         
         # Prepare user data
@@ -225,6 +235,8 @@ def login():
             'user': user_data
         }), 200
         
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         return jsonify({
             'success': False,
@@ -260,14 +272,16 @@ def verify_token(current_user):
 @token_required
 def logout(current_user):
     try:
-        # In a real application, you might want to blacklist the token
-        # For now, we'll just return a success message
+        # Revoke this token; other workers pick it up on their next sync
+        revocation_list.revoke(g.token_claims)
+        
         return jsonify({
             'success': True,
             'message': 'Logout successful'
         }), 200
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({
             'success': False,
             'message': f'Logout failed: {str(e)}'
@@ -1,10 +1,15 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from src.password_hashing import HashingPoolSaturated, hash_password, check_password
 from src.models.customer import db, Customer, CustomerAddress
 from src.models.restaurant import Restaurant, MenuItem
 from src.models.order import Order, OrderItem
-from datetime import datetime, timedelta
-import uuid
+from datetime import datetime
+from src.pagination import InvalidCursor, MAX_PAGE_SIZE, page_args, paginate_keyset, next_page_headers
+from src.search_index import search_restaurant_ids
+from src import geo
+from src.catalog_cache import group_menu_by_category, load_restaurant_menu
+from src.order_history import with_order_relations
+from src.order_placement import OrderError, place_order
 
 customer_bp = Blueprint('customer', __name__)
 
@@ -27,7 +32,7 @@ def register_customer():
             name=data['name'],
             email=data['email'],
             phone=data['phone'],
-            password_hash=generate_password_hash(data['password'])
+            password_hash=hash_password(data['password'])
         )
         
         db.session.add(customer)
@@ -38,6 +43,8 @@ def register_customer():
             'customer': customer.to_dict()
         }), 201
         
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -47,7 +54,7 @@ def login_customer():
         data = request.get_json()
         customer = Customer.query.filter_by(email=data['email']).first()
         
-        if customer and check_password_hash(customer.password_hash, data['password']):
+        if customer and check_password(customer.password_hash, data['password']):
             if not customer.is_active:
                 return jsonify({'error': 'Customer account is deactivated'}), 403
                 
@@ -58,6 +65,8 @@ def login_customer():
         else:
             return jsonify({'error': 'Invalid credentials'}), 401
             
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -137,21 +146,46 @@ def get_restaurants():
         # Get query parameters
         latitude = request.args.get('latitude', type=float)
         longitude = request.args.get('longitude', type=float)
+        radius_km = request.args.get('radius_km', type=float)
+        nearest_count = request.args.get('nearest', type=int)
         search = request.args.get('search', '')
         
         # Base query for active and approved restaurants
         query = Restaurant.query.filter_by(is_active=True, is_approved=True)
         
         # Add search filter
+        ranked_ids = None
         if search:
-            query = query.filter(Restaurant.name.contains(search))
-        
-        restaurants = query.all()
+            ranked_ids = search_restaurant_ids(search, limit=MAX_PAGE_SIZE)
+            if not ranked_ids:
+                return jsonify([]), 200
+            query = query.filter(Restaurant.id.in_(ranked_ids))
+        
+        if latitude is None or longitude is None:
+            restaurants = query.all()
+            if ranked_ids is not None:
+                rank = {rid: i for i, rid in enumerate(ranked_ids)}
+                restaurants.sort(key=lambda r: rank[r.id])
+            return jsonify([restaurant.to_dict() for restaurant in restaurants]), 200
+        
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return jsonify({'error': 'Invalid coordinates'}), 400
+        
+        # Nearest-first discovery over the geohash index
+        if nearest_count:
+            nearby = geo.nearest(query, Restaurant, latitude, longitude,
+                                 k=max(1, min(nearest_count, MAX_PAGE_SIZE)))
+        else:
+            nearby = geo.within_radius(query, Restaurant, latitude, longitude,
+                                       radius_km if radius_km and radius_km > 0 else geo.DEFAULT_RADIUS_KM)
         
-        # TODO: Add distance calculation if coordinates provided
-        # For now, return all restaurants
+        restaurants_data = []
+        for restaurant, distance in nearby:
+            restaurant_data = restaurant.to_dict()
+            restaurant_data['distance_km'] = round(distance, 3)
+            restaurants_data.append(restaurant_data)
         
-        return jsonify([restaurant.to_dict() for restaurant in restaurants]), 200
+        return jsonify(restaurants_data), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -159,8 +193,16 @@ def get_restaurants():
 @customer_bp.route('/restaurants/<int:restaurant_id>/menu', methods=['GET'])
 def get_restaurant_menu(restaurant_id):
     try:
-        restaurant = Restaurant.query.get_or_404(restaurant_id)
-        menu_items = MenuItem.query.filter_by(restaurant_id=restaurant_id, is_available=True).all()
+        # Restaurant and available items in one round trip
+        restaurant, menu_items = load_restaurant_menu(restaurant_id)
+        if restaurant is None:
+            return jsonify({'error': 'Restaurant not found'}), 404
+        
+        if request.args.get('group_by') == 'category':
+            return jsonify({
+                'restaurant': restaurant.to_dict(),
+                'menu': group_menu_by_category([item.to_dict() for item in menu_items])
+            }), 200
         
         return jsonify({
             'restaurant': restaurant.to_dict(),
@@ -174,60 +216,44 @@ def get_restaurant_menu(restaurant_id):
 @customer_bp.route('/customers/<int:customer_id>/orders', methods=['POST'])
 def create_order(customer_id):
     try:
-        data = request.get_json()
-        
-        # Generate unique order number
-        order_number = f"LVR{datetime.now().strftime('%Y%m%d')}{str(uuid.uuid4())[:8].upper()}"
+        data = request.get_json() or {}
         
-        # Calculate estimated delivery time
-        estimated_delivery = datetime.utcnow() + timedelta(minutes=data.get('estimated_delivery_time', 30))
-        
-        # Create order
-        order = Order(
+        # Prices come from the catalog; a client total is only checked against them
+        order, pricing = place_order(
             customer_id=customer_id,
-            restaurant_id=data['restaurant_id'],
-            order_number=order_number,
-            subtotal=data['subtotal'],
-            delivery_fee=data['delivery_fee'],
-            tax_amount=data.get('tax_amount', 0.0),
-            total_amount=data['total_amount'],
-            delivery_address=data['delivery_address'],
+            restaurant_id=data.get('restaurant_id'),
+            items=data.get('items'),
+            delivery_address=data.get('delivery_address'),
+            payment_method=data.get('payment_method'),
             delivery_latitude=data.get('delivery_latitude'),
             delivery_longitude=data.get('delivery_longitude'),
             delivery_notes=data.get('delivery_notes', ''),
-            payment_method=data['payment_method'],
-            estimated_delivery_time=estimated_delivery
+            expected_total=data.get('total_amount')
         )
         
-        db.session.add(order)
-        db.session.flush()  # Get order ID
-        
-        # Add order items
-        for item_data in data['items']:
-            order_item = OrderItem(
-                order_id=order.id,
-                menu_item_id=item_data['menu_item_id'],
-                quantity=item_data['quantity'],
-                unit_price=item_data['unit_price'],
-                total_price=item_data['total_price'],
-                special_instructions=item_data.get('special_instructions', '')
-            )
-            db.session.add(order_item)
-        
-        db.session.commit()
-        
+        order_dict = order.to_dict()
+        order_dict['items'] = pricing['lines']
         return jsonify({
             'message': 'Order created successfully',
-            'order': order.to_dict()
+            'order': order_dict
         }), 201
         
+    except OrderError as e:
+        response = {'error': str(e)}
+        if e.pricing:
+            response['pricing'] = e.pricing
+        return jsonify(response), e.status_code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @customer_bp.route('/customers/<int:customer_id>/orders', methods=['GET'])
 def get_customer_orders(customer_id):
     try:
-        orders = Order.query.filter_by(customer_id=customer_id).order_by(Order.created_at.desc()).all()
+        cursor, limit = page_args()
+        orders, next_cursor = paginate_keyset(
+            with_order_relations(Order.query.filter_by(customer_id=customer_id), 'order_items', 'restaurant'),
+            Order, cursor, limit
+        )
         
         # Include order items and restaurant info
         orders_data = []
@@ -237,8 +263,10 @@ def get_customer_orders(customer_id):
             order_dict['restaurant_name'] = order.restaurant.name if order.restaurant else None
             orders_data.append(order_dict)
         
-        return jsonify(orders_data), 200
+        return jsonify(orders_data), 200, next_page_headers(next_cursor)
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
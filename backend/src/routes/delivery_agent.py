@@ -1,8 +1,12 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from src.password_hashing import HashingPoolSaturated, hash_password, check_password
 from src.models.delivery_agent import db, DeliveryAgent
 from src.models.order import Order
 from datetime import datetime
+from src.pagination import InvalidCursor, page_args, paginate_keyset, next_page_headers
+from src.order_history import with_order_relations
+from src.order_dispatch import claim_order, claim_refusal
+from src.order_state import refusal_message, transition_orders
 
 delivery_agent_bp = Blueprint('delivery_agent', __name__)
 
@@ -25,7 +29,7 @@ def register_delivery_agent():
             name=data['name'],
             email=data['email'],
             phone=data['phone'],
-            password_hash=generate_password_hash(data['password']),
+            password_hash=hash_password(data['password']),
             vehicle_type=data['vehicle_type'],
             vehicle_number=data.get('vehicle_number', ''),
             license_number=data.get('license_number', '')
@@ -39,6 +43,8 @@ def register_delivery_agent():
             'agent': agent.to_dict()
         }), 201
         
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -48,7 +54,7 @@ def login_delivery_agent():
         data = request.get_json()
         agent = DeliveryAgent.query.filter_by(email=data['email']).first()
         
-        if agent and check_password_hash(agent.password_hash, data['password']):
+        if agent and check_password(agent.password_hash, data['password']):
             if not agent.is_active:
                 return jsonify({'error': 'Delivery agent account is deactivated'}), 403
             if not agent.is_approved:
@@ -61,6 +67,8 @@ def login_delivery_agent():
         else:
             return jsonify({'error': 'Invalid credentials'}), 401
             
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -145,10 +153,10 @@ def update_location(agent_id):
 def get_available_orders(agent_id):
     try:
         # Get orders that are ready for pickup and don't have a delivery agent assigned
-        orders = Order.query.filter_by(
+        orders = with_order_relations(Order.query.filter_by(
             status='ready',
             delivery_agent_id=None
-        ).order_by(Order.created_at.asc()).all()
+        ), 'restaurant', 'customer').order_by(Order.created_at.asc()).all()
         
         # Include restaurant and customer info
         orders_data = []
@@ -167,12 +175,13 @@ def get_available_orders(agent_id):
 def get_agent_orders(agent_id):
     try:
         status = request.args.get('status')
-        query = Order.query.filter_by(delivery_agent_id=agent_id)
+        query = with_order_relations(Order.query.filter_by(delivery_agent_id=agent_id), 'restaurant', 'customer')
         
         if status:
             query = query.filter_by(status=status)
         
-        orders = query.order_by(Order.created_at.desc()).all()
+        cursor, limit = page_args()
+        orders, next_cursor = paginate_keyset(query, Order, cursor, limit)
         
         # Include restaurant and customer info
         orders_data = []
@@ -182,8 +191,10 @@ def get_agent_orders(agent_id):
             order_dict['customer_name'] = order.customer.name if order.customer else None
             orders_data.append(order_dict)
         
-        return jsonify(orders_data), 200
+        return jsonify(orders_data), 200, next_page_headers(next_cursor)
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -193,26 +204,16 @@ def accept_order(order_id):
         data = request.get_json()
         agent_id = data['agent_id']
         
-        order = Order.query.get_or_404(order_id)
-        agent = DeliveryAgent.query.get_or_404(agent_id)
-        
-        # Check if order is still available
-        if order.delivery_agent_id is not None:
-            return jsonify({'error': 'Order already assigned to another agent'}), 400
-        
-        if order.status != 'ready':
-            return jsonify({'error': 'Order is not ready for pickup'}), 400
+        DeliveryAgent.query.get_or_404(agent_id)
         
-        # Assign order to agent
-        order.delivery_agent_id = agent_id
-        order.status = 'picked_up'
-        order.picked_up_at = datetime.utcnow()
-        
-        db.session.commit()
+        # Only one agent can win the order; the others get the reason back
+        if not claim_order(order_id, agent_id):
+            message, status_code = claim_refusal(order_id, agent_id)
+            return jsonify({'error': message}), status_code
         
         return jsonify({
             'message': 'Order accepted successfully',
-            'order': order.to_dict()
+            'order': Order.query.get(order_id).to_dict()
         }), 200
         
     except Exception as e:
@@ -223,16 +224,11 @@ def deliver_order(order_id):
     try:
         order = Order.query.get_or_404(order_id)
         
-        # Update order status
-        order.status = 'delivered'
-        order.delivered_at = datetime.utcnow()
-        order.payment_status = 'paid'  # Assuming cash payment is completed
-        
-        # Update agent stats
-        if order.delivery_agent:
-            order.delivery_agent.total_deliveries += 1
-        
-        db.session.commit()
+        # Marks cash orders paid and counts the delivery for the agent in the same transaction
+        result = transition_orders([order_id], 'delivered', order.delivery_agent_id, 'delivery_agent')
+        if order_id in result.refused:
+            message, status_code = refusal_message(result.refused[order_id], result.previous.get(order_id), 'delivered')
+            return jsonify({'error': message}), status_code
         
         return jsonify({
             'message': 'Order delivered successfully',
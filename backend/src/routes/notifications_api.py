@@ -11,8 +11,8 @@ from src.security_enhancements import rate_limit, sanitize_input
 notifications_bp = Blueprint('notifications', __name__)
 
 @notifications_bp.route('/notifications', methods=['GET'])
+@rate_limit(budget='reads', cost=2)
 @token_required
-@rate_limit(max_requests=30, window_minutes=1)
 def get_notifications(current_user, current_user_type):
     """
     Get user notifications
@@ -55,8 +55,8 @@ def get_notifications(current_user, current_user_type):
         }), 500
 
 @notifications_bp.route('/notifications/<int:notification_id>/read', methods=['POST'])
-@token_required
 @rate_limit(max_requests=60, window_minutes=1)
+@token_required
 def mark_notification_read(current_user, current_user_type, notification_id):
     """
     Mark a notification as read
@@ -83,8 +83,8 @@ def mark_notification_read(current_user, current_user_type, notification_id):
         }), 500
 
 @notifications_bp.route('/notifications/read-all', methods=['POST'])
-@token_required
 @rate_limit(max_requests=10, window_minutes=1)
+@token_required
 def mark_all_notifications_read(current_user, current_user_type):
     """
     Mark all notifications as read
@@ -114,8 +114,8 @@ def mark_all_notifications_read(current_user, current_user_type):
         }), 500
 
 @notifications_bp.route('/notifications/unread-count', methods=['GET'])
+@rate_limit(budget='reads')
 @token_required
-@rate_limit(max_requests=60, window_minutes=1)
 def get_unread_count(current_user, current_user_type):
     """
     Get count of unread notifications
@@ -140,8 +140,8 @@ def get_unread_count(current_user, current_user_type):
 
 # Admin endpoint to send custom notifications
 @notifications_bp.route('/admin/notifications/send', methods=['POST'])
-@token_required
 @rate_limit(max_requests=10, window_minutes=1)
+@token_required
 def send_custom_notification(current_user, current_user_type):
     """
     Send custom notification (Admin only)
@@ -196,8 +196,8 @@ def send_custom_notification(current_user, current_user_type):
 
 # Endpoint to send welcome notification to new users
 @notifications_bp.route('/notifications/welcome', methods=['POST'])
-@token_required
 @rate_limit(max_requests=5, window_minutes=1)
+@token_required
 def send_welcome(current_user, current_user_type):
     """
     Send welcome notification to current user
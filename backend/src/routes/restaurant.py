@@ -1,9 +1,12 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from src.password_hashing import HashingPoolSaturated, hash_password, check_password
 from src.models.restaurant import db, Restaurant, MenuItem
 from src.models.order import Order, OrderItem
 import uuid
 from datetime import datetime
+from src.pagination import InvalidCursor, page_args, paginate_keyset, next_page_headers
+from src.order_history import with_order_relations
+from src.order_state import refusal_message, transition_orders
 
 restaurant_bp = Blueprint('restaurant', __name__)
 
@@ -25,7 +28,7 @@ def register_restaurant():
             address=data['address'],
             phone=data.get('phone', ''),
             email=data['email'],
-            password_hash=generate_password_hash(data['password']),
+            password_hash=hash_password(data['password']),
             latitude=data.get('latitude'),
             longitude=data.get('longitude'),
             delivery_fee=data.get('delivery_fee', 0.0),
@@ -40,6 +43,8 @@ def register_restaurant():
             'restaurant': restaurant.to_dict()
         }), 201
         
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -49,7 +54,7 @@ def login_restaurant():
         data = request.get_json()
         restaurant = Restaurant.query.filter_by(email=data['email']).first()
         
-        if restaurant and check_password_hash(restaurant.password_hash, data['password']):
+        if restaurant and check_password(restaurant.password_hash, data['password']):
             if not restaurant.is_active:
                 return jsonify({'error': 'Restaurant account is deactivated'}), 403
             if not restaurant.is_approved:
@@ -62,6 +67,8 @@ def login_restaurant():
         else:
             return jsonify({'error': 'Invalid credentials'}), 401
             
+    except HashingPoolSaturated:
+        raise  # answered with 429 by the app's error handler
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -170,12 +177,13 @@ def delete_menu_item(item_id):
 def get_restaurant_orders(restaurant_id):
     try:
         status = request.args.get('status')
-        query = Order.query.filter_by(restaurant_id=restaurant_id)
+        query = with_order_relations(Order.query.filter_by(restaurant_id=restaurant_id), 'order_items', 'customer')
         
         if status:
             query = query.filter_by(status=status)
         
-        orders = query.order_by(Order.created_at.desc()).all()
+        cursor, limit = page_args()
+        orders, next_cursor = paginate_keyset(query, Order, cursor, limit)
         
         # Include order items and customer info
         orders_data = []
@@ -185,8 +193,10 @@ def get_restaurant_orders(restaurant_id):
             order_dict['customer_name'] = order.customer.name if order.customer else None
             orders_data.append(order_dict)
         
-        return jsonify(orders_data), 200
+        return jsonify(orders_data), 200, next_page_headers(next_cursor)
         
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -197,17 +207,11 @@ def update_order_status(order_id):
         data = request.get_json()
         new_status = data['status']
         
-        # Update status and timestamp
-        order.status = new_status
-        
-        if new_status == 'confirmed':
-            order.confirmed_at = datetime.utcnow()
-        elif new_status == 'preparing':
-            order.confirmed_at = order.confirmed_at or datetime.utcnow()
-        elif new_status == 'ready':
-            order.prepared_at = datetime.utcnow()
-        
-        db.session.commit()
+        # Status, timestamps and tracking are written by the order state machine
+        result = transition_orders([order_id], new_status, order.restaurant_id, 'restaurant')
+        if order_id in result.refused:
+            message, status_code = refusal_message(result.refused[order_id], result.previous.get(order_id), new_status)
+            return jsonify({'error': message}), status_code
         
         return jsonify({
             'message': 'Order status updated successfully',
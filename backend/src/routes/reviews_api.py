@@ -0,0 +1,93 @@
+"""
+Reviews API Routes
+مسارات API للتقييمات
+"""
+
+from flask import Blueprint, request, jsonify, g
+from src.routes.auth import token_required
+from src.models.user import db
+from src.models.restaurant import Restaurant
+from src.reviews import ReviewService, ReviewError
+from src.pagination import InvalidCursor, page_args
+from src.security_enhancements import rate_limit, sanitize_input
+
+reviews_bp = Blueprint('reviews', __name__)
+
+@reviews_bp.route('/orders/<int:order_id>/review', methods=['POST'])
+@rate_limit(max_requests=10, window_minutes=1)
+@token_required
+def submit_review(current_user, order_id):
+    """
+    Rate a delivered order
+    تقييم طلب تم توصيله
+    """
+    try:
+        if g.token_claims.get('user_type') != 'customer':
+            return jsonify({
+                'success': False,
+                'message': 'Only customers can review orders'
+            }), 403
+        
+        data = request.get_json() or {}
+        comment = data.get('comment')
+        
+        review = ReviewService.submit_review(
+            order_id=order_id,
+            customer_id=current_user.id,
+            restaurant_rating=data.get('restaurant_rating'),
+            agent_rating=data.get('agent_rating'),
+            comment=sanitize_input(comment) if comment else None
+        )
+        
+        return jsonify({
+            'success': True,
+            'review': review.to_dict()
+        }), 201
+        
+    except ReviewError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), e.status_code
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Failed to submit review: {str(e)}'
+        }), 500
+
+@reviews_bp.route('/restaurants/<int:restaurant_id>/reviews', methods=['GET'])
+def get_restaurant_reviews(restaurant_id):
+    """
+    Reviews of a restaurant with its precomputed rating
+    تقييمات المطعم مع المعدل المحسوب مسبقاً
+    """
+    try:
+        restaurant = db.session.get(Restaurant, restaurant_id)
+        if restaurant is None:
+            return jsonify({
+                'success': False,
+                'message': 'Restaurant not found'
+            }), 404
+        
+        cursor, limit = page_args()
+        reviews, next_cursor = ReviewService.get_restaurant_reviews(restaurant_id, cursor, limit)
+        
+        return jsonify({
+            'success': True,
+            'rating': restaurant.rating,
+            'rating_count': restaurant.rating_count,
+            'reviews': [review.to_dict() for review in reviews],
+            'next_cursor': next_cursor
+        }), 200
+        
+    except InvalidCursor:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid cursor'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Failed to fetch reviews: {str(e)}'
+        }), 500
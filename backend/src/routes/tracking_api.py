@@ -7,13 +7,14 @@ from flask import Blueprint, request, jsonify
 from src.routes.auth import token_required
 from src.order_tracking import OrderTrackingService
 from src.models.order import Order
+from src.order_state import FORBIDDEN, NOT_FOUND, transition_orders
 from src.security_enhancements import rate_limit, sanitize_input
 
 tracking_bp = Blueprint('tracking', __name__)
 
 @tracking_bp.route('/orders/<int:order_id>/status', methods=['GET'])
+@rate_limit(budget='reads')
 @token_required
-@rate_limit(max_requests=60, window_minutes=1)
 def get_order_status(current_user, current_user_type, order_id):
     """
     Get current order status and tracking information
@@ -66,8 +67,8 @@ def get_order_status(current_user, current_user_type, order_id):
         }), 500
 
 @tracking_bp.route('/orders/<int:order_id>/history', methods=['GET'])
+@rate_limit(budget='reads', cost=2)
 @token_required
-@rate_limit(max_requests=30, window_minutes=1)
 def get_order_tracking_history(current_user, current_user_type, order_id):
     """
     Get complete tracking history for an order
@@ -114,8 +115,8 @@ def get_order_tracking_history(current_user, current_user_type, order_id):
         }), 500
 
 @tracking_bp.route('/orders/<int:order_id>/update-status', methods=['POST'])
-@token_required
 @rate_limit(max_requests=20, window_minutes=1)
+@token_required
 def update_order_status(current_user, current_user_type, order_id):
     """
     Update order status
@@ -136,63 +137,33 @@ def update_order_status(current_user, current_user_type, order_id):
         location_lng = data.get('location_longitude')
         notes = data.get('notes')
         
-        # Verify user has permission to update this order
-        order = Order.query.get(order_id)
-        if not order:
+        # The state machine checks the user may set this status on this order
+        result = transition_orders(
+            [order_id], new_status, current_user.id, current_user_type,
+            notes=notes, location_lat=location_lat, location_lng=location_lng, authorize=True
+        )
+        
+        reason = result.refused.get(order_id)
+        if reason == NOT_FOUND:
             return jsonify({
                 'success': False,
                 'message': 'الطلب غير موجود'
             }), 404
-        
-        # Check permissions based on user type and status
-        can_update = False
-        
-        if current_user_type == 'restaurant' and order.restaurant_id == current_user.id:
-            # Restaurant can update: confirmed, preparing, ready, cancelled
-            if new_status in ['confirmed', 'preparing', 'ready', 'cancelled']:
-                can_update = True
-        
-        elif current_user_type == 'delivery_agent' and order.delivery_agent_id == current_user.id:
-            # Delivery agent can update: picked_up, delivered
-            if new_status in ['picked_up', 'delivered']:
-                can_update = True
-        
-        elif current_user_type == 'admin':
-            # Admin can update any status
-            can_update = True
-        
-        elif current_user_type == 'customer' and order.customer_id == current_user.id:
-            # Customer can only cancel pending orders
-            if new_status == 'cancelled' and order.status == 'pending':
-                can_update = True
-        
-        if not can_update:
+        if reason == FORBIDDEN:
             return jsonify({
                 'success': False,
                 'message': 'غير مصرح لك بتحديث حالة هذا الطلب'
             }), 403
-        
-        # Update order status
-        success, message = OrderTrackingService.update_order_status(
-            order_id=order_id,
-            new_status=new_status,
-            updated_by=current_user.id,
-            updated_by_type=current_user_type,
-            location_lat=location_lat,
-            location_lng=location_lng,
-            notes=notes
-        )
-        
-        if success:
-            return jsonify({
-                'success': True,
-                'message': message
-            }), 200
-        else:
+        if reason:
             return jsonify({
                 'success': False,
-                'message': message
+                'message': f"لا يمكن تغيير الحالة من {result.previous[order_id]} إلى {new_status}"
             }), 400
+        
+        return jsonify({
+            'success': True,
+            'message': 'تم تحديث حالة الطلب بنجاح'
+        }), 200
             
     except Exception as e:
         return jsonify({
@@ -201,8 +172,8 @@ def update_order_status(current_user, current_user_type, order_id):
         }), 500
 
 @tracking_bp.route('/delivery-agent/current-orders', methods=['GET'])
+@rate_limit(budget='reads', cost=2)
 @token_required
-@rate_limit(max_requests=30, window_minutes=1)
 def get_delivery_agent_orders(current_user, current_user_type):
     """
     Get current orders for delivery agent
@@ -230,8 +201,8 @@ def get_delivery_agent_orders(current_user, current_user_type):
         }), 500
 
 @tracking_bp.route('/restaurant/<int:restaurant_id>/orders-summary', methods=['GET'])
+@rate_limit(budget='reads', cost=3)
 @token_required
-@rate_limit(max_requests=30, window_minutes=1)
 def get_restaurant_orders_summary(current_user, current_user_type, restaurant_id):
     """
     Get orders summary for restaurant
@@ -278,8 +249,8 @@ def get_restaurant_orders_summary(current_user, current_user_type, restaurant_id
         }), 500
 
 @tracking_bp.route('/orders/<int:order_id>/metrics', methods=['GET'])
+@rate_limit(budget='reads', cost=5)
 @token_required
-@rate_limit(max_requests=30, window_minutes=1)
 def get_order_metrics(current_user, current_user_type, order_id):
     """
     Get delivery performance metrics for an order
@@ -0,0 +1,336 @@
+"""
+Catalog Search Index for Livreure
+فهرس البحث في الكتالوج لمنصة Livreure
+
+Restaurants and menu items are indexed in a full-text table that is kept up
+to date from the same transaction that writes them:
+
+- SQLite: an FTS5 virtual table ranked with bm25()
+- PostgreSQL: a table with a GIN-indexed tsvector ranked with ts_rank()
+- anything else: the same table without a tsvector, matched with LIKE on the
+  normalized text (still one indexed table instead of scanning the catalog)
+
+Both the indexed text and the query go through normalize_text(), which folds
+case, strips French accents and Arabic diacritics/tatweel, and unifies the
+alef, ya and ta marbuta spellings, so "Crêpe", "crepe", "أحمد" and "احمد"
+all match.
+"""
+
+import re
+import unicodedata
+
+from sqlalchemy import bindparam, event, inspect, text
+from sqlalchemy.orm import Session
+
+from src.models.user import db
+from src.models.restaurant import Restaurant, MenuItem
+
+SEARCH_TABLE = 'catalog_search'
+
+_ARABIC_FOLDING = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ة': 'ه',
+    'ؤ': 'و',
+    'ـ': None  # tatweel
+})
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_ARTICLE_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+
+_INDEXED_FIELDS = {
+    Restaurant: ('name', 'description', 'category'),
+    MenuItem: ('name', 'description', 'category', 'ingredients')
+}
+
+
+def normalize_text(value):
+    """
+    Normalize Arabic and French text for indexing and querying
+    توحيد النصوص العربية والفرنسية للفهرسة والبحث
+    """
+    if not value:
+        return ''
+    if not value.isascii():
+        value = value.translate(_ARABIC_FOLDING)
+        value = unicodedata.normalize('NFKD', value)
+        value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return ' '.join(_TOKEN_RE.findall(value.casefold()))
+
+
+def _strip_article(token):
+    """
+    Drop a leading Arabic definite article, alone or after و/ب/ك/ف/ل
+    حذف أداة التعريف من بداية الكلمة، منفردة أو بعد و/ب/ك/ف/ل
+    """
+    for prefix in _ARTICLE_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+
+def _tokens(value):
+    """
+    Normalized tokens plus the article-less form of each Arabic word
+    الكلمات الموحدة مع صيغة كل كلمة عربية بدون أداة التعريف
+    """
+    tokens = []
+    for token in normalize_text(value).split():
+        tokens.append(token)
+        stem = _strip_article(token)
+        if stem != token:
+            tokens.append(stem)
+    return tokens
+
+
+def _dialect(connection):
+    return connection.dialect.name
+
+
+def create_search_table(connection):
+    """
+    Create the search table for the connection's dialect
+    إنشاء جدول البحث حسب نوع قاعدة البيانات
+    """
+    dialect = _dialect(connection)
+    if dialect == 'sqlite':
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "doc_type UNINDEXED, doc_id UNINDEXED, restaurant_id UNINDEXED, name, body, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        ))
+    elif dialect == 'postgresql':
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "doc_type VARCHAR(20) NOT NULL, doc_id INTEGER NOT NULL, restaurant_id INTEGER NOT NULL, "
+            "name TEXT NOT NULL, body TEXT NOT NULL, "
+            "document tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', body), 'B')) STORED, "
+            "PRIMARY KEY (doc_type, doc_id))"
+        ))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)"
+        ))
+    else:
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "doc_type VARCHAR(20) NOT NULL, doc_id INTEGER NOT NULL, restaurant_id INTEGER NOT NULL, "
+            "name TEXT NOT NULL, body TEXT NOT NULL, PRIMARY KEY (doc_type, doc_id))"
+        ))
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def _create_search_table(target, connection, **kw):
+    create_search_table(connection)
+
+
+@event.listens_for(db.Model.metadata, 'before_drop')
+def _drop_search_table(target, connection, **kw):
+    connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+
+
+def _make_document(doc_type, doc_id, restaurant_id, name, body_parts):
+    return {'doc_type': doc_type, 'doc_id': doc_id, 'restaurant_id': restaurant_id,
+            'name': ' '.join(_tokens(name)),
+            'body': ' '.join(_tokens(' '.join(part or '' for part in body_parts)))}
+
+
+def _document(instance):
+    if isinstance(instance, Restaurant):
+        doc_type, restaurant_id = 'restaurant', instance.id
+    else:
+        doc_type, restaurant_id = 'menu_item', instance.restaurant_id
+    return _make_document(doc_type, instance.id, restaurant_id, instance.name, [
+        getattr(instance, field) for field in _INDEXED_FIELDS[type(instance)][1:]
+    ])
+
+
+def _doc_type(instance):
+    return 'restaurant' if isinstance(instance, Restaurant) else 'menu_item'
+
+
+def remove_documents(connection, keys):
+    """
+    Remove (doc_type, doc_id) entries from the index
+    حذف عناصر من الفهرس
+    """
+    by_type = {}
+    for doc_type, doc_id in keys:
+        by_type.setdefault(doc_type, []).append(doc_id)
+    # One IN list per batch: doc_id is not indexed in the FTS5 table, so a
+    # statement per key would scan the whole index once per key
+    for doc_type, doc_ids in by_type.items():
+        for start in range(0, len(doc_ids), 500):
+            connection.execute(
+                text(f"DELETE FROM {SEARCH_TABLE} WHERE doc_type = :doc_type AND doc_id IN :doc_ids")
+                .bindparams(bindparam('doc_ids', expanding=True)),
+                {'doc_type': doc_type, 'doc_ids': doc_ids[start:start + 500]}
+            )
+
+
+def index_documents(connection, instances, replace=True):
+    """
+    Insert or replace the index entries of restaurants and menu items
+    إضافة أو تحديث عناصر الفهرس للمطاعم والأطباق
+
+    replace=False skips removing old entries, for rows known to be new.
+    """
+    documents = [_document(instance) for instance in instances]
+    if not documents:
+        return
+    if replace:
+        remove_documents(connection, [(doc['doc_type'], doc['doc_id']) for doc in documents])
+    connection.execute(
+        text(f"INSERT INTO {SEARCH_TABLE} (doc_type, doc_id, restaurant_id, name, body) "
+             "VALUES (:doc_type, :doc_id, :restaurant_id, :name, :body)"),
+        documents
+    )
+
+
+def index_new_menu_rows(connection, rows):
+    """
+    Index menu items just inserted from plain dicts (with their id), without loading them
+    فهرسة أطباق أُدرجت للتو من قواميس بياناتها دون إعادة تحميلها
+    """
+    if rows:
+        connection.execute(
+            text(f"INSERT INTO {SEARCH_TABLE} (doc_type, doc_id, restaurant_id, name, body) "
+                 "VALUES (:doc_type, :doc_id, :restaurant_id, :name, :body)"),
+            [_make_document('menu_item', row['id'], row['restaurant_id'], row['name'],
+                            [row.get(field) for field in _INDEXED_FIELDS[MenuItem][1:]])
+             for row in rows]
+        )
+
+
+def index_menu_items_by_id(connection, item_ids, replace=True):
+    """
+    Re-index menu items written with bulk statements that bypass the ORM hooks
+    إعادة فهرسة الأطباق المكتوبة بعمليات جماعية لا تمر عبر ORM
+    """
+    if not item_ids:
+        return
+    items = db.session.query(MenuItem).filter(MenuItem.id.in_(list(item_ids))).all()
+    if replace:
+        found = {item.id for item in items}
+        remove_documents(connection, [('menu_item', item_id) for item_id in item_ids if item_id not in found])
+    index_documents(connection, items, replace)
+
+
+def rebuild_search_index():
+    """
+    Rebuild the whole index from the catalog tables
+    إعادة بناء الفهرس بالكامل من جداول الكتالوج
+    """
+    connection = db.session.connection()
+    create_search_table(connection)
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    for model in (Restaurant, MenuItem):
+        batch = []
+        for instance in db.session.query(model).yield_per(1000):
+            batch.append(instance)
+            if len(batch) >= 1000:
+                index_documents(connection, batch, replace=False)
+                batch = []
+        index_documents(connection, batch, replace=False)
+    db.session.commit()
+
+
+# Incremental maintenance: index rows in the flush that writes them
+
+def _text_changed(instance):
+    state = inspect(instance)
+    fields = _INDEXED_FIELDS[type(instance)] + (('restaurant_id',) if isinstance(instance, MenuItem) else ())
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    changed = [obj for obj in session.new if type(obj) in _INDEXED_FIELDS]
+    changed += [obj for obj in session.dirty if type(obj) in _INDEXED_FIELDS and _text_changed(obj)]
+    removed = [(_doc_type(obj), obj.id) for obj in session.deleted if type(obj) in _INDEXED_FIELDS]
+    if not changed and not removed:
+        return
+    connection = session.connection()
+    remove_documents(connection, removed)
+    index_documents(connection, changed)
+
+
+def _fts_query(tokens):
+    return ' '.join('"%s"*' % token.replace('"', '') for token in tokens)
+
+
+def search_catalog(query, doc_type=None, limit=20):
+    """
+    Ranked search over restaurants and menu items
+    بحث مرتب حسب الصلة في المطاعم والأطباق
+
+    Returns a list of dicts with doc_type, doc_id, restaurant_id and score
+    (higher is better). Every query word must match, as a prefix.
+    """
+    tokens = [_strip_article(token) for token in normalize_text(query).split()]
+    if not tokens:
+        return []
+
+    connection = db.session.connection()
+    dialect = _dialect(connection)
+    params = {'limit': limit}
+    type_filter = ''
+    if doc_type:
+        type_filter = ' AND doc_type = :doc_type'
+        params['doc_type'] = doc_type
+
+    if dialect == 'sqlite':
+        params['match'] = _fts_query(tokens)
+        rows = connection.execute(text(
+            f"SELECT doc_type, doc_id, restaurant_id, -bm25({SEARCH_TABLE}, 0, 0, 0, 10.0, 1.0) AS score "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match{type_filter} "
+            "ORDER BY score DESC LIMIT :limit"
+        ), params)
+    elif dialect == 'postgresql':
+        params['tsquery'] = ' & '.join(re.sub(r'\W', '', token) + ':*' for token in tokens)
+        rows = connection.execute(text(
+            "SELECT doc_type, doc_id, restaurant_id, ts_rank(document, q) AS score "
+            f"FROM {SEARCH_TABLE}, to_tsquery('simple', :tsquery) q "
+            f"WHERE document @@ q{type_filter} ORDER BY score DESC LIMIT :limit"
+        ), params)
+    else:
+        clauses = []
+        for i, token in enumerate(tokens):
+            params[f'token{i}'] = f'%{token}%'
+            clauses.append(f"(name LIKE :token{i} OR body LIKE :token{i})")
+        params['name_match'] = f'%{tokens[0]}%'
+        rows = connection.execute(text(
+            "SELECT doc_type, doc_id, restaurant_id, "
+            "CASE WHEN name LIKE :name_match THEN 2 ELSE 1 END AS score "
+            f"FROM {SEARCH_TABLE} WHERE {' AND '.join(clauses)}{type_filter} "
+            "ORDER BY score DESC LIMIT :limit"
+        ), params)
+
+    return [
+        {'doc_type': row[0], 'doc_id': int(row[1]), 'restaurant_id': int(row[2]), 'score': float(row[3])}
+        for row in rows
+    ]
+
+
+def search_restaurant_ids(query, limit=50):
+    """
+    Ids of restaurants matching query by themselves or by a menu item, best first
+    معرفات المطاعم المطابقة بنفسها أو بأحد أطباقها مرتبة حسب الأفضلية
+    """
+    restaurant_ids = []
+    for hit in search_catalog(query, limit=limit * 4):
+        if hit['restaurant_id'] not in restaurant_ids:
+            restaurant_ids.append(hit['restaurant_id'])
+    return restaurant_ids[:limit]
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from src.main import app
+
+    with app.app_context():
+        rebuild_search_index()
+        print('Search index rebuilt')
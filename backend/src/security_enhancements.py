@@ -4,15 +4,234 @@ Security Enhancements for Livreure Backend
 """
 
 import hashlib
+import logging
+import os
 import secrets
 import re
+import threading
+from collections import OrderedDict
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, make_response
 from datetime import datetime, timedelta
 import time
 
-# Rate limiting storage (in production, use Redis)
-rate_limit_storage = {}
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowRateLimiter:
+    """
+    Thread-safe sliding-window counter limiter with bounded memory
+    محدد معدل بنافذة منزلقة آمن للخيوط مع ذاكرة محدودة
+
+    Each key keeps only the request count of the current and previous fixed
+    windows; the previous count is weighted by how much of it still overlaps
+    the sliding window. Checks are O(1), idle keys are swept periodically and
+    the key table never grows past max_keys (least recently seen keys go first).
+    """
+
+    def __init__(self, max_keys=100000, sweep_interval=60):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()  # key -> [window_index, current, previous, window_seconds, last_seen]
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def hit(self, key, limit, window_seconds, cost=1):
+        """
+        Record a request of the given cost; returns (allowed, remaining, reset_after)
+        تسجيل طلب بالتكلفة المحددة؛ يرجع (مسموح، المتبقي، ثواني حتى إعادة التعيين)
+        """
+        now = time.monotonic()
+        window = int(now // window_seconds)
+        elapsed = (now % window_seconds) / window_seconds
+
+        with self._lock:
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [window, 0, 0, window_seconds, now]
+                self._entries[key] = entry
+                if len(self._entries) > self.max_keys:
+                    self._evict(now)
+            elif entry[0] != window:
+                entry[2] = entry[1] if entry[0] == window - 1 else 0
+                entry[1] = 0
+                entry[0] = window
+            self._entries.move_to_end(key)
+            entry[4] = now
+
+            used = entry[2] * (1 - elapsed) + entry[1]
+            reset_after = int(window_seconds * (1 - elapsed)) + 1
+            if used + cost > limit:
+                return False, max(0, int(limit - used)), reset_after
+
+            entry[1] += cost
+            return True, max(0, int(limit - used - cost)), reset_after
+
+    def _sweep(self, now):
+        # Keys untouched for two windows carry no state worth keeping
+        idle = [key for key, entry in self._entries.items() if now - entry[4] >= 2 * entry[3]]
+        for key in idle:
+            del self._entries[key]
+        self._last_sweep = now
+
+    def _evict(self, now):
+        # Least recently seen keys sit at the front; idle ones wait for the next sweep
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedWindowRateLimiter:
+    """
+    Sliding-window limiter whose counters live in a shared backend
+    محدد معدل بنافذة منزلقة تُحفظ عداداته في مخزن مشترك
+
+    Accepted requests are accumulated locally and written to the backend in
+    one batched increment once batch_size requests are pending or
+    flush_interval has passed. A key's shared counts are re-read (together
+    with its own pending increments) at most once per flush_interval, so the
+    store sees a bounded number of round trips however busy a worker is.
+
+    When the backend fails the limiter fails open: pending increments are
+    kept for the next successful write, the error is logged, and for
+    retry_interval seconds requests are counted by per-worker counters
+    instead of turning every rate-limited endpoint into a 500.
+    """
+
+    def __init__(self, backend, batch_size=20, flush_interval=0.25, max_keys=100000, retry_interval=5.0):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.retry_interval = retry_interval
+        self._fallback = SlidingWindowRateLimiter(max_keys=max_keys)
+        self._backend_down_until = 0.0
+        self.backend_errors = 0
+        self._views = OrderedDict()  # key -> [window_index, current, previous, synced_at]
+        self._pending = {}  # (key, window_index) -> [amount, window_seconds]
+        self._pending_hits = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window_seconds, cost=1):
+        """
+        Record a request of the given cost; returns (allowed, remaining, reset_after)
+        تسجيل طلب بالتكلفة المحددة؛ يرجع (مسموح، المتبقي، ثواني حتى إعادة التعيين)
+        """
+        now = time.monotonic()
+        wall = time.time()
+        window = int(wall // window_seconds)
+        elapsed = (wall % window_seconds) / window_seconds
+
+        with self._lock:
+            if now < self._backend_down_until:
+                return self._fallback.hit(key, limit, window_seconds, cost)
+            view = self._views.get(key)
+            if view is None or view[0] != window or now - view[3] >= self.flush_interval:
+                try:
+                    view = self._sync(key, window, window_seconds, now)
+                except Exception:
+                    self._backend_failed(now)
+                    return self._fallback.hit(key, limit, window_seconds, cost)
+            self._views.move_to_end(key)
+
+            pending = self._pending.get((key, window))
+            local = pending[0] if pending else 0
+            used = view[2] * (1 - elapsed) + view[1] + local
+            reset_after = int(window_seconds * (1 - elapsed)) + 1
+            if used + cost > limit:
+                return False, max(0, int(limit - used)), reset_after
+
+            if pending:
+                pending[0] += cost
+            else:
+                self._pending[(key, window)] = [cost, window_seconds]
+            self._pending_hits += 1
+            if self._pending_hits >= self.batch_size or now - self._last_flush >= self.flush_interval:
+                self._flush(now)
+            return True, max(0, int(limit - used - cost)), reset_after
+
+    def _sync(self, key, window, window_seconds, now):
+        pending = self._pending.get((key, window))
+        amount = pending[0] if pending else 0
+        current, previous = self.backend.increment([(key, window, window_seconds, amount)])[0]
+        # Only drop the pending count once the backend has it
+        self._pending.pop((key, window), None)
+        view = [window, current, previous, now]
+        self._views[key] = view
+        while len(self._views) > self.max_keys:
+            self._views.popitem(last=False)
+        return view
+
+    def _flush(self, now):
+        self._last_flush = now
+        # Counts kept through an outage stop mattering once their window has slid past
+        wall = time.time()
+        entries = [(key, window, window_seconds, amount)
+                   for (key, window), (amount, window_seconds) in self._pending.items()
+                   if window >= int(wall // window_seconds) - 1]
+        if not entries:
+            self._pending = {}
+            self._pending_hits = 0
+            return
+        try:
+            results = self.backend.increment(entries)
+        except Exception:
+            self._backend_failed(now)
+            return
+        self._pending = {}
+        self._pending_hits = 0
+        for (key, window, _, _), (current, previous) in zip(entries, results):
+            self._views[key] = [window, current, previous, now]
+
+    def _backend_failed(self, now):
+        self.backend_errors += 1
+        self._backend_down_until = now + self.retry_interval
+        logger.warning('Rate limit backend failed; counting per worker for %ss', self.retry_interval, exc_info=True)
+
+    def flush(self):
+        with self._lock:
+            self._flush(time.monotonic())
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+            self._pending = {}
+            self._pending_hits = 0
+            self._fallback.reset()
+            self._backend_down_until = 0.0
+
+    def __len__(self):
+        return len(self._views)
+
+
+def create_rate_limiter(backend_url=None):
+    """
+    Build the limiter for RATE_LIMIT_BACKEND (in-process when unset)
+    إنشاء محدد المعدل حسب RATE_LIMIT_BACKEND (داخل العملية إذا لم يُحدد)
+    """
+    if not backend_url or backend_url == 'local':
+        return SlidingWindowRateLimiter()
+
+    from src.rate_limit_backends import create_backend
+    return SharedWindowRateLimiter(
+        create_backend(backend_url),
+        batch_size=int(os.environ.get('RATE_LIMIT_BATCH_SIZE', 20)),
+        flush_interval=float(os.environ.get('RATE_LIMIT_FLUSH_INTERVAL', 0.25))
+    )
+
+
+# Rate limiting storage (per process unless RATE_LIMIT_BACKEND points at a shared store)
+rate_limiter = create_rate_limiter(os.environ.get('RATE_LIMIT_BACKEND'))
 
 def generate_secure_password_hash(password):
     """
@@ -75,44 +294,94 @@ def validate_phone(phone):
     pattern = r'^(\+222|222)?[0-9]{8}$'
     return re.match(pattern, phone.replace(' ', '').replace('-', '')) is not None
 
-def rate_limit(max_requests=60, window_minutes=1):
+# Reverse proxies in front of the app (e.g. 1 for nginx); 0 ignores X-Forwarded-For
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+
+def client_ip():
+    """
+    Client address, read from X-Forwarded-For only as far as trusted proxies vouch for it
+    عنوان العميل، يُقرأ من X-Forwarded-For فقط بقدر ما تضمنه الوكلاء الموثوقة
+    """
+    if TRUSTED_PROXY_COUNT > 0:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        # Each trusted proxy appends the address it saw; anything further left is client-supplied
+        if len(forwarded) >= TRUSTED_PROXY_COUNT:
+            return forwarded[-TRUSTED_PROXY_COUNT]
+    return request.remote_addr
+
+def _rate_limit_identity():
+    """
+    Key the budget on the JWT principal when a valid token is sent, else on the client IP
+    ربط الحصة بصاحب رمز JWT عند وجوده، وإلا بعنوان IP للعميل
+    """
+    token = request.headers.get('Authorization')
+    if token:
+        from src.routes.auth import JWT_SECRET
+        from src.jwt_cache import decode_token
+        import jwt
+
+        if token.startswith('Bearer '):
+            token = token[7:]
+        try:
+            claims = decode_token(token, JWT_SECRET)
+            return f"{claims['user_type']}:{claims['user_id']}"
+        except (jwt.InvalidTokenError, KeyError):
+            # token_required will reject it; throttle by IP meanwhile
+            pass
+    return client_ip()
+
+# Budgets shared by every endpoint that names one: (cost units, window minutes)
+RATE_LIMIT_BUDGETS = {
+    'reads': (int(os.environ.get('RATE_LIMIT_READ_BUDGET', 120)), 1)
+}
+
+def rate_limit(max_requests=60, window_minutes=1, cost=1, budget=None):
     """
     Rate limiting decorator
     محدد معدل الطلبات
+
+    Without budget, the endpoint has its own allowance of max_requests per
+    window. With budget, it draws on that shared RATE_LIMIT_BUDGETS entry
+    instead, together with every other endpoint naming it, and each call
+    consumes cost units of it: a client may poll a cheap status endpoint
+    often or fetch expensive metrics a few times, but not both at full rate.
+    Authenticated callers get their own budgets (clients behind a shared
+    carrier NAT no longer share one), and every response reports the budget
+    in X-RateLimit-* headers.
+
+    Apply it above token_required so throttled requests are rejected
+    before the token is decoded and the user row is loaded.
     """
+    if budget is not None:
+        max_requests, window_minutes = RATE_LIMIT_BUDGETS[budget]
+    window_seconds = window_minutes * 60
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Get client IP
-            client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-            
-            # Create key for this IP and endpoint
-            key = f"{client_ip}:{request.endpoint}"
+            # Create key for this principal (or IP) and budget or endpoint
+            key = f"{_rate_limit_identity()}:{budget or request.endpoint}"
             
-            # Get current time
-            now = time.time()
-            window_start = now - (window_minutes * 60)
-            
-            # Initialize or clean old requests
-            if key not in rate_limit_storage:
-                rate_limit_storage[key] = []
-            
-            # Remove old requests outside the window
-            rate_limit_storage[key] = [req_time for req_time in rate_limit_storage[key] 
-                                     if req_time > window_start]
+            allowed, remaining, reset_after = rate_limiter.hit(key, max_requests, window_seconds, cost)
+            headers = {
+                'X-RateLimit-Limit': str(max_requests),
+                'X-RateLimit-Remaining': str(remaining),
+                'X-RateLimit-Reset': str(reset_after),
+                'X-RateLimit-Cost': str(cost)
+            }
             
             # Check if limit exceeded
-            if len(rate_limit_storage[key]) >= max_requests:
+            if not allowed:
+                headers['Retry-After'] = str(reset_after)
                 return jsonify({
                     'success': False,
                     'message': 'تم تجاوز الحد المسموح من الطلبات. يرجى المحاولة لاحقاً',
-                    'retry_after': window_minutes * 60
-                }), 429
-            
-            # Add current request
-            rate_limit_storage[key].append(now)
+                    'retry_after': reset_after
+                }), 429, headers
             
-            return f(*args, **kwargs)
+            response = make_response(f(*args, **kwargs))
+            response.headers.extend(headers)
+            return response
         return decorated_function
     return decorator
 
@@ -152,7 +421,7 @@ def log_security_event(event_type, user_id=None, ip_address=None, details=None):
         'timestamp': datetime.utcnow().isoformat(),
         'event_type': event_type,
         'user_id': user_id,
-        'ip_address': ip_address or request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr),
+        'ip_address': ip_address or client_ip(),
         'details': details
     }
     
@@ -0,0 +1,147 @@
+"""
+Token Revocation for Livreure
+إلغاء رموز الدخول لمنصة Livreure
+
+Tokens live for 30 days, so logout has to be able to kill one. Revoked
+token IDs (jti) are written to the revoked_tokens table and mirrored in an
+in-memory set in every worker. token_required only checks that set; each
+worker picks up revocations made elsewhere with one indexed range query at
+most every REVOCATION_SYNC_INTERVAL seconds, never per request.
+
+The range is on revoked_at, starting REVOCATION_SYNC_OVERLAP seconds before
+the newest revocation already seen. Ids or timestamps do not become visible
+in order when logouts commit concurrently, so a plain high-water mark could
+step past a row that commits late; re-reading the overlap catches it, and
+rows already known are simply set again.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db
+
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    user_type = db.Column(db.String(20), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'jti': self.jti,
+            'user_id': self.user_id,
+            'user_type': self.user_type,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'revoked_at': self.revoked_at.isoformat() if self.revoked_at else None
+        }
+
+
+class RevocationList:
+    """
+    In-memory mirror of revoked_tokens
+    نسخة في الذاكرة من جدول الرموز الملغاة
+    """
+
+    def __init__(self, sync_interval=5.0, purge_interval=3600.0, sync_overlap=60.0):
+        self.sync_interval = sync_interval
+        self.purge_interval = purge_interval
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        self._revoked = {}  # jti -> exp (unix seconds)
+        self._newest = None  # latest revoked_at loaded
+        self._last_sync = None
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        """
+        O(1) membership check, syncing from the table when the interval has passed
+        فحص بتعقيد O(1) مع المزامنة من الجدول عند انتهاء الفترة
+        """
+        if jti is None:
+            # Tokens issued before revocation support carry no jti
+            return False
+        now = time.monotonic()
+        if self._last_sync is None or now - self._last_sync >= self.sync_interval:
+            self.sync(now)
+        return jti in self._revoked
+
+    def sync(self, now=None):
+        """
+        Load revocations added since the last sync and forget expired ones
+        تحميل الإلغاءات الجديدة منذ آخر مزامنة وحذف المنتهية
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._last_sync is not None and now - self._last_sync < self.sync_interval:
+                return
+            query = db.session.query(RevokedToken.jti, RevokedToken.expires_at, RevokedToken.revoked_at)\
+                              .filter(RevokedToken.expires_at > datetime.utcnow())
+            if self._newest is not None:
+                query = query.filter(RevokedToken.revoked_at >= self._newest - self.sync_overlap)
+            for jti, expires_at, revoked_at in query.all():
+                self._revoked[jti] = (expires_at - datetime(1970, 1, 1)).total_seconds()
+                if revoked_at is not None and (self._newest is None or revoked_at > self._newest):
+                    self._newest = revoked_at
+            wall = time.time()
+            expired = [jti for jti, exp in self._revoked.items() if exp <= wall]
+            for jti in expired:
+                del self._revoked[jti]
+            self._last_sync = now
+
+    def add(self, jti, exp):
+        with self._lock:
+            self._revoked[jti] = exp
+
+    def revoke(self, claims):
+        """
+        Persist a revocation for the given token claims and apply it locally
+        حفظ إلغاء الرمز وتطبيقه محلياً
+        """
+        jti = claims.get('jti')
+        if not jti:
+            return False
+
+        if not RevokedToken.query.filter_by(jti=jti).first():
+            db.session.add(RevokedToken(
+                jti=jti,
+                user_id=claims['user_id'],
+                user_type=claims['user_type'],
+                expires_at=datetime.utcfromtimestamp(claims['exp'])
+            ))
+            now = time.monotonic()
+            if now - self._last_purge >= self.purge_interval:
+                RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete()
+                self._last_purge = now
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # The same token was revoked concurrently (e.g. a double-clicked logout)
+                db.session.rollback()
+
+        self.add(jti, claims['exp'])
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._revoked.clear()
+            self._newest = None
+            self._last_sync = None
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+revocation_list = RevocationList(
+    sync_interval=float(os.environ.get('REVOCATION_SYNC_INTERVAL', 5)),
+    sync_overlap=float(os.environ.get('REVOCATION_SYNC_OVERLAP', 60))
+)